@@ -2,14 +2,26 @@
 """
 from typing_extensions import Union
 import asyncio
+import warnings
+from functools import wraps
 
 
 def asyncio_db_loop(method):
-    """Decorator for checking that an event loop is present for handling asynchronous callse
+    """Decorator for checking that an event loop is present for handling asynchronous calls
+
+    .. deprecated::
+        fusionDB methods are synchronous and no longer need an event loop, call them directly (or use fusionDB.run_async from a running event loop)
 
     :param method: Function which has asynchronous process
     :type method: None
     """
+    warnings.warn(
+        'asyncio_db_loop is deprecated, fusionDB methods can be called directly (or with fusionDB.run_async from a running event loop)',
+        DeprecationWarning,
+        stacklevel = 2
+    )
+
+    @wraps(method)
     def wrapper(self, *args, **kwargs):
         try:
             loop = asyncio.get_event_loop()
@@ -27,5 +39,3 @@ def asyncio_db_loop(method):
 
 
 
-
-
@@ -26,7 +26,6 @@ import requests
 import time
 import geojson
 
-import asyncio
 
 from skimage.measure import label
 
@@ -47,7 +46,7 @@ from fusion_tools.utils.shapes import (
     path_to_mask, process_filters_queries,
     path_to_indices, indices_to_path
 )
-from fusion_tools import asyncio_db_loop
+from fusion_tools.utils.images import get_region_array
 from fusion_tools.components.base import Tool, MultiTool, BaseSchema, Handler
 
 
@@ -985,6 +984,7 @@ class FeatureAnnotation(Tool):
         slide_data = vis_data['current'][get_pattern_matching_value(slide_selection)]
         new_slide_data = {}
         new_slide_data['regions_url'] = slide_data['regions_url']
+        new_slide_data['regions_array'] = slide_data.get('regions_array')
         new_metadata = requests.get(slide_data['image_metadata_url']).json()
         new_slide_data['x_scale'], new_slide_data['y_scale'] = self.get_scale_factors(new_metadata)
         new_slide_data['name'] = slide_data['name']
@@ -1247,7 +1247,6 @@ class FeatureAnnotation(Tool):
 
         return [structure_options], [new_structure_bboxes], [progress_value], [progress_label], [new_figure]
 
-    @asyncio_db_loop
     def check_database(self, table_name: str = 'annotation', structure_id:Union[str,list,None] = None, user_id:Union[str,list,None] = None, session_id:Union[str,list,None] = None):
         """Check if a user(s) has any annotations for one or more structures
 
@@ -1272,16 +1271,11 @@ class FeatureAnnotation(Tool):
             filters = filters | {'session': {'id': session_id}}
 
 
-        loop = asyncio.get_event_loop()
-        db_annotations = loop.run_until_complete(
-            asyncio.gather(
-                self.database.search(
-                    search_kwargs = {
-                        'type': table_name,
-                        'filters': filters
-                    }
-                )
-            )
+        db_annotations = self.database.search(
+            search_kwargs = {
+                'type': table_name,
+                'filters': filters
+            }
         )
 
         return db_annotations
@@ -1427,7 +1421,7 @@ class FeatureAnnotation(Tool):
             session_id = session_data.get('session',{}).get('id')
         )
         
-        if len(new_anns[0])==0:
+        if len(new_anns)==0:
             updated_annotation_store = json.dumps(
                 {
                     'id': uuid.uuid4().hex[:24],
@@ -1439,14 +1433,14 @@ class FeatureAnnotation(Tool):
             )
         else:
             # datetime isn't JSON serializable
-            last_update = new_anns[0][0].pop('updated')
-            updated_annotation_store = json.dumps(new_anns[0][0])
+            last_update = new_anns[0].pop('updated')
+            updated_annotation_store = json.dumps(new_anns[0])
         
 
         # Updating with current annotation values for selected annotation (from dropdown) and pinned annotation components
         annotations_list, current_names = self.check_annotation_list(session_data)
-        if not len(new_anns[0])==0:
-            prev_ann_values = new_anns[0][0]['data']
+        if not len(new_anns)==0:
+            prev_ann_values = new_anns[0]['data']
             layout_shape_list = []
             for p in prev_ann_values:
                 annotations_list[current_names.index(p.get('name'))]['value'] = p.get('value')
@@ -1739,13 +1733,19 @@ class FeatureAnnotation(Tool):
         ]
 
         #TODO: Update this function for multi-frame images
-        image_region = Image.open(
-            BytesIO(
-                requests.get(
-                    slide_information['regions_url']+f'?left={slide_coordinates[0]}&top={slide_coordinates[1]}&right={slide_coordinates[2]}&bottom={slide_coordinates[3]}'
-                ).content
+        if not slide_information.get('regions_array') is None:
+            region_array = get_region_array(slide_information['regions_array'], slide_coordinates)
+            if not region_array.dtype==np.uint8:
+                region_array = np.uint8(255*(region_array/max(np.max(region_array),1)))
+            image_region = Image.fromarray(np.squeeze(region_array))
+        else:
+            image_region = Image.open(
+                BytesIO(
+                    requests.get(
+                        slide_information['regions_url']+f'?left={slide_coordinates[0]}&top={slide_coordinates[1]}&right={slide_coordinates[2]}&bottom={slide_coordinates[3]}'
+                    ).content
+                )
             )
-        )
 
         return image_region, marker_centroid
     
@@ -2134,7 +2134,7 @@ class FeatureAnnotation(Tool):
                 user_session_list = self.check_database(
                     table_name = 'vis_session',
                     user_id = user_internal_id
-                )[0]
+                )
                 print(user_session_list)
 
                 user_session_dataframe = self.make_dash_table(
@@ -2157,7 +2157,7 @@ class FeatureAnnotation(Tool):
                 # This user can download any/all annotation data from different users/sessions
                 all_users_list = self.check_database(
                     table_name='user'
-                )[0]
+                )
                 print(all_users_list)
 
                 users_dataframe = self.make_dash_table(
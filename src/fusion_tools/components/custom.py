@@ -844,11 +844,14 @@ class CustomFunction(Tool):
         # Scaling feature geometry to original slide CRS (skipping this)
         #feature = geojson.utils.map_geometries(lambda g: geojson.utils.map_tuples(lambda c: (c[0]/slide_information['x_scale'],c[1]/slide_information['y_scale']),g),feature)
         
+        # Reading regions at native dtype in one request if the tile server supports it
+        regions_url = slide_information.get('regions_array',slide_information['regions'])
+
         if return_image and not return_mask:
             feature_mask = None
             feature_image = get_feature_image(
                 feature,
-                slide_information['regions'],
+                regions_url,
                 return_mask = return_mask,
                 return_image = return_image,
                 frame_index = frame_index,
@@ -857,7 +860,7 @@ class CustomFunction(Tool):
         elif return_image and return_mask:
             feature_image, feature_mask = get_feature_image(
                 feature,
-                slide_information['regions'],
+                regions_url,
                 return_mask = return_mask,
                 return_image = return_image,
                 frame_index = frame_index,
@@ -867,7 +870,7 @@ class CustomFunction(Tool):
             feature_image = None
             feature_mask = get_feature_image(
                 feature,
-                slide_information['regions'],
+                regions_url,
                 return_mask = return_mask,
                 return_image = return_image,
                 frame_index = frame_index,
@@ -1176,17 +1179,14 @@ class CustomFunction(Tool):
 
                 slide_annotation_metadata = requests.get(current_slide_information.get('annotations_metadata')).json()
                 for s in slide_annotation_metadata:
-                    intersecting_structure_ids = self.database.get_structures_in_bbox(
+                    intersecting_structures = self.database.get_structures_in_bbox(
                         bbox = main_bounds,
                         item_id = current_slide_information.get('id'),
-                        layer_id = s.get('id')
+                        layer_id = s.get('id'),
+                        ids_only = False
                     )
 
-                    if len(intersecting_structure_ids)>0:
-                        structure_generator = self.database.get_structure_generator(
-                            structure_id = intersecting_structure_ids
-                        )
-
+                    if len(intersecting_structures)>0:
                         intersecting_in_layer = {
                             'type': 'FeatureCollection',
                             'features': [
@@ -1194,11 +1194,11 @@ class CustomFunction(Tool):
                                     'type': 'Feature',
                                     'geometry': geojson.utils.map_geometries(
                                         lambda g: geojson.utils.map_tuples(lambda c: (c[0]-main_bounds[0],c[1] - main_bounds[1]),g),
-                                        f.geom
+                                        f.get('geom')
                                     ),
-                                    'properties': {'id': f.id} | f.properties
+                                    'properties': {'id': f.get('id')} | f.get('properties')
                                 }
-                                for f in structure_generator
+                                for f in intersecting_structures
                             ],
                             'properties': {
                                 'id': s.get('id'),
@@ -1206,7 +1206,7 @@ class CustomFunction(Tool):
                             }
                         }
 
-                        scaled_intersecting_anns.append(s_geo)
+                        scaled_intersecting_anns.append(intersecting_in_layer)
 
                 kwarg_inputs[all_input_names[all_input_types.index('annotation')]] = scaled_intersecting_anns
             
@@ -1016,7 +1016,7 @@ class DataExtractor(Tool):
                             'format': data_format,
                             'folder': self.assets_folder+'/downloads/'+base_download_folder,
                             'features': struct_features,
-                            'tile_url': slide_info['tiles_url'].replace('zxy/{z}/{x}/{y}','region'),
+                            'tile_url': slide_info['regions_array'] if 'regions_array' in slide_info else slide_info['tiles_url'].replace('zxy/{z}/{x}/{y}','region'),
                             'save_masks': 'Masks' in data,
                             'image_opts': image_opts,
                             'mask_opts': data_masks,
@@ -20,7 +20,6 @@ import lxml.etree as ET
 from copy import deepcopy
 
 import threading
-import asyncio
 
 #os.environ['PROTOCOL_BUFFERS_PYTHON_IMPLEMENTATION'] = 'python'
 
@@ -36,7 +35,6 @@ from dash_extensions.enrich import DashBlueprint, html, Input, Output, State, Mu
 from dash_extensions.javascript import assign, arrow_function, Namespace
 
 # fusion-tools imports
-from fusion_tools import asyncio_db_loop
 from fusion_tools.tileserver import LocalTileServer,DSATileServer,CustomTileServer
 from fusion_tools.components.base import MapComponent
 from fusion_tools.utils.shapes import (
@@ -71,7 +69,6 @@ class SlideMap(MapComponent):
 
         self.cache = cache
 
-    @asyncio_db_loop
     def check_slide_in_cache(self, image_id:Union[str,None]=None, user_id: str = None, vis_session_id: str = None):
         """Check if a new slide is present in the database
 
@@ -109,26 +106,20 @@ class SlideMap(MapComponent):
 
         #TODO: Add check for whether an item is in the database but this user just doesn't
         # have access to it
-        loop = asyncio.get_event_loop()
-        db_item = loop.run_until_complete(
-            asyncio.gather(
-                self.database.search(
-                    search_kwargs = {
-                        'type': 'item',
-                        'filters': filter_dict
-                    }
-                )
-            )
+        db_item = self.database.search(
+            search_kwargs = {
+                'type': 'item',
+                'filters': filter_dict
+            }
         )
 
-        return_val = db_item[0].copy()
         if image_id is not None:
-            if len(return_val)==0:
+            if len(db_item)==0:
                 return False
             else:
-                return db_item[0][0]
+                return db_item[0]
         else:
-            return db_item[0]
+            return db_item
 
     def get_image_overlay_popup(self, st, st_idx):
         """Getting popup components for image overlay annotations
@@ -1223,6 +1214,29 @@ class SlideMap(MapComponent):
 
         return new_tile_layer
 
+    def prefetch_slide(self, new_slide: dict):
+        """Asking the LocalTileServer to pre-render low-zoom tiles for a newly opened slide (in the background)
+
+        :param new_slide: Slide information containing urls
+        :type new_slide: dict
+        """
+        if not new_slide.get('item_type')=='local_item' or new_slide.get('prefetch') is None:
+            return
+
+        def request_prefetch(prefetch_url):
+            try:
+                requests.get(prefetch_url, timeout = 10)
+            except requests.exceptions.RequestException:
+                pass
+
+        new_thread = threading.Thread(
+            target = request_prefetch,
+            args = (new_slide.get('prefetch'),),
+            name = uuid.uuid4().hex[:24],
+            daemon = True
+        )
+        new_thread.start()
+
     def update_vis_session(self, new_session_data):
         """Updating slide dropdown options based on current visualization session
 
@@ -1252,7 +1266,8 @@ class SlideMap(MapComponent):
         new_slide = session_data['current'][get_pattern_matching_value(slide_selected)]
 
         new_image_metadata, new_metadata, new_annotations_metadata, new_slide = self.extract_slide_data(new_slide,session_data)
-        
+        self.prefetch_slide(new_slide)
+
         x_scale,y_scale = self.get_scale_factors(new_image_metadata)
         new_slide['x_scale'] = x_scale
         new_slide['y_scale'] = y_scale
@@ -1281,7 +1296,6 @@ class SlideMap(MapComponent):
 
         return new_layer_children, remove_old_edits, new_marker_div, manual_rois, gen_rois, new_tile_layer, new_slide_info, slide_metadata_div
 
-    @asyncio_db_loop
     def get_annotations_backup(self, ann_error_store, session_data):
         """Getting annotations which are cached/if there is an error using JavaScript "fetch" API
 
@@ -1317,17 +1331,11 @@ class SlideMap(MapComponent):
             )
             if ann_error_store.get('cached') and db_item:
                 # Grabbing annotation data from the database:
-                loop = asyncio.get_event_loop()
-                raw_geojson = loop.run_until_complete(
-                    asyncio.gather(
-                        self.database.get_item_annotations(
-                            item_id = ann_error_store.get('id'),
-                            user_id = user_internal_id,
-                            vis_session_id = session_data.get('session').get('id')
-                        )
-                    )
+                raw_geojson = self.database.get_item_annotations(
+                    item_id = ann_error_store.get('id'),
+                    user_id = user_internal_id,
+                    vis_session_id = session_data.get('session').get('id')
                 )
-                raw_geojson = raw_geojson[0]
 
             else:
                 # Use requests to get annotations data
@@ -2110,9 +2118,9 @@ class MultiFrameSlideMap(SlideMap):
 
         super().__init__(cache)
 
-    def process_frames(self,image_metadata,tiles_url):
+    def process_frames(self,image_metadata,tiles_url,composite_url = None):
         """Create BaseLayer and TileLayer components for each of the different frames present in a multi-frame image
-        Also initializes base tile url and styled tile url
+        Also initializes base tile url and styled tile url. If a LocalTileServer composite_url is provided, frames are composited server-side (single-frame layers are single-channel)
         """
 
         frame_layers = []
@@ -2153,6 +2161,19 @@ class MultiFrameSlideMap(SlideMap):
                     else:
                         rgb_url = None
 
+                if not composite_url is None:
+                    # Decoded frames are cached by the LocalTileServer and re-used for each composite
+                    composite_start_str = '&' if '?' in composite_url else '?'
+                    if not rgb_url is None:
+                        rgb_frames = [0,1,2] if len(frame_names)==3 else [frame_names.index(c) for c in ['red','green','blue']]
+                        rgb_url = composite_url+f'{composite_start_str}channels='+json.dumps([
+                            {
+                                "frame": f,
+                                "color": [255 if i==c_idx else 0 for i in range(3)]+[255]
+                            }
+                            for c_idx,f in enumerate(rgb_frames)
+                        ])
+
                 # Pre-determining indices:
                 # For some reason, if you create a new component with the same id index then it doesn't get updated
                 if not rgb_url is None:
@@ -2168,6 +2189,9 @@ class MultiFrameSlideMap(SlideMap):
                     else:
                         frame_url = tiles_url+'?style={"bands": [{"palette":["rgba(0,0,0,0)","rgba(255,255,255,255)"],"framedelta":'+str(f_idx)+'}]}'
 
+                    if not composite_url is None:
+                        frame_url = composite_url+f'{composite_start_str}channels='+json.dumps([{"frame": f_idx}])+'&grayscale=true'
+
                     frame_layers.append(
                         dl.BaseLayer(
                             dl.TileLayer(
@@ -2222,7 +2246,7 @@ class MultiFrameSlideMap(SlideMap):
 
         new_layer_children, new_image_overlays = super().generate_annotation_layers(annotation_metadata, image_metadata, slide_info)
         new_layer_children.extend(
-            self.process_frames(image_metadata, slide_info.get('tiles'))
+            self.process_frames(image_metadata, slide_info.get('tiles'), composite_url = slide_info.get('composite'))
         )
 
         return new_layer_children, new_image_overlays
@@ -2740,7 +2764,8 @@ class HybridSlideMap(MultiFrameSlideMap):
         new_slide = session_data['current'][get_pattern_matching_value(slide_selected)]
 
         new_image_metadata, new_metadata, new_annotations_metadata, new_slide = self.extract_slide_data(new_slide,session_data)
-        
+        self.prefetch_slide(new_slide)
+
         x_scale,y_scale = self.get_scale_factors(new_image_metadata)
         new_slide['x_scale'] = x_scale
         new_slide['y_scale'] = y_scale
@@ -3167,6 +3192,10 @@ class ChannelMixer(MapComponent):
         else:
             rgb_style_dict = None
 
+        if not slide_info.get('composite') is None:
+            # Blending frames on the LocalTileServer using cached frame tiles
+            return self.get_composite_urls(slide_info['composite'], frame_names, style_dict, rgb_style_dict)
+
         styled_urls = []
         for f in frame_names:
             f_dict = {"bands": [
@@ -3197,5 +3226,52 @@ class ChannelMixer(MapComponent):
 
         return styled_urls
 
+    def get_composite_urls(self, composite_url: str, frame_names: list, style_dict: dict, rgb_style_dict: Union[dict,None]):
+        """Converting large-image style bands into LocalTileServer composite tile urls
+
+        :param composite_url: "composite" url for the current slide
+        :type composite_url: str
+        :param frame_names: Names of each frame in the image
+        :type frame_names: list
+        :param style_dict: Style containing bands for the selected overlay channels
+        :type style_dict: dict
+        :param rgb_style_dict: Style containing RGB bands (if present)
+        :type rgb_style_dict: Union[dict,None]
+        :return: List of composite urls (one per frame, then RGB)
+        :rtype: list
+        """
+        if '?' in composite_url:
+            start_str = '&'
+        else:
+            start_str = '?'
+
+        overlay_channels = [
+            {
+                'frame': b['framedelta'],
+                'color': b['palette'][-1]
+            }
+            for b in style_dict['bands']
+        ]
+
+        composite_urls = []
+        for f_idx,f in enumerate(frame_names):
+            composite_urls.append(
+                composite_url+f'{start_str}channels='+json.dumps([{'frame': f_idx}]+overlay_channels)
+            )
+
+        if not rgb_style_dict is None:
+            rgb_channels = [
+                {
+                    'frame': b['framedelta'],
+                    'color': [255 if i==c_idx else 0 for i in range(3)]+[255]
+                }
+                for c_idx,b in enumerate(rgb_style_dict['bands'])
+            ]
+            composite_urls.append(
+                composite_url+f'{start_str}channels='+json.dumps(rgb_channels+overlay_channels)
+            )
+
+        return composite_urls
+
 
 
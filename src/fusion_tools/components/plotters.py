@@ -2094,17 +2094,24 @@ class GlobalPropertyPlotter(MultiTool):
 
         return property_keys, property_names, structure_col, slide_col, bbox_cols
     
-    def get_plottable_data(self, session_data, keys_list, label_keys, structure_list):
-
-        #TODO: Enable database integration here 
-        # Main changes:
-        #   1) Checking cache for items in "current"
-        #   2) Updating "annotation.name" to "layer.name" in cached/local items
-        #   3) Updating "bbox" keys to "bbox.min_x", "bbox.min_y", "bbox.max_x", "bbox.max_y" instead of x0, y0, x1, y1
-
-        # self.database.get_structure_property_data automatically returns 
-        # [*propery_list: numeric or str for each property, structure.id: str, bbox: list, layer.id: str, layer.name: str, item.id: str, item.name: str]
-
+    def get_plottable_data(self, session_data, keys_list, label_keys, structure_list, filters:Union[list,None] = None):
+        """Getting property data for all slides in the current session
+
+        Local slides which are stored in this application's database are queried all at once (with filters applied by the database), other slides are requested individually.
+
+        :param session_data: Current session information
+        :type session_data: dict
+        :param keys_list: Property keys to include
+        :type keys_list: list
+        :param label_keys: Property key used for labels
+        :type label_keys: Union[str,None]
+        :param structure_list: Names of structures to include
+        :type structure_list: Union[list,None]
+        :param filters: Property filters (see parse_filter_divs), defaults to None
+        :type filters: Union[list,None], optional
+        :return: Property data for each structure
+        :rtype: pd.DataFrame
+        """
 
         # Required keys for backwards identification
         req_keys = ['item.name','annotation.name','bbox.x0','bbox.y0','bbox.x1','bbox.y1']
@@ -2117,10 +2124,24 @@ class GlobalPropertyPlotter(MultiTool):
         user_external_token = self.get_user_external_token(session_data)
         user_internal_token = self.get_user_internal_token(session_data)
 
+        database_items = []
+        if not self.database is None:
+            local_ids = [slide.get('id') for slide in session_data['current'] if not slide.get('type')=='remote_item' and 'id' in slide]
+            if len(local_ids)>0:
+                cohort_data = self.database.get_cohort_property_data(
+                    item_id = local_ids,
+                    include_keys = keys_list,
+                    include_anns = structure_list if not structure_list is None and not structure_list==[] else '__all__',
+                    # (filters on properties which aren't plotted are skipped, same as in generate_plot)
+                    filters = [f for f in filters if f.get('name') in keys_list] if not filters is None else None,
+                    user_token = user_internal_token
+                )
+                database_items = cohort_data['items']
+                property_data = pd.DataFrame(columns = cohort_data['columns'], data = cohort_data['data'])
+
         for slide in session_data['current']:
-            if slide.get('cached'):
-                #TODO: Grab data from the local fusionDB instance
-                pass
+            if slide.get('id') in database_items:
+                continue
 
             # Determine whether this is a DSA slide or local
             if slide.get('type')=='remote_item':
@@ -2580,7 +2601,8 @@ class GlobalPropertyPlotter(MultiTool):
                         method: 'GET',
                         headers: { 'Content-Type': 'application/json' },
                         });
-                        return res.json();
+                        // Slides which can't be accessed return 400
+                        return res.ok ? res.json() : [];
                     })
                 );
                 return responses.flat();
@@ -2759,7 +2781,7 @@ class GlobalPropertyPlotter(MultiTool):
             overlap_one = [b for b in bbox_cols if b==label_keys][0]
             bbox_cols[bbox_cols.index(overlap_one)] = label_keys
 
-        plottable_df = self.get_plottable_data(session_data,property_keys,label_keys,structure_names)
+        plottable_df = self.get_plottable_data(session_data,property_keys,label_keys,structure_names,filters)
 
         # Updating with renamed columns from labels
         plottable_df = plottable_df.rename(columns = {k:v for k,v in zip([keys_info['structure_col']],[structure_col])} | {h:q for h,q in zip([keys_info['slide_col']],[slide_col])} | {i:r for i,r in zip(keys_info['bbox_cols'],bbox_cols)})
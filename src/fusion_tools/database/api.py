@@ -20,10 +20,8 @@ from copy import deepcopy
 import numpy as np
 import uvicorn
 
-import asyncio
 
 from shapely.geometry import box, shape
-from fusion_tools import asyncio_db_loop
 from fusion_tools.database.database import fusionDB 
 
 
@@ -42,54 +40,68 @@ class fusionAPI:
         self.router = APIRouter()
 
         # User
-        self.router.add_api_route('/user', lambda: self.get_from_table("user"), methods=["GET"],tags = ['user'])
-        #self.router.add_api_route('/user/me', lambda: self.get_from_table("user"), methods=["GET"],tags = ['user'])
+        self.router.add_api_route('/user', self.table_route("user"), methods=["GET"],tags = ['user'])
+        #self.router.add_api_route('/user/me', self.table_route("user"), methods=["GET"],tags = ['user'])
         self.router.add_api_route('/user/authenticate',self.authenticate, methods = ["GET"],tags=['user'])
-        self.router.add_api_route('/user/{id}', lambda id: self.get_from_table("user",id), methods=["GET"],tags = ['user'])
+        self.router.add_api_route('/user/{id}', self.table_route("user", by_id = True), methods=["GET"],tags = ['user'])
 
         # VisSession 
-        self.router.add_api_route('/vis_session', lambda: self.get_from_table("vis_session"), methods=["GET"], tags = ['vis_session'])
-        self.router.add_api_route('/vis_session/{id}', lambda id: self.get_from_table("vis_session",id), methods=["GET"], tags = ['vis_session'])
+        self.router.add_api_route('/vis_session', self.table_route("vis_session"), methods=["GET"], tags = ['vis_session'])
+        self.router.add_api_route('/vis_session/{id}', self.table_route("vis_session", by_id = True), methods=["GET"], tags = ['vis_session'])
 
         # Item
-        self.router.add_api_route('/item', lambda: self.get_from_table("item"), methods=["GET"],tags=['item'])
-        self.router.add_api_route('/item/{id}', lambda id: self.get_from_table("item",id), methods=["GET"],tags=['item'])
+        self.router.add_api_route('/item', self.table_route("item"), methods=["GET"],tags=['item'])
+        self.router.add_api_route('/item/{id}', self.table_route("item", by_id = True), methods=["GET"],tags=['item'])
 
         # Layer
-        self.router.add_api_route('/layer', lambda: self.get_from_table("layer"), methods=["GET"],tags = ['layer'])
-        self.router.add_api_route('/layer/{id}', lambda id: self.get_from_table("layer",id), methods=["GET"],tags = ['layer'])
+        self.router.add_api_route('/layer', self.table_route("layer"), methods=["GET"],tags = ['layer'])
+        self.router.add_api_route('/layer/{id}', self.table_route("layer", by_id = True), methods=["GET"],tags = ['layer'])
 
         # Structure
-        self.router.add_api_route('/structure', lambda: self.get_from_table("structure"), methods=["GET"],tags = ['structure'])
-        self.router.add_api_route('/structure/{id}', lambda id: self.get_from_table("structure",id), methods=["GET"],tags = ['structure'])
+        self.router.add_api_route('/structure', self.table_route("structure"), methods=["GET"],tags = ['structure'])
+        self.router.add_api_route('/structure/{id}', self.table_route("structure", by_id = True), methods=["GET"],tags = ['structure'])
 
         # ImageOverlay
-        self.router.add_api_route('/image_overlay', lambda: self.get_from_table("image_overlay"), methods=["GET"], tags = ['image_overlay'])
-        self.router.add_api_route('/image_overlay/{id}', lambda id: self.get_from_table("image_overlay",id), methods=["GET"], tags = ['image_overlay'])
+        self.router.add_api_route('/image_overlay', self.table_route("image_overlay"), methods=["GET"], tags = ['image_overlay'])
+        self.router.add_api_route('/image_overlay/{id}', self.table_route("image_overlay", by_id = True), methods=["GET"], tags = ['image_overlay'])
 
         # Annotation
-        self.router.add_api_route('/annotation', lambda: self.get_from_table("annotation"), methods=["GET"], tags = ['annotation'])
-        self.router.add_api_route('/annotation/{id}', lambda id: self.get_from_table("annotation",id), methods=["GET"], tags = ['annotation'])
+        self.router.add_api_route('/annotation', self.table_route("annotation"), methods=["GET"], tags = ['annotation'])
+        self.router.add_api_route('/annotation/{id}', self.table_route("annotation", by_id = True), methods=["GET"], tags = ['annotation'])
 
         # Data
-        self.router.add_api_route('/data', lambda: self.get_from_table("data"), methods=["GET"], tags = ['data'])
-        self.router.add_api_route('/data/{id}', lambda id: self.get_from_table("data",id), methods=["GET"], tags = ['data'])
+        self.router.add_api_route('/data', self.table_route("data"), methods=["GET"], tags = ['data'])
+        self.router.add_api_route('/data/{id}', self.table_route("data", by_id = True), methods=["GET"], tags = ['data'])
 
-    @asyncio_db_loop
-    def search_db(self, search_kwargs, size, offset):
+    def table_route(self, table_name: str, by_id: bool = False):
+        """Creating a route handler for GET requests to a table (passing along the request for query parameters)
+
+        :param table_name: Name of table to GET from
+        :type table_name: str
+        :param by_id: Whether this route includes the id of a specific element, defaults to False
+        :type by_id: bool, optional
+        """
+        if by_id:
+            def get_table_id(id: str, request: Request):
+                return self.get_from_table(table_name, id, request)
+            return get_table_id
+        else:
+            def get_table(request: Request):
+                return self.get_from_table(table_name, request = request)
+            return get_table
+
+    def search_db(self, search_kwargs, size, offset, order = None, after = None, columns = None):
         
-        loop = asyncio.get_event_loop()
-        search_output = loop.run_until_complete(
-            asyncio.gather(
-                self.database.search(
-                    search_kwargs = search_kwargs,
-                    size = size,
-                    offset = offset
-                )
-            )
+        search_output = self.database.search(
+            search_kwargs = search_kwargs,
+            size = size,
+            offset = offset,
+            order = order,
+            after = after,
+            columns = columns
         )
 
-        return search_output[0].copy()
+        return search_output
 
     def get_from_table(self, table_name: str, id: str | None = None, request: Request | None = None) -> list:
         """Getting one or more elements from a specific table in the database
@@ -105,13 +117,23 @@ class fusionAPI:
         token = None
         size = None
         offset = 0
+        order = None
+        after = None
+        columns = None
         if not request is None:
             if request.query_params.get('token'):
                 token = request.query_params.get('token')
             if request.query_params.get('size'):
-                size = request.query_params.get('size')
+                size = int(request.query_params.get('size'))
             if request.query_params.get('offset'):
-                offset = request.query_params.get('offset')
+                offset = int(request.query_params.get('offset'))
+            if request.query_params.get('order'):
+                order = request.query_params.get('order').split(',')
+            if request.query_params.get('after'):
+                # Keyset pagination, id of the last element on the previous page
+                after = request.query_params.get('after')
+            if request.query_params.get('columns'):
+                columns = request.query_params.get('columns').split(',')
 
         if not token is None:
             user_filter = {
@@ -134,10 +156,13 @@ class fusionAPI:
         search_output = self.search_db(
             search_kwargs = {
                 'type': table_name,
-                'filter': id_filter | user_filter 
+                'filters': id_filter | user_filter 
             },
             size = size,
-            offset = offset
+            offset = offset,
+            order = order,
+            after = after,
+            columns = columns
         )
 
         return search_output
@@ -3,16 +3,26 @@
 Structure schemas for different items in SQLite database
 
 """
+import os
 import json
+import hashlib
+import asyncio
 import uuid
 import time
 import bcrypt
+import threading
+import warnings
 
-from datetime import datetime
+from itertools import groupby
+from functools import partial
+
+from concurrent.futures import ThreadPoolExecutor
+
+from datetime import datetime, timedelta
 
 from sqlalchemy import (
-    not_, or_, and_, func, select, insert, event, union_all, create_engine, update, exc,
-    Column, String, Boolean,ForeignKey, JSON, text)
+    not_, or_, and_, false, case, func, select, insert, event, union_all, create_engine, update, exc,
+    Column, String, Boolean,ForeignKey, JSON, text, inspect, type_coerce, LargeBinary, literal_column, cast, Integer)
 from sqlalchemy.orm import (
     declarative_base, sessionmaker, 
     mapped_column, Session, scoped_session,
@@ -21,7 +31,7 @@ from sqlalchemy.orm import (
 from sqlalchemy.pool import NullPool
 
 from typing import Generator
-from contextlib import contextmanager
+from contextlib import contextmanager, nullcontext
 from shapely.geometry import box, shape
 
 from typing_extensions import Union
@@ -30,9 +40,15 @@ from .models import (
     Base, User, UserAccess, 
     VisSession, Item, Layer, 
     LocalItem, RemoteItem,
-    Structure, ImageOverlay, Annotation,
-    Data
+    Structure, StructureRTree, ImageOverlay, Annotation,
+    Data, PropertyCatalog, encode_geometry, 
+    geometry_to_shape, decode_geometry
 )
+from .property_store import (
+    PropertyStore, pyarrow, STRUCTURE_ID_COLUMN, BBOX_COLUMNS,
+    get_column_stats, get_column_histogram, get_column_counts, is_numeric_range
+)
+from fusion_tools.utils.shapes import extract_nested_prop, extract_listed_prop
 
 
 TABLE_NAMES = {
@@ -46,19 +62,322 @@ TABLE_NAMES = {
     'structure': Structure,
     'image_overlay': ImageOverlay,
     'annotation': Annotation,
-    'data': Data
+    'data': Data,
+    'property_catalog': PropertyCatalog
+}
+
+
+def get_geom_bounds(geom:Union[dict,None]) -> dict:
+    """Getting the bounding box columns (minx, miny, maxx, maxy) for a GeoJSON geometry
+
+    :param geom: GeoJSON geometry
+    :type geom: Union[dict,None]
+    :return: Dictionary containing minx, miny, maxx, and maxy (None if the geometry has no coordinates)
+    :rtype: dict
+    """
+    bounds = {'minx': None, 'miny': None, 'maxx': None, 'maxy': None}
+    if geom is None:
+        return bounds
+
+    if geom.get('type')=='GeometryCollection':
+        coord_list = [g.get('coordinates') for g in geom.get('geometries',[])]
+    else:
+        coord_list = [geom.get('coordinates')]
+
+    xs, ys = [], []
+    while len(coord_list)>0:
+        c = coord_list.pop()
+        if c is None or len(c)==0:
+            continue
+        if type(c[0]) in [int,float]:
+            xs.append(c[0])
+            ys.append(c[1])
+        else:
+            coord_list.extend(c)
+
+    if len(xs)>0:
+        bounds = {'minx': min(xs), 'miny': min(ys), 'maxx': max(xs), 'maxy': max(ys)}
+
+    return bounds
+
+
+def get_geom_columns(geom:Union[dict,None], geometry_format:str = 'json') -> dict:
+    """Getting the stored geometry along with the bounding box and centroid columns for a GeoJSON geometry
+
+    :param geom: GeoJSON geometry
+    :type geom: Union[dict,None]
+    :param geometry_format: Storage format for the geometry, either "json" or "wkb", defaults to "json"
+    :type geometry_format: str, optional
+    :return: Dictionary containing geom, minx, miny, maxx, maxy, centroid_x, and centroid_y
+    :rtype: dict
+    """
+    geom_columns = {'geom': encode_geometry(geom, geometry_format), 'centroid_x': None, 'centroid_y': None} | get_geom_bounds(geom)
+    if not geom_columns.get('minx') is None:
+        try:
+            centroid = shape(geom).centroid
+            if not centroid.is_empty:
+                geom_columns['centroid_x'] = centroid.x
+                geom_columns['centroid_y'] = centroid.y
+        except Exception:
+            # Geometries that shapely can't read still get bounds
+            pass
+
+    return geom_columns
+
+
+def get_property_catalog(property_list:list, cardinality_limit:int = 1000, nested_depth:int = 4) -> dict:
+    """Summarizing the properties of a list of structures (key paths, types, counts, ranges, and unique values)
+
+    :param property_list: List of structure properties dictionaries
+    :type property_list: list
+    :param cardinality_limit: Maximum number of unique values stored for each property, defaults to 1000
+    :type cardinality_limit: int, optional
+    :param nested_depth: Depth of nested properties to include, defaults to 4
+    :type nested_depth: int, optional
+    :return: Dictionary with one entry per property key path
+    :rtype: dict
+    """
+    property_catalog = {}
+    for f_props in property_list:
+        if f_props is None:
+            continue
+
+        for p,v in f_props.items():
+            if type(v)==dict:
+                values_list = extract_nested_prop({p: v}, nested_depth, (), [])
+            elif type(v)==list:
+                values_list = extract_listed_prop(v, (p,), [])
+            elif type(v) in [int,float,str]:
+                values_list = [{p: v}]
+            else:
+                continue
+
+            for val in values_list:
+                for v_key, v_val in val.items():
+                    if not v_key in property_catalog:
+                        property_catalog[v_key] = {
+                            'dtype': 'number',
+                            'count': 0,
+                            'min': None,
+                            'max': None,
+                            'distinct': set()
+                        }
+
+                    v_info = property_catalog[v_key]
+                    v_info['count'] += 1
+                    if type(v_val) in [int,float]:
+                        if v_info['min'] is None or v_val<v_info['min']:
+                            v_info['min'] = v_val
+                        if v_info['max'] is None or v_val>v_info['max']:
+                            v_info['max'] = v_val
+                    else:
+                        v_info['dtype'] = 'string'
+
+                    if not v_info['distinct'] is None:
+                        v_info['distinct'].add(v_val)
+                        if len(v_info['distinct'])>cardinality_limit:
+                            v_info['distinct'] = None
+
+    for v_info in property_catalog.values():
+        if not v_info['distinct'] is None:
+            v_info['distinct'] = sorted(v_info['distinct'], key = lambda i: (type(i)==str, i))
+            v_info['distinct_count'] = len(v_info['distinct'])
+        else:
+            v_info['distinct_count'] = None
+
+    return property_catalog
+
+
+# Structure filter keys which aren't properties
+FILTER_COLUMNS = {
+    'bbox.x0': Structure.minx,
+    'bbox.y0': Structure.miny,
+    'bbox.x1': Structure.maxx,
+    'bbox.y1': Structure.maxy,
+    'layer.id': Layer.id,
+    'layer.name': Layer.name,
+    'item.id': Item.id,
+    'item.name': Item.name
 }
 
 
+def get_property_filter(filters:list):
+    """SQL filter expression for structure property filters, structures must pass all "and"/"not" filters, "or" filters are only used if there aren't any "and"/"not" filters
+
+    Numeric ranges match values as numbers, lists of values match string values to the strings and numeric values to the numbers in the list. Structures without a property only pass "not" filters on it.
+
+    :param filters: List of dictionaries containing "name" (property key path or a key in FILTER_COLUMNS), "range" (numeric range or list of values), and "mod" ("and", "or", or "not")
+    :type filters: list
+    :return: SQL filter expression on Structure (joined with Layer and Item)
+    """
+    def filter_condition(f):
+        if f['name'] in FILTER_COLUMNS:
+            column = FILTER_COLUMNS[f['name']]
+            number_column, string_column = column, column
+        else:
+            column = Structure.properties[f['name'].split(' --> ')]
+            number_column, string_column = column.as_float(), column.as_string()
+
+        if is_numeric_range(f['range']):
+            condition = number_column.between(f['range'][0], f['range'][1])
+        else:
+            string_values = [r for r in f['range'] if type(r)==str]
+            number_values = [r for r in f['range'] if type(r) in [int,float]]
+            condition = or_(
+                string_column.in_(string_values) if len(string_values)>0 else false(),
+                number_column.in_(number_values) if len(number_values)>0 else false()
+            )
+
+        if f.get('mod')=='not':
+            # (JSON values are compared after extraction, a JSON null is also missing)
+            condition = or_(string_column.is_(None), not_(condition))
+
+        return condition
+
+    and_filters = [f for f in filters if f.get('mod') in ['and','not']]
+    if len(and_filters)>0:
+        return and_(*[filter_condition(f) for f in and_filters])
+
+    or_filters = [f for f in filters if f.get('mod')=='or']
+    if len(or_filters)>0:
+        return or_(*[filter_condition(f) for f in or_filters])
+
+    return None
+
+
+def get_source_hash(sources:list) -> str:
+    """Hashing the sources that an item is created from, files are identified by path, size, and modification time while other sources (dictionaries, lists, etc.) are hashed by content
+
+    :param sources: List of file paths and/or objects (annotations, metadata, etc.)
+    :type sources: list
+    :return: Hex digest
+    :rtype: str
+    """
+    source_hash = hashlib.sha1()
+    for src in sources:
+        if type(src)==str and os.path.exists(src):
+            src_stat = os.stat(src)
+            src = ['file',os.path.abspath(src),src_stat.st_size,src_stat.st_mtime_ns]
+        elif type(src)==list:
+            # Lists can contain file paths (ex: multiple annotation files)
+            src = [get_source_hash([i]) for i in src]
+        elif hasattr(src,'to_dict'):
+            src = src.to_dict()
+
+        source_hash.update(json.dumps(src, sort_keys = True, default = str).encode())
+
+    return source_hash.hexdigest()
+
+
+class AccessCache:
+    """Thread-safe in-process cache for access control lookups (readable item ids per user token, item records), entries expire after ttl seconds
+
+    Each invalidation starts a new generation, values read from the database before an invalidation aren't stored after it.
+    """
+    def __init__(self, ttl:Union[int,float,None] = 30):
+        """Constructor method
+
+        :param ttl: Seconds before a cached entry is looked up again (None or 0 disables caching), defaults to 30
+        :type ttl: Union[int,float,None], optional
+        """
+        self.ttl = ttl
+        self.entries = {}
+        self.lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.generation = 0
+
+    def get(self, key):
+        """Getting a cached value (None if it isn't present or has expired)
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+            if not entry is None and time.monotonic() < entry[0]:
+                self.hits += 1
+                return entry[1]
+
+            self.misses += 1
+            return None
+
+    def set(self, key, value, generation:Union[int,None] = None):
+        """Storing a value
+
+        :param generation: Cache generation read before value was looked up (value is dropped if the cache was invalidated since then), defaults to None (always stored)
+        :type generation: Union[int,None], optional
+        """
+        if not self.ttl:
+            return
+
+        with self.lock:
+            if generation is None or generation==self.generation:
+                self.entries[key] = (time.monotonic()+self.ttl, value)
+
+    def invalidate(self):
+        """Removing all cached entries (called whenever users, items, or access change)
+        """
+        with self.lock:
+            self.entries.clear()
+            self.invalidations += 1
+            self.generation += 1
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                'entries': len(self.entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'invalidations': self.invalidations
+            }
+
+
+# Tables which change what a user can access
+ACCESS_TABLES = ['user','user_access','item','local_item','remote_item']
+
+
 #TODO: add access check to UserAccess table for any query that mentions data from an item
 # This includes Item, Layer, Structure, ImageOverlay, and Annotation elements
 # either user_id or user_token can be used to identify a user, though user_id is a column in UserAccess
 
 
+# (Re)building the structure R*Tree index from structure bounding boxes
+SPATIAL_INDEX_FILL = [
+    'DELETE FROM structure_rtree',
+    'INSERT INTO structure_rtree SELECT rowid, minx, maxx, miny, maxy FROM structure WHERE minx IS NOT NULL'
+]
+
 class fusionDB:
     def __init__(self,
                  db_url:str,
-                 echo:bool = False):
+                 echo:bool = False,
+                 geometry_format:str = 'json',
+                 property_store_dir:Union[str,None] = None,
+                 async_workers:int = 4,
+                 access_ttl:Union[int,float,None] = 30,
+                 maintenance_interval:Union[int,float,None] = None,
+                 session_retention:Union[dict,None] = None):
+        """Database for items, layers, structures, users, and visualization sessions
+
+        :param db_url: SQLAlchemy database url
+        :type db_url: str
+        :param echo: Whether to log SQL statements, defaults to False
+        :type echo: bool, optional
+        :param geometry_format: Storage format for structure geometries, either "json" or "wkb" (smaller and faster to read for spatial queries), defaults to "json"
+        :type geometry_format: str, optional
+        :param property_store_dir: Directory for columnar (Parquet) structure property files (requires pyarrow), defaults to None (next to the database file for SQLite)
+        :type property_store_dir: Union[str,None], optional
+        :param async_workers: Number of threads used by the async (*_async) methods, defaults to 4
+        :type async_workers: int, optional
+        :param access_ttl: Seconds that readable item ids for each user and item records are cached for access checks (cleared whenever users, items, or access change), defaults to 30
+        :type access_ttl: Union[int,float,None], optional
+        :param maintenance_interval: Seconds between background maintenance runs (see compact), defaults to None (no scheduled maintenance)
+        :type maintenance_interval: Union[int,float,None], optional
+        :param session_retention: Retention policy for visualization sessions and guest users, dictionary containing "interval" (seconds between sweeps, defaults to 600) and any arguments to expire_sessions ("max_age", "max_sessions", "guest_only"), defaults to None (sessions are kept)
+        :type session_retention: Union[dict,None], optional
+        """
+        assert geometry_format in ['json','wkb']
+        self.geometry_format = geometry_format
         
         self.engine = create_engine(
             db_url,
@@ -70,8 +389,54 @@ class fusionDB:
             pool_recycle=3600
         )
 
+        if self.engine.dialect.name=='sqlite':
+            # New database files release pages freed by deletions with "PRAGMA incremental_vacuum" (existing files switch over on the next full compact)
+            event.listen(self.engine, 'connect', lambda dbapi_connection, connection_record: dbapi_connection.execute('PRAGMA auto_vacuum = INCREMENTAL'))
+
         Base.metadata.create_all(bind = self.engine)
         self.SessionLocal = scoped_session(sessionmaker(bind=self.engine))
+        self.SessionStream = sessionmaker(bind=self.engine)
+
+        # Access checks for every tile/annotation request are resolved from this cache, it is cleared once a write to an access table is committed
+        self.access_cache = AccessCache(ttl = access_ttl)
+        for session_factory in [self.SessionLocal, self.SessionStream]:
+            event.listen(session_factory, 'after_flush', self.check_access_flush)
+            event.listen(session_factory, 'do_orm_execute', self.check_access_execute)
+            event.listen(session_factory, 'after_commit', self.check_access_commit)
+            event.listen(session_factory, 'after_rollback', lambda session: session.info.pop('access_changed',None))
+
+        # Async methods (used by the tile server) run the synchronous queries on these threads so they don't block the event loop
+        self.async_executor = ThreadPoolExecutor(max_workers = async_workers, thread_name_prefix = 'fusionDB')
+
+        # SQLite only allows one writer at a time, bulk writes from multiple threads are serialized here
+        self.write_lock = threading.Lock() if self.engine.dialect.name=='sqlite' else nullcontext()
+
+        # Structures are returned in the order they were added (rowid for SQLite)
+        self.structure_order = literal_column('structure.rowid') if self.engine.dialect.name=='sqlite' else Structure.id
+
+        # Structure properties are also saved column-wise per layer so that plotting/stats only read the requested properties
+        self.property_store = None
+        if not pyarrow is None:
+            db_file = self.engine.url.database
+            if property_store_dir is None and self.engine.dialect.name=='sqlite' and not db_file in [None,'',':memory:']:
+                property_store_dir = f'{os.path.splitext(os.path.abspath(db_file))[0]}_properties'
+
+            if not property_store_dir is None:
+                self.property_store = PropertyStore(property_store_dir)
+
+        # Adding new structure columns to databases created by previous versions (also creates the spatial index)
+        self.spatial_index = False
+        self.migrate_structures()
+
+        # Background tasks (name: (thread, stop event))
+        self.periodic_tasks = {}
+        if not maintenance_interval is None:
+            self.start_maintenance(maintenance_interval)
+
+        # Sessions which are never expired (ex: the session created when a Visualization starts)
+        self.retained_sessions = set()
+        if not session_retention is None:
+            self.start_session_expiry(**session_retention)
 
         """
         # Not sure how to add this as an automatic filterer, this will prevent non-public Items from being available on "select" statements
@@ -88,9 +453,10 @@ class fusionDB:
         """
 
     @contextmanager
-    def get_db(self) -> Generator[Session, None, None]:
+    def get_db(self, stream: bool = False) -> Generator[Session, None, None]:
         # Generator type has types, yield, send, return (in this case it yields a Session, sends None and returns None)
-        db: Session = self.SessionLocal()
+        # Streaming generators get their own (non thread-local) session so that other queries made while they are suspended don't close their cursor
+        db: Session = self.SessionLocal() if not stream else self.SessionStream()
         try:
             yield db
             db.commit()
@@ -100,6 +466,165 @@ class fusionDB:
         finally:
             db.close()
 
+    def check_access_flush(self, session, flush_context):
+        """Marking a session's transaction as changing access if users or items were added, changed, or deleted in this flush
+        """
+        if any([isinstance(obj,(User,Item)) for obj in list(session.new)+list(session.dirty)+list(session.deleted)]):
+            session.info['access_changed'] = True
+
+    def check_access_execute(self, orm_execute_state):
+        """Marking a session's transaction as changing access for insert/update/delete statements on access tables
+        """
+        if orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete:
+            statement_table = getattr(orm_execute_state.statement,'table',None)
+            if getattr(statement_table,'name',None) in ACCESS_TABLES:
+                orm_execute_state.session.info['access_changed'] = True
+
+    def check_access_commit(self, session):
+        """Clearing the access cache after a transaction which changed access is committed (before then other connections still read the previous access)
+        """
+        if session.info.pop('access_changed',False):
+            self.access_cache.invalidate()
+
+    async def run_async(self, method, *args, **kwargs):
+        """Running a synchronous database method from a running event loop without blocking it
+
+        :param method: fusionDB method (or any callable)
+        :type method: callable
+        :return: Output of method(*args, **kwargs)
+        """
+        return await asyncio.get_running_loop().run_in_executor(
+            self.async_executor,
+            partial(method, *args, **kwargs)
+        )
+
+    def migrate_structures(self, convert_geometry:bool = False, chunk_size:int = 5000) -> int:
+        """Adding bounding box/centroid columns (and their indexes) to existing structure tables, adding item source hashes, user guest flags, and access control indexes, filling them in for structures which don't have them, and building missing property catalogs/property store files
+
+        :param convert_geometry: Whether to re-encode all stored geometries using the current geometry_format, defaults to False
+        :type convert_geometry: bool, optional
+        :param chunk_size: Number of structures updated at a time, defaults to 5000
+        :type chunk_size: int, optional
+        :return: Number of structures updated
+        :rtype: int
+        """
+        structure_columns = [c.get('name') for c in inspect(self.engine).get_columns('structure')]
+        with self.engine.begin() as connection:
+            for c in ['minx','miny','maxx','maxy','centroid_x','centroid_y']:
+                if not c in structure_columns:
+                    connection.execute(text(f'ALTER TABLE structure ADD COLUMN {c} FLOAT'))
+
+            if not 'source_hash' in [c.get('name') for c in inspect(self.engine).get_columns('item')]:
+                connection.execute(text('ALTER TABLE item ADD COLUMN source_hash VARCHAR'))
+
+            if not 'guest' in [c.get('name') for c in inspect(self.engine).get_columns('user')]:
+                connection.execute(text('ALTER TABLE "user" ADD COLUMN guest BOOLEAN'))
+                # Guest users created before they were marked (Visualization guest user ids start with "guestuser")
+                connection.execute(update(User).where(User.id.like('guestuser%'), User.password.is_(None)).values(guest = True))
+
+            for table in [Structure.__table__, User.__table__, UserAccess]:
+                for idx in table.indexes:
+                    idx.create(bind = connection, checkfirst = True)
+
+        # Building property catalogs for layers added before the catalog existed
+        with self.get_db() as session:
+            uncataloged_layers = session.execute(
+                select(Layer.id, Layer.item).where(
+                    select(Structure.id).where(Structure.layer==Layer.id).exists(),
+                    ~select(PropertyCatalog.id).where(PropertyCatalog.layer==Layer.id).exists()
+                )
+            ).all()
+            for layer_id, item_id in uncataloged_layers:
+                self.update_property_catalog(
+                    layer_id = layer_id,
+                    item_id = item_id,
+                    property_catalog = get_property_catalog(
+                        session.scalars(select(Structure.properties).where(Structure.layer==layer_id)).all()
+                    ),
+                    session = session
+                )
+
+        n_updated = 0
+        last_id = ''
+        with self.write_lock:
+            with self.get_db() as session:
+                while True:
+                    migrate_query = select(
+                        Structure.id,
+                        type_coerce(Structure.geom, LargeBinary)
+                    ).where(Structure.id > last_id)
+
+                    if not convert_geometry:
+                        migrate_query = migrate_query.where(Structure.minx.is_(None), Structure.geom.is_not(None))
+
+                    structure_rows = session.execute(migrate_query.order_by(Structure.id).limit(chunk_size)).all()
+                    if len(structure_rows)==0:
+                        break
+
+                    session.execute(
+                        update(Structure),
+                        [
+                            {'id': i[0]} | get_geom_columns(decode_geometry(i[1]), self.geometry_format)
+                            for i in structure_rows
+                        ]
+                    )
+
+                    n_updated += len(structure_rows)
+                    last_id = structure_rows[-1][0]
+
+        if not self.property_store is None:
+            with self.get_db() as session:
+                stored_layers = session.scalars(
+                    select(Layer.id).where(select(Structure.id).where(Structure.layer==Layer.id).exists())
+                ).all()
+
+            for layer_id in stored_layers:
+                if not self.property_store.has_layer(layer_id):
+                    self.update_property_store(layer_id)
+
+        self.create_spatial_index()
+
+        return n_updated
+
+    def create_spatial_index(self) -> bool:
+        """Creating the R*Tree index on structure bounding boxes (SQLite only) and the triggers keeping it in sync with the structure table, bounding box queries then only visit structures near the requested region
+
+        :return: Whether the spatial index is available (False for other databases or SQLite builds without R*Tree)
+        :rtype: bool
+        """
+        if not self.engine.dialect.name=='sqlite':
+            self.spatial_index = False
+            return self.spatial_index
+
+        try:
+            with self.write_lock:
+                with self.engine.begin() as connection:
+                    if not inspect(connection).has_table('structure_rtree'):
+                        connection.execute(text('CREATE VIRTUAL TABLE structure_rtree USING rtree(id, minx, maxx, miny, maxy)'))
+                        for statement in SPATIAL_INDEX_FILL:
+                            connection.execute(text(statement))
+
+                    connection.execute(text(
+                        'CREATE TRIGGER IF NOT EXISTS structure_rtree_insert AFTER INSERT ON structure WHEN new.minx IS NOT NULL BEGIN '
+                        'INSERT INTO structure_rtree VALUES (new.rowid, new.minx, new.maxx, new.miny, new.maxy); END'
+                    ))
+                    connection.execute(text(
+                        'CREATE TRIGGER IF NOT EXISTS structure_rtree_update AFTER UPDATE OF minx, maxx, miny, maxy ON structure BEGIN '
+                        'DELETE FROM structure_rtree WHERE id = old.rowid; '
+                        'INSERT INTO structure_rtree SELECT new.rowid, new.minx, new.maxx, new.miny, new.maxy WHERE new.minx IS NOT NULL; END'
+                    ))
+                    connection.execute(text(
+                        'CREATE TRIGGER IF NOT EXISTS structure_rtree_delete AFTER DELETE ON structure BEGIN '
+                        'DELETE FROM structure_rtree WHERE id = old.rowid; END'
+                    ))
+            self.spatial_index = True
+        except exc.OperationalError:
+            # SQLite compiled without the R*Tree module, bounding box queries fall back to the structure bbox indexes
+            self.spatial_index = False
+
+        return self.spatial_index
+
+
     def get_uuid(self):
         return uuid.uuid4().hex[:24]
     
@@ -159,13 +684,16 @@ class fusionDB:
                         self.add(get_create_result, session)
                     else:
                         # This is if this thing DOES exist in the table, update
+                        # (setting attributes on the instance so joined-inheritance tables like local_item are updated correctly)
                         updated = datetime.now()
+                        update_kwargs = kwargs | {'updated': updated}
+                        for k,v in update_kwargs.items():
+                            setattr(get_create_result,k,v)
+
                         get_create_result = TABLE_NAMES.get(table_name)(
                             id = inst_id,
-                            **kwargs | {'updated': updated}
+                            **update_kwargs
                         )
-                        update_kwargs = kwargs | {'updated': updated}
-                        session.execute(update(TABLE_NAMES.get(table_name)).where(getattr(TABLE_NAMES.get(table_name),'id')==inst_id).values(update_kwargs))
                 
                 else:
                     new_id = self.get_uuid()
@@ -186,50 +714,307 @@ class fusionDB:
     def get_remove(self, table_name:str, inst_id:Union[str,None] = None, user_id: Union[str,None] = None, vis_session_id: Union[str,None] = None):
         """The opposite of self.get_create, checks if an item is present in the table and if it is, deletes it.
 
+        Rows are deleted with set-based statements, removing an item or layer also removes everything that belongs to it (see delete_items and delete_layers).
+
         :param table_name: Name of table that the instance belongs to
         :type table_name: str
         :param inst_id: A unique id assigned to the instance, defaults to None
         :type inst_id: Union[str,None], optional
-        :return: Returns True if the removal was successful/the table name exists and that instance is in the table
+        :param user_id: Only remove the instance if it belongs to this user (items this user has access to or which were added in one of their sessions, or anything in those items), defaults to None
+        :type user_id: Union[str,None], optional
+        :param vis_session_id: Only remove the instance if it belongs to this session (items added in this session, excluding items ingested from local sources, or anything in those items), defaults to None
+        :type vis_session_id: Union[str,None], optional
+        :return: Number of instances removed (None if the table doesn't exist, 0 if the table can't be checked for this user/session)
+        :rtype: Union[int,None]
         """
+        if not table_name in TABLE_NAMES:
+            return None
+
+        # Don't delete anything if no instance id is provided
+        if inst_id is None:
+            return 0
+
+        table = TABLE_NAMES.get(table_name)
+        # Items are owned through UserAccess/VisSession, tables without their own "user"/"session" column are owned through their item
+        item_column = table.id if table_name in ['item','local_item','remote_item'] else getattr(table,'item',None)
+
+        remove_query = select(table.id).where(table.id==inst_id)
+        if not user_id is None:
+            if hasattr(table,'user'):
+                remove_query = remove_query.where(table.user==user_id)
+            elif table_name=='user':
+                remove_query = remove_query.where(table.id==user_id)
+            elif not item_column is None:
+                remove_query = remove_query.where(
+                    or_(
+                        item_column.in_(select(UserAccess.c.item_id).where(UserAccess.c.user_id==user_id)),
+                        item_column.in_(select(Item.id).where(Item.session.in_(select(VisSession.id).where(VisSession.user==user_id))))
+                    )
+                )
+            else:
+                return 0
+
+        if not vis_session_id is None:
+            if hasattr(table,'session') and not table_name in ['item','local_item','remote_item']:
+                remove_query = remove_query.where(table.session==vis_session_id)
+            elif table_name=='vis_session':
+                remove_query = remove_query.where(table.id==vis_session_id)
+            elif not item_column is None:
+                # Items ingested from local sources (source_hash) are kept when a session's items are cleaned up
+                remove_query = remove_query.where(
+                    item_column.in_(select(Item.id).where(Item.session==vis_session_id, Item.source_hash.is_(None)))
+                )
+            else:
+                return 0
+
         with self.get_db() as session:
-            if table_name in TABLE_NAMES:
-                if not inst_id is None:
-                    get_remove_result = session.query(
-                        TABLE_NAMES.get(table_name)
-                    ).filter_by(id = inst_id)
+            remove_ids = session.scalars(remove_query).all()
 
-                    if not get_remove_result:
-                        #print("Instance not present in db")
-                        # If this thing isn't in the table, don't do anything
-                        pass
-                    else:
-                        # This is if this thing DOES exist in the table, remove it
-                        if not user_id is None:
-                            get_remove_result = get_remove_result.filter(
-                                getattr(TABLE_NAMES.get(table_name),'user')==user_id
-                            )
-
-                        if not vis_session_id is None:
-                            get_remove_result = get_remove_result.filter(
-                                getattr(TABLE_NAMES.get(table_name),'session')==vis_session_id
-                            )
-
-                        if get_remove_result:
-                            for r in get_remove_result.all():
-                                self.remove(r,session)
-                        else:
-                            #print('Not found for this user/vis_session')
-                            pass
+        if table_name in ['item','local_item','remote_item']:
+            return self.delete_items(remove_ids)
+        elif table_name=='layer':
+            return self.delete_layers(remove_ids)
+        elif len(remove_ids)==0:
+            return 0
+
+        with self.write_lock:
+            with self.get_db() as session:
+                if table_name=='structure':
+                    structure_layers = session.scalars(select(Structure.layer).where(Structure.id.in_(remove_ids)).distinct()).all()
+                    for ref_table in [Annotation, Data]:
+                        session.execute(ref_table.__table__.delete().where(ref_table.structure.in_(remove_ids)))
+                elif table_name=='user':
+                    session.execute(UserAccess.delete().where(UserAccess.c.user_id.in_(remove_ids)))
+
+                n_removed = session.execute(table.__table__.delete().where(table.id.in_(remove_ids))).rowcount
+
+        if table_name=='structure':
+            # Keeping the property summaries for these layers up to date
+            for layer_id in structure_layers:
+                layer_rows = self.get_layer_property_rows(layer_id)
+                with self.get_db() as session:
+                    item_id = session.scalar(select(Layer.item).where(Layer.id==layer_id))
+                self.update_property_catalog(layer_id, item_id, get_property_catalog([r['properties'] for r in layer_rows]))
+                self.update_property_store(layer_id, layer_rows)
+
+        return n_removed
+
+    def update_structure_stats(self):
+        """Updating query planner statistics for the structure table after structures are added (SQLite only), without statistics SQLite prefers the layer/item indexes over the spatial index for bounding box queries
+
+        Statistics are estimated from a sample of each index (analysis_limit) so the cost doesn't grow with the size of the table.
+        """
+        if not self.engine.dialect.name=='sqlite':
+            return
+
+        with self.write_lock:
+            with self.engine.connect().execution_options(isolation_level = 'AUTOCOMMIT') as connection:
+                connection.connection.driver_connection.executescript('PRAGMA analysis_limit = 1000; ANALYZE structure;')
+
+        self.reload_statistics()
+
+    def reload_statistics(self):
+        """SQLite only loads query planner statistics when a connection is opened, so pooled connections are replaced after ANALYZE (connections in use are closed when they are returned)
+        """
+        if not self.engine.url.database in [None,'',':memory:']:
+            self.engine.dispose()
+
+    def compact(self, full:bool = False) -> dict:
+        """Database maintenance, updating query planner statistics (ANALYZE) and returning free pages left by deletions to the filesystem (SQLite only)
+
+        :param full: Whether to rebuild the whole database file (VACUUM, slower and blocks writes), otherwise only free pages are released (incremental vacuum), defaults to False
+        :type full: bool, optional
+        :return: Dictionary containing "file_size" before and after and "free_pages" remaining
+        :rtype: dict
+        """
+        if not self.engine.dialect.name=='sqlite':
+            with self.engine.connect().execution_options(isolation_level = 'AUTOCOMMIT') as connection:
+                connection.execute(text('ANALYZE'))
+            return {}
+
+        db_file = self.engine.url.database
+        get_size = lambda: os.path.getsize(db_file) if not db_file in [None,'',':memory:'] and os.path.exists(db_file) else None
+
+        compact_stats = {'file_size_before': get_size()}
+        with self.write_lock:
+            with self.engine.connect().execution_options(isolation_level = 'AUTOCOMMIT') as connection:
+                auto_vacuum = connection.execute(text('PRAGMA auto_vacuum')).scalar()
+                if full or not auto_vacuum==2:
+                    # Incremental vacuum needs auto_vacuum = INCREMENTAL, which only applies to existing databases after a full VACUUM
+                    connection.execute(text('PRAGMA auto_vacuum = INCREMENTAL'))
+                    connection.execute(text('VACUUM'))
+                    if self.spatial_index:
+                        # VACUUM can renumber structure rowids (no INTEGER PRIMARY KEY), the R*Tree is rebuilt in one transaction
+                        connection.connection.driver_connection.executescript(f'BEGIN; {"; ".join(SPATIAL_INDEX_FILL)}; COMMIT;')
                 else:
-                    # Don't delete anything if no instance id is provided
-                    get_remove_result = None
+                    # Only one page is freed per step when run through execute, executescript runs the pragma to completion
+                    connection.connection.driver_connection.executescript('PRAGMA incremental_vacuum;')
 
-                session.commit()
+                connection.execute(text('ANALYZE'))
+                compact_stats['free_pages'] = connection.execute(text('PRAGMA freelist_count')).scalar()
 
-                return get_remove_result
-            else:
-                return None
+        self.reload_statistics()
+
+        compact_stats['file_size_after'] = get_size()
+
+        return compact_stats
+
+    def start_periodic(self, name:str, interval:Union[int,float], task):
+        """Running a task in a background thread every interval seconds
+
+        :param name: Name for this task (only one task with each name runs at a time)
+        :type name: str
+        :param interval: Seconds between runs
+        :type interval: Union[int,float]
+        :param task: Function called with no arguments
+        :type task: callable
+        """
+        if name in self.periodic_tasks and self.periodic_tasks[name][0].is_alive():
+            return
+
+        stop_event = threading.Event()
+
+        def run_task():
+            while not stop_event.wait(interval):
+                try:
+                    task()
+                except Exception as e:
+                    warnings.warn(f'fusionDB {name} error: {e}', RuntimeWarning)
+
+        task_thread = threading.Thread(
+            target = run_task,
+            name = f'fusionDB_{name}',
+            daemon = True
+        )
+        self.periodic_tasks[name] = (task_thread, stop_event)
+        task_thread.start()
+
+    def stop_periodic(self, name:Union[str,None] = None):
+        """Stopping one (or all if name is None) background tasks
+        """
+        for task_name, (task_thread, stop_event) in list(self.periodic_tasks.items()):
+            if name is None or task_name==name:
+                stop_event.set()
+                del self.periodic_tasks[task_name]
+
+    def start_maintenance(self, interval:Union[int,float] = 3600, full_every:Union[int,None] = 24):
+        """Running compact in a background thread every interval seconds
+
+        :param interval: Seconds between maintenance runs, defaults to 3600
+        :type interval: Union[int,float], optional
+        :param full_every: Run a full VACUUM on every Nth maintenance run (None for never), defaults to 24
+        :type full_every: Union[int,None], optional
+        """
+        n_runs = [0]
+
+        def run_maintenance():
+            n_runs[0] += 1
+            self.compact(full = not full_every is None and n_runs[0] % full_every==0)
+
+        self.start_periodic('maintenance', interval, run_maintenance)
+
+    def stop_maintenance(self):
+        """Stopping the background maintenance thread
+        """
+        self.stop_periodic('maintenance')
+
+    def start_session_expiry(self, interval:Union[int,float] = 600, **expire_kwargs):
+        """Running expire_sessions in a background thread every interval seconds
+
+        :param interval: Seconds between sweeps, defaults to 600
+        :type interval: Union[int,float], optional
+        :param expire_kwargs: Arguments passed to expire_sessions (retention policy)
+        """
+        self.start_periodic('session_expiry', interval, lambda: self.expire_sessions(**expire_kwargs))
+
+    def stop_session_expiry(self):
+        """Stopping the background session expiry thread
+        """
+        self.stop_periodic('session_expiry')
+
+    def touch_vis_session(self, vis_session_id:str):
+        """Marking a visualization session as active (resets its expiry)
+
+        :param vis_session_id: String uuid for a visualization session
+        :type vis_session_id: str
+        """
+        with self.write_lock:
+            with self.get_db() as session:
+                session.execute(update(VisSession).where(VisSession.id==vis_session_id).values(updated = datetime.now()))
+
+    def expire_sessions(self, max_age:Union[int,float,None] = 7*24*3600, max_sessions:Union[int,None] = None, guest_only:bool = True, chunk_size:int = 500) -> dict:
+        """Deleting visualization sessions which haven't been active within max_age seconds (or beyond the newest max_sessions), along with their annotations/data, items cached for them, and guest users left without a session
+
+        :param max_age: Seconds since a session was last active (created or touched) before it expires, defaults to 7 days (None for no age limit)
+        :type max_age: Union[int,float,None], optional
+        :param max_sessions: Maximum number of expirable sessions that are kept (the most recently active), defaults to None (no limit)
+        :type max_sessions: Union[int,None], optional
+        :param guest_only: Whether only sessions belonging to guest users (users with "guest" set, see add_vis_session) or no user expire, defaults to True
+        :type guest_only: bool, optional
+        :param chunk_size: Number of sessions/users deleted per statement, defaults to 500
+        :type chunk_size: int, optional
+        :return: Number of "sessions", "users", and "items" deleted
+        :rtype: dict
+        """
+        with self.get_db() as session:
+            session_query = select(VisSession.id, VisSession.updated).outerjoin(User, VisSession.user==User.id)
+            if guest_only:
+                session_query = session_query.where(or_(User.guest.is_(True), User.id.is_(None)))
+
+            # Most recently active sessions first (sessions without a timestamp last)
+            expirable_sessions = [
+                s for s in session.execute(session_query.order_by(VisSession.updated.is_(None), VisSession.updated.desc())).all()
+                if not s[0] in self.retained_sessions
+            ]
+
+        oldest_active = datetime.now() - timedelta(seconds = max_age) if not max_age is None else None
+        expired_sessions = [
+            s_id for s_idx,(s_id, s_updated) in enumerate(expirable_sessions)
+            if (not max_sessions is None and s_idx>=max_sessions) or (not oldest_active is None and (s_updated is None or s_updated<oldest_active))
+        ]
+
+        expired_stats = {'sessions': 0, 'users': 0, 'items': 0}
+        for chunk_start in range(0,len(expired_sessions),chunk_size):
+            chunk_ids = expired_sessions[chunk_start:chunk_start+chunk_size]
+
+            # Items cached for these sessions (items added from local sources are kept)
+            with self.get_db() as session:
+                session_items = session.scalars(
+                    select(Item.id).where(Item.session.in_(chunk_ids), Item.source_hash.is_(None))
+                ).all()
+            expired_stats['items'] += self.delete_items(session_items)
+
+            with self.write_lock:
+                with self.get_db() as session:
+                    session.execute(update(Item).where(Item.session.in_(chunk_ids)).values(session = None))
+                    for table in [Annotation, Data]:
+                        session.execute(table.__table__.delete().where(table.session.in_(chunk_ids)))
+
+                    expired_stats['sessions'] += session.execute(VisSession.__table__.delete().where(VisSession.id.in_(chunk_ids))).rowcount
+
+        # Guest users without any remaining sessions
+        with self.get_db() as session:
+            orphan_users = session.scalars(
+                select(User.id).where(
+                    User.guest.is_(True),
+                    ~select(VisSession.id).where(VisSession.user==User.id).exists()
+                )
+            ).all()
+
+        for chunk_start in range(0,len(orphan_users),chunk_size):
+            chunk_ids = orphan_users[chunk_start:chunk_start+chunk_size]
+            with self.write_lock:
+                with self.get_db() as session:
+                    session.execute(UserAccess.delete().where(UserAccess.c.user_id.in_(chunk_ids)))
+                    for table in [Annotation, Data]:
+                        session.execute(table.__table__.delete().where(table.user.in_(chunk_ids)))
+
+                    expired_stats['users'] += session.execute(User.__table__.delete().where(User.id.in_(chunk_ids))).rowcount
+
+        if expired_stats['users']>0:
+            self.access_cache.invalidate()
+
+        return expired_stats
 
     def count(self, table_name:str):
         """Get the count of unique instances within this specific table
@@ -322,7 +1107,75 @@ class fusionDB:
         else:
             return search_query
 
-    async def search(self, search_kwargs:dict, size:Union[int,None] = None, offset = 0, order = None):
+    def paginate_query(self, search_query, table_name:str, size:Union[int,None] = None, offset:int = 0, order:Union[str,list,None] = None, after:Union[str,dict,None] = None):
+        """Applying ordering and pagination (LIMIT/OFFSET or keyset) to a query so that they are executed by the database
+
+        :param search_query: DB query object
+        :type search_query: None
+        :param table_name: Name of table being searched
+        :type table_name: str
+        :param size: Number of instances to return, if None returns all, defaults to None
+        :type size: Union[int,None], optional
+        :param offset: Number of instances to skip, defaults to 0
+        :type offset: int, optional
+        :param order: Name(s) of column(s) to order by, prefixed with "-" for descending order, defaults to None
+        :type order: Union[str,list,None], optional
+        :param after: Keyset pagination cursor. Either the id of the last instance on the previous page or a dictionary containing the last instance's order column value(s) and id, defaults to None
+        :type after: Union[str,dict,None], optional
+        :return: Updated DB query object
+        :rtype: None
+        """
+        table = TABLE_NAMES.get(table_name)
+
+        if type(order)==str:
+            order = [order]
+        elif order is None:
+            order = []
+
+        order_columns = []
+        for o in order:
+            col_name = o.lstrip('-')
+            if hasattr(table,col_name):
+                order_columns.append((col_name, getattr(table,col_name), o.startswith('-')))
+
+        if not after is None or (not size is None and len(order_columns)>0):
+            # Unique tie-breaker so that pages are stable
+            if not 'id' in [i[0] for i in order_columns]:
+                order_columns.append(('id',table.id,False))
+
+        if not after is None:
+            if type(after)==str:
+                after = {'id': after}
+
+            # Row-value comparison written out so that mixed ascending/descending orders are supported
+            keyset_filter = None
+            for o_idx in range(len(order_columns)-1,-1,-1):
+                col_name, col, desc = order_columns[o_idx]
+                if not col_name in after:
+                    continue
+                col_filter = col < after.get(col_name) if desc else col > after.get(col_name)
+                if keyset_filter is None:
+                    keyset_filter = col_filter
+                else:
+                    keyset_filter = or_(col_filter, and_(col == after.get(col_name), keyset_filter))
+
+            if not keyset_filter is None:
+                search_query = search_query.filter(keyset_filter)
+
+        if len(order_columns)>0:
+            search_query = search_query.order_by(
+                *[col.desc() if desc else col.asc() for _, col, desc in order_columns]
+            )
+
+        if not offset is None and int(offset)>0:
+            search_query = search_query.offset(int(offset))
+
+        if not size is None:
+            search_query = search_query.limit(int(size))
+
+        return search_query
+
+    def search(self, search_kwargs:dict, size:Union[int,None] = None, offset = 0, order:Union[str,list,None] = None, after:Union[str,dict,None] = None, columns:Union[list,None] = None):
         """Search DB
 
         :param search_kwargs: Dictionary containing "type" (table name) and "filters"
@@ -331,8 +1184,12 @@ class fusionDB:
         :type size: int, optional
         :param offset: Offset of instances to return from search, defaults to 0
         :type offset: int, optional
-        :param order: Name of column to order by (Not Implemented), defaults to None
-        :type order: None, optional
+        :param order: Name(s) of column(s) to order by, prefixed with "-" for descending order, defaults to None
+        :type order: Union[str,list,None], optional
+        :param after: Keyset pagination cursor (see paginate_query), defaults to None
+        :type after: Union[str,dict,None], optional
+        :param columns: Names of columns to return, if None returns the full dictionary for each instance, defaults to None
+        :type columns: Union[list,None], optional
         :return: Results of DB search
         :rtype: list
         """
@@ -397,17 +1254,39 @@ class fusionDB:
                     # Filtering public
                     search_query = search_query.filter(Item.public==True)
 
-            return_list = []
-            for idx,i in enumerate(search_query.all()):
-                if not size is None:
-                    if len(return_list)==size:
-                        break
+            search_query = self.paginate_query(
+                search_query,
+                search_kwargs.get('type'),
+                size = size,
+                offset = offset,
+                order = order,
+                after = after
+            )
+
+            if not columns is None:
+                search_table = TABLE_NAMES.get(search_kwargs.get('type'))
+                columns = [c for c in columns if hasattr(search_table,c)]
+                search_query = search_query.with_entities(
+                    *[getattr(search_table,c) for c in columns]
+                )
 
-                if idx>=offset:
-                    return_list.append(i.to_dict())
+                return_list = [
+                    dict(zip(columns,i))
+                    for i in search_query.all()
+                ]
+            else:
+                return_list = [
+                    i.to_dict()
+                    for i in search_query.all()
+                ]
 
             return return_list
       
+    async def search_async(self, search_kwargs:dict, size:Union[int,None] = None, offset = 0, order:Union[str,list,None] = None, after:Union[str,dict,None] = None, columns:Union[list,None] = None):
+        """Async version of search (runs on the database threads), see search for arguments
+        """
+        return await self.run_async(self.search, search_kwargs, size = size, offset = offset, order = order, after = after, columns = columns)
+
     def add_slide(self,
         slide_id:str, 
         slide_name:str,
@@ -419,9 +1298,19 @@ class fusionDB:
         annotations:Union[list,dict,None],
         vis_session_id: Union[str,None] = None,
         user_id: Union[str,None] = None,
-        public: bool = False):
+        public: bool = False,
+        source_hash: Union[str,None] = None):
 
         #print(f'{slide_id=}, {public=}, {item_type=}, {user_id=}')
+
+        if type(annotations)==dict:
+            annotations = [annotations]
+
+        # Re-ingesting an existing item, its previous layers are replaced (structures get new ids each time annotations are loaded)
+        with self.get_db() as session:
+            previous_layers = session.scalars(select(Layer.id).where(Layer.item==slide_id)).all()
+        self.delete_layers(previous_layers)
+
         if item_type=='local_item':
             new_item = self.get_create(
                 table_name = 'local_item',
@@ -434,6 +1323,7 @@ class fusionDB:
                     'filepath': image_filepath,
                     'session': vis_session_id,
                     'public': public, 
+                    'source_hash': source_hash
                 }
             )
 
@@ -448,6 +1338,7 @@ class fusionDB:
                     'ann_meta': annotations_metadata,
                     'session': vis_session_id,
                     'public': public, 
+                    'source_hash': source_hash
                 }
             )
 
@@ -462,25 +1353,144 @@ class fusionDB:
                     'ann_meta': annotations_metadata,
                     'session': vis_session_id,
                     'public': public, 
+                    'source_hash': source_hash
                 }
             )
 
         if not public and user_id is not None:
             self.add_access(slide_id,user_id)
 
-        self.add_layer(annotations, slide_id)
+        return self.add_layer(annotations or [], slide_id)
+
+    def get_item_source_hash(self, item_id:str) -> Union[str,None]:
+        """Getting the source hash that an item was ingested with (see get_source_hash)
+
+        :param item_id: String uuid for an item
+        :type item_id: str
+        :return: Source hash or None if the item isn't in the database (or was added without a source hash)
+        :rtype: Union[str,None]
+        """
+        with self.get_db() as session:
+            return session.scalar(select(Item.source_hash).where(Item.id==item_id))
+
+    def delete_layers(self, layer_ids:list) -> int:
+        """Deleting layers along with their structures, image overlays, property catalogs/store files, and any annotations or data that reference them
+
+        :param layer_ids: List of layer ids
+        :type layer_ids: list
+        :return: Number of layers deleted
+        :rtype: int
+        """
+        if len(layer_ids)==0:
+            return 0
+
+        with self.write_lock:
+            with self.get_db() as session:
+                for table in [Annotation, Data, Structure, ImageOverlay, PropertyCatalog]:
+                    session.execute(table.__table__.delete().where(table.layer.in_(layer_ids)))
+
+                n_deleted = session.execute(Layer.__table__.delete().where(Layer.id.in_(layer_ids))).rowcount
+
+        if not self.property_store is None:
+            for layer_id in layer_ids:
+                self.property_store.remove_layer(layer_id)
+
+        return n_deleted
+
+    def delete_items(self, item_ids:list) -> int:
+        """Deleting items along with all of their layers and access rows
+
+        :param item_ids: List of item ids
+        :type item_ids: list
+        :return: Number of items deleted
+        :rtype: int
+        """
+        if len(item_ids)==0:
+            return 0
+
+        with self.get_db() as session:
+            item_layers = session.scalars(select(Layer.id).where(Layer.item.in_(item_ids))).all()
+
+        self.delete_layers(item_layers)
+
+        with self.write_lock:
+            with self.get_db() as session:
+                for table in [Annotation, Data]:
+                    session.execute(table.__table__.delete().where(table.item.in_(item_ids)))
+
+                session.execute(UserAccess.delete().where(UserAccess.c.item_id.in_(item_ids)))
+                for table in [LocalItem, RemoteItem]:
+                    session.execute(table.__table__.delete().where(table.__table__.c.id.in_(item_ids)))
 
-    def add_layer(self, annotations:Union[dict,list],item_id:str):
+                n_deleted = session.execute(Item.__table__.delete().where(Item.id.in_(item_ids))).rowcount
+
+        self.access_cache.invalidate()
+
+        return n_deleted
+
+    def prune_items(self, keep_ids:list) -> int:
+        """Deleting items that were added from local sources (have a source hash) but are not in keep_ids
+
+        :param keep_ids: Ids of items which are still in use
+        :type keep_ids: list
+        :return: Number of items deleted
+        :rtype: int
+        """
+        with self.get_db() as session:
+            orphan_ids = session.scalars(
+                select(Item.id).where(Item.source_hash.is_not(None), Item.id.not_in(keep_ids))
+            ).all()
+
+        return self.delete_items(orphan_ids)
+
+    def add_layer(self, annotations:Union[dict,list],item_id:str, bulk:bool = True, chunk_size:int = 5000, max_workers:int = 4) -> dict:
+        """Adding one or more annotation layers (and their structures) to the database
+
+        :param annotations: GeoJSON FeatureCollection(s) or image overlay layers
+        :type annotations: Union[dict,list]
+        :param item_id: String uuid for the item these layers belong to
+        :type item_id: str
+        :param bulk: Whether to insert structures in chunks using the bulk ingestion path (otherwise each structure is added with get_create), defaults to True
+        :type bulk: bool, optional
+        :param chunk_size: Number of structures inserted per statement when using the bulk path, defaults to 5000
+        :type chunk_size: int, optional
+        :param max_workers: Number of layers preprocessed in parallel when using the bulk path (structures are still written one layer at a time), defaults to 4
+        :type max_workers: int, optional
+        :return: Ingestion statistics ("rows", "seconds", and "rows_per_second")
+        :rtype: dict
+        """
 
         if type(annotations)==dict:
             annotations =  [annotations]
 
+        start = time.time()
+        n_rows = 0
+        bulk_layers = []
         for ann_idx, ann in enumerate(annotations):
             jic_uuid = self.get_uuid()
+            layer_id = ann.get('properties',{}).get('_id',jic_uuid)
+
+            # Structures in layers which weren't already in the database don't need to be checked before inserting
+            with self.get_db() as session:
+                layer_item = session.scalar(select(Layer.item).where(Layer.id==layer_id))
+            layer_exists = not layer_item is None
+
+            if layer_exists and not layer_item==item_id:
+                # Layers are only replaced within the same item, the same annotations added to another item get new layer/structure ids
+                layer_id = jic_uuid
+                layer_exists = False
+                ann = ann | {
+                    'properties': ann.get('properties',{}) | {'_id': layer_id},
+                    'features': [
+                        f | {'properties': f['properties'] | {'_id': uuid.uuid4().hex[:24]}} if not f.get('properties') is None else f
+                        for f in ann.get('features',[])
+                    ]
+                }
+
             # Adding layer
             new_layer = self.get_create(
                 table_name = 'layer',
-                inst_id = ann.get('properties',{}).get('_id',jic_uuid),
+                inst_id = layer_id,
                 kwargs = {
                     'name': ann.get('properties',{}).get('name'),
                     'item': item_id
@@ -496,10 +1506,12 @@ class fusionDB:
                         'bounds': ann.get('image_bounds'),
                         'properties': ann.get('image_properties'),
                         'image_src': ann.get('image_path'),
-                        'layer': ann.get('properties',{}).get('_id',jic_uuid),
+                        'layer': layer_id,
                         'item': item_id
                     }
                 )
+            elif bulk:
+                bulk_layers.append((ann, layer_id, layer_exists))
             else:
                 # Adding Structures in Layer
                 for f_idx, f in enumerate(ann.get('features',[])):
@@ -509,12 +1521,208 @@ class fusionDB:
                         kwargs = {
                             'geom': f.get('geometry'),
                             'properties': f.get('properties',{'name': ann.get('properties',{}).get('name')}),
-                            'layer': ann.get('properties',{}).get('_id',jic_uuid),
+                            'layer': layer_id,
                             'item': item_id,
-                        }
+                        } | get_geom_columns(f.get('geometry'), self.geometry_format)
+                    )
+                    n_rows += 1
+
+                if len(ann.get('features',[]))>0:
+                    # Existing layers might have other structures so the catalog/property store cover everything in the layer
+                    layer_rows = self.get_layer_property_rows(layer_id)
+                    self.update_property_catalog(
+                        layer_id = layer_id,
+                        item_id = item_id,
+                        property_catalog = get_property_catalog([r['properties'] for r in layer_rows])
                     )
+                    self.update_property_store(layer_id, layer_rows)
+
+        if len(bulk_layers)>0:
+            # Only building rows (geometry encoding/bounds), property catalogs, and property files runs in parallel,
+            # add_layer_structures holds write_lock for each layer's transaction.
+            with ThreadPoolExecutor(max_workers = max(1,min(max_workers,len(bulk_layers)))) as executor:
+                layer_rows = executor.map(
+                    lambda l: self.add_layer_structures(
+                        annotation = l[0],
+                        layer_id = l[1],
+                        item_id = item_id,
+                        check_existing = l[2],
+                        chunk_size = chunk_size
+                    ),
+                    bulk_layers
+                )
+                n_rows += sum(layer_rows)
+
+        if n_rows>0:
+            self.update_structure_stats()
+
+        ingest_time = time.time() - start
+        ingest_stats = {
+            'rows': n_rows,
+            'seconds': ingest_time,
+            'rows_per_second': n_rows / ingest_time if ingest_time>0 else 0
+        }
+
+        return ingest_stats
+
+    def add_layer_structures(self, annotation:dict, layer_id:str, item_id:str, check_existing:bool = True, chunk_size:int = 5000) -> int:
+        """Bulk inserting the structures in a single layer within one transaction (holding write_lock while writing)
+
+        :param annotation: GeoJSON FeatureCollection for this layer
+        :type annotation: dict
+        :param layer_id: String uuid for the layer
+        :type layer_id: str
+        :param item_id: String uuid for the item
+        :type item_id: str
+        :param check_existing: Whether structures might already be in the database (these are updated instead of inserted), defaults to True
+        :type check_existing: bool, optional
+        :param chunk_size: Number of structures inserted per statement, defaults to 5000
+        :type chunk_size: int, optional
+        :return: Number of structures added or updated
+        :rtype: int
+        """
+        updated = datetime.now()
+        layer_name = annotation.get('properties',{}).get('name')
+        structure_rows = [
+            {
+                'id': f.get('properties',{}).get('_id',uuid.uuid4().hex[:24]),
+                'geom': f.get('geometry'),
+                'properties': f.get('properties',{'name': layer_name}),
+                'layer': layer_id,
+                'item': item_id,
+                'updated': updated
+            } | get_geom_columns(f.get('geometry'), self.geometry_format)
+            for f in annotation.get('features',[])
+        ]
+
+        if len(structure_rows)==0:
+            return 0
+
+        n_rows = len(structure_rows)
+        if not check_existing:
+            property_catalog = get_property_catalog([r['properties'] for r in structure_rows])
+
+        with self.write_lock:
+            with self.get_db() as session:
+                for chunk_start in range(0,len(structure_rows),chunk_size):
+                    chunk_rows = structure_rows[chunk_start:chunk_start+chunk_size]
+
+                    if check_existing:
+                        # Checking ids in smaller batches to stay under the bound parameter limit
+                        existing_ids = set()
+                        for id_start in range(0,len(chunk_rows),500):
+                            existing_ids |= set(session.scalars(
+                                select(Structure.id).where(Structure.id.in_([r['id'] for r in chunk_rows[id_start:id_start+500]]))
+                            ).all())
+
+                        if len(existing_ids)>0:
+                            session.execute(update(Structure),[r for r in chunk_rows if r['id'] in existing_ids])
+                            chunk_rows = [r for r in chunk_rows if not r['id'] in existing_ids]
+
+                    if len(chunk_rows)>0:
+                        session.execute(insert(Structure),chunk_rows)
+
+                if check_existing:
+                    # This layer might already have other structures so the catalog/property store cover everything in the layer
+                    structure_rows = self.get_layer_property_rows(layer_id, session)
+                    property_catalog = get_property_catalog([r['properties'] for r in structure_rows])
+
+                self.update_property_catalog(layer_id, item_id, property_catalog, session)
+
+        self.update_property_store(layer_id, structure_rows)
+
+        return n_rows
+
+    def get_layer_property_rows(self, layer_id:str, session = None) -> list:
+        """Getting the id, properties, and bounding box of every structure in a layer
+
+        :param layer_id: String uuid for the layer
+        :type layer_id: str
+        :param session: Session to use (otherwise a new one is created), defaults to None
+        :type session: None, optional
+        :return: List of dictionaries containing "id", "properties", "minx", "miny", "maxx", and "maxy"
+        :rtype: list
+        """
+        if session is None:
+            with self.get_db() as session:
+                return self.get_layer_property_rows(layer_id, session)
+
+        layer_rows = session.execute(
+            select(
+                Structure.id,
+                Structure.properties,
+                Structure.minx,
+                Structure.miny,
+                Structure.maxx,
+                Structure.maxy
+            ).where(Structure.layer==layer_id).order_by(self.structure_order)
+        ).all()
+
+        return [r._asdict() for r in layer_rows]
+
+    def update_property_store(self, layer_id:str, structure_rows:Union[list,None] = None) -> bool:
+        """Writing the columnar property file for a layer
+
+        :param layer_id: String uuid for the layer
+        :type layer_id: str
+        :param structure_rows: Output of get_layer_property_rows (or equivalent) for every structure in this layer, defaults to None (read from the database)
+        :type structure_rows: Union[list,None], optional
+        :return: Whether the layer file was written (False if there is no property store)
+        :rtype: bool
+        """
+        if self.property_store is None:
+            return False
 
-    def add_vis_session(self, vis_session: dict):
+        if structure_rows is None:
+            structure_rows = self.get_layer_property_rows(layer_id)
+
+        self.property_store.write_layer(layer_id, structure_rows)
+
+        return True
+
+    def update_property_catalog(self, layer_id:str, item_id:str, property_catalog:dict, session = None):
+        """Replacing the property catalog entries for a layer
+
+        :param layer_id: String uuid for the layer
+        :type layer_id: str
+        :param item_id: String uuid for the item
+        :type item_id: str
+        :param property_catalog: Output of get_property_catalog for all structures in this layer
+        :type property_catalog: dict
+        :param session: Session to use (otherwise a new one is created), defaults to None
+        :type session: None, optional
+        """
+        if session is None:
+            with self.get_db() as session:
+                return self.update_property_catalog(layer_id, item_id, property_catalog, session)
+
+        updated = datetime.now()
+        session.query(PropertyCatalog).filter(PropertyCatalog.layer==layer_id).delete(synchronize_session = False)
+        if len(property_catalog)>0:
+            session.execute(
+                insert(PropertyCatalog),
+                [
+                    {
+                        'id': self.get_uuid(),
+                        'key': k,
+                        'layer': layer_id,
+                        'item': item_id,
+                        'updated': updated
+                    } | v
+                    for k,v in property_catalog.items()
+                ]
+            )
+
+        return True
+
+    def add_vis_session(self, vis_session: dict, retain: bool = False):
+        """Adding (or updating) a visualization session and its user
+
+        :param vis_session: Dictionary containing "session" (with "id"), "user" (user dictionary, "guest": True for users created for this session which are removed with it), and "data"
+        :type vis_session: dict
+        :param retain: Whether this session should never be removed by expire_sessions, defaults to False
+        :type retain: bool, optional
+        """
 
         vis_session_kwargs = {
             'user': vis_session.get('user',{}).get('id'),
@@ -537,13 +1745,38 @@ class fusionDB:
             }
         )
 
+        # New sessions can bring new users/tokens
+        self.access_cache.invalidate()
+
+        if retain:
+            self.retained_sessions.add(vis_session.get('session',{}).get('id'))
+
     def add_access(self, item_id, user_id):
 
+        with self.get_db() as session:
+            # Items are re-added for every session when the database persists, only adding access once
+            access_exists = session.execute(
+                select(UserAccess.c.item_id).where(
+                    UserAccess.c.user_id==user_id,
+                    UserAccess.c.item_id==item_id
+                ).limit(1)
+            ).first()
+
+            if access_exists is None:
+                statement = session.execute(
+                    insert(UserAccess).values(
+                        user_id = user_id,
+                        item_id = item_id
+                    )
+                )
+
+    def remove_access(self, item_id, user_id):
+
         with self.get_db() as session:
             statement = session.execute(
-                insert(UserAccess).values(
-                    user_id = user_id,
-                    item_id = item_id
+                UserAccess.delete().where(
+                    UserAccess.c.user_id==user_id,
+                    UserAccess.c.item_id==item_id
                 )
             )
         
@@ -616,69 +1849,311 @@ class fusionDB:
 
     def check_user_access(self, user_id:str, admin:bool = False) -> list:
 
-        user_access_rows = []
         with self.get_db() as session:
-            user_access = session.query(UserAccess)
-
-            for i in user_access.all():
-                user_access_rows.append(i)
+            access_query = select(UserAccess.c.item_id)
+            # Admins have access to everything
+            if not admin:
+                access_query = access_query.where(UserAccess.c.user_id==user_id)
 
-        # Admins have access to everything
-        non_public_access_list = []
-        if admin:
-            non_public_access_list =  [i[1] for i in user_access_rows]
-        else:
-            for user,item in user_access_rows:
-                if user_id==user:
-                    non_public_access_list.append(item)
+            non_public_access_list = session.scalars(access_query).all()
 
         return non_public_access_list
 
-    def get_names(self, table_name:str, user_token: Union[str,None] = None, size:Union[int,None]=None, offset = 0):
+    def get_readable_items(self, user_token:Union[str,None] = None) -> frozenset:
+        """Getting the ids of all items that a user can read (public items, items the user has access to, or all items for admins), cached for access_ttl seconds
+
+        :param user_token: User token, defaults to None (public items only)
+        :type user_token: Union[str,None], optional
+        :return: Set of readable item ids
+        :rtype: frozenset
+        """
+        readable_items = self.access_cache.get(('readable',user_token))
+        if readable_items is None:
+            cache_generation = self.access_cache.generation
+            with self.get_db() as session:
+                readable_items = frozenset(session.scalars(
+                    select(Item.id).where(self.item_access_filter(user_token))
+                ).all())
+
+            self.access_cache.set(('readable',user_token), readable_items, cache_generation)
+
+        return readable_items
+
+    def check_item_access(self, item_id:str, user_token:Union[str,None] = None) -> bool:
+        """Checking whether a user can read an item
+
+        :param item_id: String uuid for an item
+        :type item_id: str
+        :param user_token: User token, defaults to None (public items only)
+        :type user_token: Union[str,None], optional
+        :return: True if the item is public or accessible by this user
+        :rtype: bool
+        """
+        return item_id in self.get_readable_items(user_token)
+
+    def get_item_info(self, item_id:str) -> Union[dict,None]:
+        """Getting an item's record (without access checks, see check_item_access), cached for access_ttl seconds
+
+        :param item_id: String uuid for an item
+        :type item_id: str
+        :return: Item dictionary (including "filepath" for local items) or None if the item isn't in the database
+        :rtype: Union[dict,None]
+        """
+        item_info = self.access_cache.get(('item',item_id))
+        if item_info is None:
+            cache_generation = self.access_cache.generation
+            with self.get_db() as session:
+                item_info = session.get(Item,item_id)
+                item_info = item_info.to_dict() if not item_info is None else None
+
+            if not item_info is None:
+                self.access_cache.set(('item',item_id), item_info, cache_generation)
+
+        # Copying so that callers can't modify the cached record
+        return item_info.copy() if not item_info is None else None
+
+    async def get_accessible_item_async(self, item_id:str, user_token:Union[str,None] = None) -> list:
+        """Getting an item's record if this user can read it, only going to the database threads when the cache doesn't have the answer
+
+        :param item_id: String uuid for an item
+        :type item_id: str
+        :param user_token: User token, defaults to None (public items only)
+        :type user_token: Union[str,None], optional
+        :return: List containing the item dictionary (empty if the item isn't found or accessible), same as search
+        :rtype: list
+        """
+        readable_items = self.access_cache.get(('readable',user_token))
+        if readable_items is None:
+            readable_items = await self.run_async(self.get_readable_items, user_token)
+
+        if not item_id in readable_items:
+            return []
+
+        item_info = self.access_cache.get(('item',item_id))
+        if item_info is None:
+            item_info = await self.run_async(self.get_item_info, item_id)
+
+        return [item_info.copy()] if not item_info is None else []
+
+    def get_names(self, table_name:str, user_token: Union[str,None] = None, size:Union[int,None]=None, offset = 0, order:Union[str,list,None] = None, after:Union[str,dict,None] = None):
         
         #TODO: This should get access controlled
         return_names = []
         with self.get_db() as session:
 
             if table_name in TABLE_NAMES:
-                #if not table_name=='item':
-                name_query = session.execute(
-                    select(getattr(TABLE_NAMES.get(table_name),'name'))
+                name_query = session.query(
+                    getattr(TABLE_NAMES.get(table_name),'name')
+                )
+                name_query = self.paginate_query(
+                    name_query, table_name,
+                    size = size,
+                    offset = offset,
+                    order = order,
+                    after = after
                 )
-                #else:
-                #    name_query = session.query(Item.name)
-                #    name_query = name_query.join(UserAccess)
 
-                for a_idx,a in enumerate(name_query.all()):
-                    if not size is None:
-                        if len(return_names)==size:
-                            break
-                    if a_idx>=offset:
-                        return_names.append(a[0])
+                return_names = [a[0] for a in name_query.all()]
 
             return return_names
 
-    def get_ids(self, table_name: str, user_token: Union[str,None] = None, size:Union[int,None] = None, offset = 0):
+    def get_ids(self, table_name: str, user_token: Union[str,None] = None, size:Union[int,None] = None, offset = 0, order:Union[str,list,None] = None, after:Union[str,dict,None] = None):
 
         #TODO: This should be access controlled
         return_ids = []
         with self.get_db() as session:
 
             if table_name in TABLE_NAMES:
-                id_query = session.execute(
-                    select(getattr(TABLE_NAMES.get(table_name),'id'))
+                id_query = session.query(
+                    getattr(TABLE_NAMES.get(table_name),'id')
+                )
+                id_query = self.paginate_query(
+                    id_query, table_name,
+                    size = size,
+                    offset = offset,
+                    order = order,
+                    after = after
                 )
 
-                for a_idx, a in enumerate(id_query.all()):
-                    if not size is None:
-                        if len(return_ids)==size:
-                            break
-                    if a_idx>=offset:
-                        return_ids.append(a[0])
+                return_ids = [a[0] for a in id_query.all()]
             
             return return_ids
 
-    async def get_item_annotations(self, item_id:str, user_id:Union[str,None] = None, vis_session_id:Union[str,None] = None)->list:
+    def item_access_filter(self, user_token:Union[str,None] = None):
+        """Filter expression for items which are public or accessible by the user with this token (admins can access all items)
+
+        :param user_token: User token, defaults to None (public items only)
+        :type user_token: Union[str,None], optional
+        :return: SQL filter expression on Item
+        """
+        if user_token is None:
+            return Item.public==True
+
+        return or_(
+            Item.public==True,
+            Item.user_access.any(User.token==user_token),
+            select(User.id).where(User.token==user_token, User.admin==True).exists()
+        )
+
+    def get_layer_counts(self, item_id:str, user_token:Union[str,None] = None) -> list:
+        """Getting layer metadata along with the number of structures and image overlays in each layer (one grouped query)
+
+        :param item_id: String uuid for an item
+        :type item_id: str
+        :param user_token: User token used to check access to non-public items, defaults to None
+        :type user_token: Union[str,None], optional
+        :return: List of dictionaries containing layer "id", "name", "item", "structures", and "image_overlays"
+        :rtype: list
+        """
+        with self.get_db() as session:
+            layer_query = session.execute(
+                select(
+                    Layer.id,
+                    Layer.name,
+                    Layer.item,
+                    select(func.count(Structure.id)).where(Structure.layer==Layer.id).scalar_subquery(),
+                    select(func.count(ImageOverlay.id)).where(ImageOverlay.layer==Layer.id).scalar_subquery()
+                ).join(
+                    Item, Layer.item==Item.id
+                ).where(
+                    Layer.item==item_id,
+                    self.item_access_filter(user_token)
+                )
+            )
+
+            return [
+                {
+                    'id': l[0],
+                    'name': l[1],
+                    'item': l[2],
+                    'structures': l[3],
+                    'image_overlays': l[4]
+                }
+                for l in layer_query.all()
+            ]
+
+    def get_item_structures(self, item_id:str, layer_id:Union[str,list,None] = None, user_token:Union[str,None] = None, chunk_size:int = 1000) -> Generator:
+        """Streaming structures from all (or selected) layers of an item in one cursor ordered by layer
+
+        :param item_id: String uuid for an item
+        :type item_id: str
+        :param layer_id: String uuid for one or multiple layers, defaults to None
+        :type layer_id: Union[str,list,None], optional
+        :param user_token: User token used to check access to non-public items, defaults to None
+        :type user_token: Union[str,None], optional
+        :param chunk_size: Number of rows fetched from the cursor at a time, defaults to 1000
+        :type chunk_size: int, optional
+        :yield: Rows containing (layer, id, geom, properties), in the same order as layer_id if a list is passed
+        :rtype: Generator
+        """
+        with self.get_db(stream = True) as session:
+            structure_query = select(
+                Structure.layer,
+                Structure.id,
+                Structure.geom,
+                Structure.properties
+            ).join(
+                Item, Structure.item==Item.id
+            ).where(
+                Structure.item==item_id,
+                self.item_access_filter(user_token)
+            )
+
+            layer_order = Structure.layer
+            if not layer_id is None:
+                if type(layer_id)==list:
+                    structure_query = structure_query.where(Structure.layer.in_(layer_id))
+                    if len(layer_id)>1:
+                        layer_order = case({l: l_idx for l_idx, l in enumerate(layer_id)}, value = Structure.layer)
+                elif type(layer_id)==str:
+                    structure_query = structure_query.where(Structure.layer==layer_id)
+
+            structure_query = structure_query.order_by(layer_order, self.structure_order).execution_options(yield_per = chunk_size)
+
+            for row in session.execute(structure_query):
+                yield row
+
+    def iter_item_annotations(self, item_id:str, user_token:Union[str,None] = None, bbox:Union[list,None] = None) -> Generator:
+        """Iterating through the annotation layers of an item without loading all structures at once
+
+        :param item_id: String uuid for an item
+        :type item_id: str
+        :param user_token: User token used to check access to non-public items, defaults to None
+        :type user_token: Union[str,None], optional
+        :param bbox: Bounding box (minx, miny, maxx, maxy) to restrict structures to, defaults to None
+        :type bbox: Union[list,None], optional
+        :yield: (FeatureCollection properties, generator of GeoJSON Features) for structure layers and (image overlay dictionary, None) for image overlays. Features for each layer should be consumed before moving to the next layer.
+        :rtype: Generator
+        """
+
+        item_layers = self.get_layer_counts(item_id, user_token)
+        structure_layers = [l.get('id') for l in item_layers if l.get('structures')>0]
+
+        # Structures for all layers come from one cursor, grouped by layer in the same order as item_layers
+        if not bbox is None:
+            bbox_structures = {}
+            for s in self.get_structures_in_bbox(bbox = bbox, item_id = item_id, user_token = user_token, ids_only = False):
+                bbox_structures.setdefault(s.get('layer'),[]).append(
+                    {
+                        'type': 'Feature',
+                        'geometry': s.get('geom'),
+                        'properties': s.get('properties')
+                    }
+                )
+            structure_groups = iter([(l, bbox_structures.get(l,[])) for l in structure_layers])
+        elif len(structure_layers)>0:
+            structure_groups = (
+                (
+                    l_id,
+                    (
+                        {
+                            'type': 'Feature',
+                            'geometry': s.geom,
+                            'properties': s.properties
+                        }
+                        for s in l_structures
+                    )
+                )
+                for l_id, l_structures in groupby(
+                    self.get_item_structures(item_id, layer_id = structure_layers, user_token = user_token),
+                    key = lambda s: s[0]
+                )
+            )
+        else:
+            structure_groups = iter([])
+
+        overlay_layers = [l.get('id') for l in item_layers if l.get('structures')==0 and l.get('image_overlays')>0]
+        layer_overlays = {}
+        if len(overlay_layers)>0:
+            with self.get_db() as session:
+                for i in session.scalars(select(ImageOverlay).where(ImageOverlay.layer.in_(overlay_layers))).all():
+                    layer_overlays.setdefault(i.layer,[]).append(i.to_dict())
+
+        current_group = next(structure_groups, (None, iter([])))
+        for l in item_layers:
+            if l.get('structures')>0:
+                if current_group[0]==l.get('id'):
+                    yield (
+                        {
+                            'name': l.get('name'),
+                            '_id': l.get('id')
+                        },
+                        current_group[1]
+                    )
+                    current_group = next(structure_groups, (None, iter([])))
+            else:
+                # This could be an ImageOverlay layer
+                image_overlays = layer_overlays.get(l.get('id'),[])
+                if not bbox is None:
+                    image_overlays = [
+                        i for i in image_overlays
+                        if i.get('bounds') is None or box(*i.get('bounds')).intersects(box(*bbox))
+                    ]
+
+                for i in image_overlays:
+                    yield (i, None)
+
+    def get_item_annotations(self, item_id:str, user_id:Union[str,None] = None, vis_session_id:Union[str,None] = None, user_token:Union[str,None] = None, bbox:Union[list,None] = None)->list:
         """Loading annotations from item database
 
         :param item_id: String uuid for an item
@@ -687,84 +2162,105 @@ class fusionDB:
         :type user_id: Union[str,None], optional
         :param vis_session_id: String uuid for a visualization session, defaults to None
         :type vis_session_id: Union[str,None], optional
+        :param user_token: User token used to check access to non-public items, defaults to None
+        :type user_token: Union[str,None], optional
+        :param bbox: Bounding box (minx, miny, maxx, maxy) to restrict structures to, defaults to None
+        :type bbox: Union[list,None], optional
         :return: List of GeoJSON-formatted FeatureCollections (and image overlays if present)
         :rtype: list
         """
 
-        item_annotations = []
+        if user_token is None and not user_id is None:
+            user_token = (self.get_user(user_id = user_id) or {}).get('token')
 
-        item_layers = await self.search(
-            search_kwargs = {
-                'type': 'layer',
-                'filters': {
-                    'item': {
-                        'id': item_id
-                    }
-                }
-            }
-        )
-
-        for l in item_layers:
-            layer_name = l.get('name')
-            layer_id = l.get('id')
-
-            layer_structures = await self.search(
-                search_kwargs={
-                    'type': 'structure',
-                    'filters': {
-                        'layer': {
-                            'id': layer_id
-                        }
-                    }
-                }
-            )
-
-            if len(layer_structures)>0:
+        item_annotations = []
+        for layer, features in self.iter_item_annotations(item_id, user_token, bbox):
+            if features is None:
+                item_annotations.append(layer)
+            else:
                 item_annotations.append(
                     {
                         'type': 'FeatureCollection',
-                        'properties': {
-                            'name': layer_name,
-                            '_id': layer_id
-                        },
-                        'features': [
-                            {
-                                'type': 'Feature',
-                                'geometry': s.get('geom'),
-                                'properties': s.get('properties')
-                            }
-                            for s in layer_structures
-                        ]
+                        'properties': layer,
+                        'features': list(features)
                     }
                 )
-            else:
-                # This could be an ImageOverlay layer
-                image_overlays = await self.search(
-                    search_kwargs = {
-                        'type': 'image_overlay',
-                        'filters': {
-                            'layer': {
-                                'id': layer_id
-                            }
-                        }
+
+        return item_annotations
+
+    async def get_item_annotations_async(self, item_id:str, user_id:Union[str,None] = None, vis_session_id:Union[str,None] = None, user_token:Union[str,None] = None, bbox:Union[list,None] = None)->list:
+        """Async version of get_item_annotations (runs on the database threads), see get_item_annotations for arguments
+        """
+        return await self.run_async(self.get_item_annotations, item_id, user_id = user_id, vis_session_id = vis_session_id, user_token = user_token, bbox = bbox)
+
+    def get_structure_property_keys(self, item_id:Union[str,list,None] = None, layer_id:Union[str,list,None] = None) -> list:
+        """Getting the names and summaries of structure properties from the property catalog (combined across layers)
+
+        :param item_id: String uuid for one or multiple image items, defaults to None
+        :type item_id: Union[str,list,None], optional
+        :param layer_id: String uuid for one or multiple layers, defaults to None
+        :type layer_id: Union[str,list,None], optional
+        :return: List of dictionaries containing "key", "title", "type", "count", and either "min"/"max" (numeric) or "distinct"/"distinctcount" (string)
+        :rtype: list
+        """
+        with self.get_db() as session:
+            catalog_query = session.query(PropertyCatalog)
+
+            if not item_id is None:
+                if type(item_id)==list:
+                    catalog_query = catalog_query.filter(PropertyCatalog.item.in_(item_id))
+                elif type(item_id)==str:
+                    catalog_query = catalog_query.filter(PropertyCatalog.item==item_id)
+
+            if not layer_id is None:
+                if type(layer_id)==list:
+                    catalog_query = catalog_query.filter(PropertyCatalog.layer.in_(layer_id))
+                elif type(layer_id)==str:
+                    catalog_query = catalog_query.filter(PropertyCatalog.layer==layer_id)
+
+            property_keys = {}
+            for c in catalog_query.order_by(PropertyCatalog.key).all():
+                if not c.key in property_keys:
+                    property_keys[c.key] = {
+                        'key': c.key.lower().replace(' --> ','.'),
+                        'title': c.key,
+                        'type': c.dtype,
+                        'count': c.count,
+                        'min': c.min,
+                        'max': c.max,
+                        'distinct': c.distinct
                     }
-                )
+                else:
+                    p_info = property_keys[c.key]
+                    p_info['count'] += c.count
+                    if c.dtype=='string':
+                        p_info['type'] = 'string'
+                    if not c.min is None:
+                        p_info['min'] = c.min if p_info['min'] is None else min(p_info['min'],c.min)
+                        p_info['max'] = c.max if p_info['max'] is None else max(p_info['max'],c.max)
+                    if p_info['distinct'] is None or c.distinct is None:
+                        p_info['distinct'] = None
+                    else:
+                        p_info['distinct'] = list(dict.fromkeys(p_info['distinct'] + c.distinct))
+
+            property_list = []
+            for p_info in property_keys.values():
+                if p_info['type']=='string':
+                    # distinct is None if there are more unique values than the catalog's cardinality limit
+                    p_info['distinctcount'] = len(p_info['distinct']) if not p_info['distinct'] is None else None
+                    p_info['distinct'] = p_info['distinct'] if not p_info['distinct'] is None else []
+                    del p_info['min'], p_info['max']
+                else:
+                    del p_info['distinct']
 
-                if len(image_overlays)>0:
-                    item_annotations.extend(
-                        [
-                            i.to_dict() for i in image_overlays
-                        ]
-                    )
+                property_list.append(p_info)
 
-        return item_annotations
+            return property_list
 
-    def get_structure_property_keys(self, item_id:Union[str,list,None] = None, layer_id:Union[str,list,None] = None):
-        #TODO: Make a more efficient way to get names of properties for each structure
-        pass
+    def get_structure_property_data(self, item_id:Union[str,list,None] = None, layer_id:Union[str,list,None] = None, structure_id:Union[str,list,None] = None, property_list:Union[str,list] = None, filters:Union[list,None] = None):
+        """Extracting one or multiple properties from structures given id and property filters.
 
-    def get_structure_property_data(self, item_id:Union[str,list,None] = None, layer_id:Union[str,list,None] = None, structure_id:Union[str,list,None] = None, property_list:Union[str,list] = None):
-        """Extracting one or multiple properties from structures given id filters.
+        Properties are read from the columnar property store where available (filters are applied while reading each file), layers without a property file (or requests/filters the file can't answer) use the JSON properties column instead (filters are applied in the query).
 
         :param item_id: String uuid for one or multiple image items, defaults to None
         :type item_id: Union[str,list,None], optional
@@ -774,6 +2270,8 @@ class fusionDB:
         :type structure_id: Union[str,list,None], optional
         :param property_list: List of one or more properties to extract from structures, defaults to None
         :type property_list: Union[str,list], optional
+        :param filters: List of dictionaries containing "name" (property name, "bbox.x0", "bbox.y0", "bbox.x1", "bbox.y1", "layer.id", "layer.name", "item.id", or "item.name"), "range" (numeric range or list of values), and "mod" ("and", "or", or "not"), see get_property_filter, defaults to None
+        :type filters: Union[list,None], optional
         :return: Records-formatted list of dictionaries with each property, along with structure id, bounding box (minx, miny, maxx, maxy), layer id, layer name, item id, and item name
         :rtype: list
         """
@@ -787,91 +2285,572 @@ class fusionDB:
         property_list = list(set(property_list))
 
         with self.get_db() as session:
-            search_query = session.query(
-                *[Structure.properties[p.split(' --> ')] for p in property_list],
-                Structure.id,
-                Structure.geom,
+            layer_query = session.query(
                 Layer.id,
                 Layer.name,
                 Item.id,
                 Item.name
-            ).filter(Structure.layer == Layer.id).filter(Layer.item==Item.id)
+            ).filter(Layer.item==Item.id)
 
             if not item_id is None:
                 if type(item_id)==list:
-                    search_query = search_query.filter(Item.id.in_(item_id))
+                    layer_query = layer_query.filter(Item.id.in_(item_id))
                 elif type(item_id)==str:
-                    search_query = search_query.filter(Item.id == item_id)
+                    layer_query = layer_query.filter(Item.id == item_id)
 
             if not layer_id is None:
                 if type(layer_id)==list:
-                    search_query = search_query.filter(Layer.id.in_(layer_id))
+                    layer_query = layer_query.filter(Layer.id.in_(layer_id))
                 elif type(layer_id)==str:
-                    search_query = search_query.filter(Layer.id==layer_id)
+                    layer_query = layer_query.filter(Layer.id==layer_id)
+
+            if not structure_id is None:
+                structure_layers = select(Structure.layer)
+                if type(structure_id)==list:
+                    structure_layers = structure_layers.where(Structure.id.in_(structure_id))
+                elif type(structure_id)==str:
+                    structure_layers = structure_layers.where(Structure.id==structure_id)
+
+                layer_query = layer_query.filter(Layer.id.in_(structure_layers))
+
+            layer_info = layer_query.all()
+
+        return_list = []
+        json_layers = []
+        for l_id, l_name, i_id, i_name in layer_info:
+            layer_data = None
+            if not self.property_store is None:
+                layer_data = self.property_store.read_layer(
+                    l_id, property_list, structure_id,
+                    filters = filters,
+                    layer_values = {'layer.id': l_id, 'layer.name': l_name, 'item.id': i_id, 'item.name': i_name}
+                )
+
+            if layer_data is None:
+                json_layers.append(l_id)
+                continue
+
+            layer_bboxes = zip(*[layer_data[b] for b in BBOX_COLUMNS])
+            for s_idx, (s_id, s_bbox) in enumerate(zip(layer_data[STRUCTURE_ID_COLUMN],layer_bboxes)):
+                i_dict = {'_index': len(return_list)}
+                for prop_name in property_list:
+                    i_dict[prop_name] = layer_data[prop_name][s_idx]
+
+                i_dict = i_dict | {
+                    'structure.id': s_id,
+                    'layer.id': l_id,
+                    'layer.name': l_name,
+                    'item.id': i_id,
+                    'item.name': i_name,
+                    'bbox': list(s_bbox)
+                }
+                return_list.append(i_dict)
+
+        if len(json_layers)==0:
+            return return_list
+
+        with self.get_db() as session:
+            search_query = session.query(
+                *[Structure.properties[p.split(' --> ')] for p in property_list],
+                Structure.id,
+                Structure.minx,
+                Structure.miny,
+                Structure.maxx,
+                Structure.maxy,
+                Layer.id,
+                Layer.name,
+                Item.id,
+                Item.name
+            ).filter(Structure.layer == Layer.id).filter(Layer.item==Item.id).filter(Layer.id.in_(json_layers))
 
             if not structure_id is None:
                 if type(structure_id)==list:
                     search_query = search_query.filter(Structure.id.in_(structure_id))
                 elif type(structure_id)==str:
                     search_query = search_query.filter(Structure.id==structure_id)
+
+            if not filters is None and len(filters)>0:
+                property_filter = get_property_filter(filters)
+                if not property_filter is None:
+                    search_query = search_query.filter(property_filter)
             
-            returned_props = property_list + ['structure.id','geometry','layer.id','layer.name','item.id','item.name']
-            return_list = []
-            for idx,i in enumerate(search_query.all()):
-                i_dict = {'_index': idx}
+            # Bounding boxes come from the columns filled in at ingest so geometries don't need to be loaded
+            returned_props = property_list + ['structure.id','minx','miny','maxx','maxy','layer.id','layer.name','item.id','item.name']
+            for i in search_query.all():
+                i_dict = {'_index': len(return_list)}
                 for prop,prop_name in zip(i,returned_props):
-                    if not prop_name=='geometry':
+                    if not prop_name in ['minx','miny','maxx','maxy']:
                         i_dict[prop_name] = prop
-                    else:
-                        i_dict['bbox'] = list(shape(prop).bounds)
 
+                i_dict['bbox'] = list(i[len(property_list)+1:len(property_list)+5])
                 return_list.append(i_dict)
 
-            return return_list
+        return return_list
+
+    def structure_bbox_filter(self, bbox:list):
+        """Filter expression for structures whose bounding box intersects bbox, candidates are found using the R*Tree index when available
+
+        :param bbox: Bounding box (minx, miny, maxx, maxy)
+        :type bbox: list
+        :return: SQL filter expression on Structure
+        """
+        bbox_filter = and_(
+            Structure.minx <= bbox[2],
+            Structure.maxx >= bbox[0],
+            Structure.miny <= bbox[3],
+            Structure.maxy >= bbox[1]
+        )
+        if self.spatial_index:
+            # R*Tree coordinates are stored as (outward rounded) 32-bit floats, the exact bounds above are still compared
+            bbox_filter = and_(
+                literal_column('structure.rowid').in_(
+                    select(StructureRTree.c.id).where(
+                        StructureRTree.c.minx <= bbox[2],
+                        StructureRTree.c.maxx >= bbox[0],
+                        StructureRTree.c.miny <= bbox[3],
+                        StructureRTree.c.maxy >= bbox[1]
+                    )
+                ),
+                bbox_filter
+            )
+
+        return bbox_filter
+
+    def get_aggregate_layers(self, item_id:Union[str,list,None] = None, layer_id:Union[str,list,None] = None, user_token:Union[str,None] = None) -> list:
+        """Getting the layers (and their items) included in a property aggregation
+
+        :return: List of tuples containing layer id, layer name, item id, and item name
+        :rtype: list
+        """
+        with self.get_db() as session:
+            layer_query = select(
+                Layer.id,
+                Layer.name,
+                Item.id,
+                Item.name
+            ).join(Item, Layer.item==Item.id).where(self.item_access_filter(user_token))
+
+            if not item_id is None:
+                if type(item_id)==list:
+                    layer_query = layer_query.where(Item.id.in_(item_id))
+                elif type(item_id)==str:
+                    layer_query = layer_query.where(Item.id==item_id)
+
+            if not layer_id is None:
+                if type(layer_id)==list:
+                    layer_query = layer_query.where(Layer.id.in_(layer_id))
+                elif type(layer_id)==str:
+                    layer_query = layer_query.where(Layer.id==layer_id)
+
+            return [tuple(l) for l in session.execute(layer_query).all()]
+
+    def aggregate_layers(self, property_name:str, layer_info:list, bbox:Union[list,None], store_aggregate, sql_aggregate) -> dict:
+        """Computing a partial aggregate of one property for each layer. Layers in the columnar property store are aggregated from their property file, all others with one grouped SQL query.
+
+        :param property_name: Property key path (ex: "main_prop --> sub_prop")
+        :type property_name: str
+        :param layer_info: Layers returned by get_aggregate_layers
+        :type layer_info: list
+        :param bbox: Bounding box (minx, miny, maxx, maxy) used to select structures, defaults to None
+        :type bbox: Union[list,None]
+        :param store_aggregate: Function applied to a layer's property column
+        :type store_aggregate: callable
+        :param sql_aggregate: Function called with a list of layer ids, a SQL filter on Structure, and the session, returning a dictionary of layer id to partial aggregate
+        :type sql_aggregate: callable
+        :return: Dictionary of layer id to partial aggregate (layers without matching structures may be missing)
+        :rtype: dict
+        """
+        layer_aggregates = {}
+        sql_layers = []
+        for l in layer_info:
+            column = None
+            if not self.property_store is None:
+                column = self.property_store.read_column(l[0], property_name, bbox)
+
+            if column is None:
+                sql_layers.append(l[0])
+            else:
+                layer_aggregates[l[0]] = store_aggregate(column)
+
+        if len(sql_layers)>0:
+            structure_filter = Structure.layer.in_(sql_layers)
+            if not bbox is None:
+                structure_filter = and_(structure_filter, self.structure_bbox_filter(bbox))
+
+            with self.get_db() as session:
+                layer_aggregates |= sql_aggregate(sql_layers, structure_filter, session)
+
+        return layer_aggregates
+
+    def get_numeric_layers(self, property_name:str, layer_ids:list, session) -> list:
+        """Layers where a property only has numeric values (according to the property catalog)
+        """
+        return session.scalars(
+            select(PropertyCatalog.layer).where(
+                PropertyCatalog.layer.in_(layer_ids),
+                PropertyCatalog.key==property_name,
+                PropertyCatalog.dtype=='number'
+            )
+        ).all()
+
+    def group_aggregates(self, layer_info:list, layer_aggregates:dict, group_by:Union[str,None], combine) -> Union[dict,list]:
+        """Combining per-layer partial aggregates into one result (group_by = None) or one result for each layer/item
+
+        :return: Combined result or list of dictionaries containing "layer.id", "layer.name" (group_by = "layer"), "item.id", "item.name", and the combined result
+        :rtype: Union[dict,list]
+        """
+        assert group_by in [None,'layer','item']
+
+        if group_by is None:
+            return combine([layer_aggregates[l[0]] for l in layer_info if l[0] in layer_aggregates])
+
+        groups = {}
+        for l_id, l_name, i_id, i_name in layer_info:
+            if group_by=='layer':
+                group_key = l_id
+                group_info = {'layer.id': l_id, 'layer.name': l_name, 'item.id': i_id, 'item.name': i_name}
+            else:
+                group_key = i_id
+                group_info = {'item.id': i_id, 'item.name': i_name}
+
+            if not group_key in groups:
+                groups[group_key] = (group_info, [])
+            if l_id in layer_aggregates:
+                groups[group_key][1].append(layer_aggregates[l_id])
+
+        return [
+            group_info | combine(group_partials)
+            for group_info, group_partials in groups.values()
+        ]
+
+    def get_property_stats(self, property_list:Union[str,list], item_id:Union[str,list,None] = None, layer_id:Union[str,list,None] = None, bbox:Union[list,None] = None, group_by:Union[str,None] = None, user_token:Union[str,None] = None) -> Union[dict,list]:
+        """Getting the count, min, max, and mean of one or more structure properties without loading structures
+
+        :param property_list: One or more property key paths (ex: "main_prop --> sub_prop")
+        :type property_list: Union[str,list]
+        :param item_id: String uuid for one or multiple items, defaults to None
+        :type item_id: Union[str,list,None], optional
+        :param layer_id: String uuid for one or multiple layers, defaults to None
+        :type layer_id: Union[str,list,None], optional
+        :param bbox: Only include structures whose bounding box intersects this box (minx, miny, maxx, maxy), defaults to None
+        :type bbox: Union[list,None], optional
+        :param group_by: Either None (one result), "layer", or "item", defaults to None
+        :type group_by: Union[str,None], optional
+        :param user_token: User token used to check access to non-public items, defaults to None
+        :type user_token: Union[str,None], optional
+        :return: Dictionary of property to "count" (structures with this property), "min", "max", and "mean" (None for non-numeric properties), or a list of these for each group
+        :rtype: Union[dict,list]
+        """
+        if type(property_list)==str:
+            property_list = [property_list]
+
+        layer_info = self.get_aggregate_layers(item_id, layer_id, user_token)
+
+        def combine_property(partials):
+            numeric = sum([p['numeric'] for p in partials])
+            return {
+                'count': sum([p['count'] for p in partials]),
+                'min': min([p['min'] for p in partials if p['numeric']>0], default = None),
+                'max': max([p['max'] for p in partials if p['numeric']>0], default = None),
+                'mean': sum([p['sum'] for p in partials if p['numeric']>0])/numeric if numeric>0 else None
+            }
+
+        # Layer id: {property: partial statistics}
+        layer_aggregates = {}
+        for property_name in property_list:
+            path = property_name.split(' --> ')
+
+            def sql_stats(layer_ids, structure_filter, session):
+                numeric_layers = self.get_numeric_layers(property_name, layer_ids, session)
+                layer_stats = {}
+                # Counting values of any type
+                for l_id, count in session.execute(
+                    select(Structure.layer, func.count(Structure.properties[path].as_string())).where(structure_filter).group_by(Structure.layer)
+                ).all():
+                    layer_stats[l_id] = {'count': count, 'numeric': 0, 'sum': None, 'min': None, 'max': None}
+
+                if len(numeric_layers)>0:
+                    value = Structure.properties[path].as_float()
+                    for l_id, numeric, value_sum, value_min, value_max in session.execute(
+                        select(Structure.layer, func.count(value), func.sum(value), func.min(value), func.max(value)).where(
+                            structure_filter, Structure.layer.in_(numeric_layers)
+                        ).group_by(Structure.layer)
+                    ).all():
+                        # Integer properties are returned as integers by SQLite, matching the property store's float min/max
+                        layer_stats[l_id] |= {'numeric': numeric, 'sum': value_sum, 'min': float(value_min) if numeric>0 else None, 'max': float(value_max) if numeric>0 else None}
+
+                return layer_stats
+
+            for l_id, l_stats in self.aggregate_layers(property_name, layer_info, bbox, get_column_stats, sql_stats).items():
+                layer_aggregates[l_id] = layer_aggregates.get(l_id,{}) | {property_name: l_stats}
+
+        return self.group_aggregates(
+            layer_info,
+            layer_aggregates,
+            group_by,
+            lambda partials: {
+                p: combine_property([l[p] for l in partials if p in l])
+                for p in property_list
+            }
+        )
+
+    def get_property_histogram(self, property_name:str, bins:int = 20, value_range:Union[list,None] = None, item_id:Union[str,list,None] = None, layer_id:Union[str,list,None] = None, bbox:Union[list,None] = None, group_by:Union[str,None] = None, user_token:Union[str,None] = None) -> Union[dict,list]:
+        """Counting numeric values of a structure property in equal-width bins (binning is done in SQL or on the columnar property store)
+
+        :param property_name: Property key path (ex: "main_prop --> sub_prop")
+        :type property_name: str
+        :param bins: Number of bins, defaults to 20
+        :type bins: int, optional
+        :param value_range: Lower and upper limits of the histogram, defaults to None (min and max of the property)
+        :type value_range: Union[list,None], optional
+        :param item_id: String uuid for one or multiple items, defaults to None
+        :type item_id: Union[str,list,None], optional
+        :param layer_id: String uuid for one or multiple layers, defaults to None
+        :type layer_id: Union[str,list,None], optional
+        :param bbox: Only include structures whose bounding box intersects this box (minx, miny, maxx, maxy), defaults to None
+        :type bbox: Union[list,None], optional
+        :param group_by: Either None (one histogram), "layer", or "item" (all groups use the same bins), defaults to None
+        :type group_by: Union[str,None], optional
+        :param user_token: User token used to check access to non-public items, defaults to None
+        :type user_token: Union[str,None], optional
+        :return: Dictionary containing bin "edges" (bins + 1) and "counts" (bins), or a list of these for each group
+        :rtype: Union[dict,list]
+        """
+        if value_range is None:
+            property_stats = self.get_property_stats(property_name, item_id, layer_id, bbox, user_token = user_token)[property_name]
+            if property_stats['min'] is None:
+                value_range = [0.0,0.0]
+            else:
+                value_range = [property_stats['min'],property_stats['max']]
+
+        value_range = [float(value_range[0]), float(value_range[1])]
+        layer_info = self.get_aggregate_layers(item_id, layer_id, user_token)
+        path = property_name.split(' --> ')
+        bin_width = (value_range[1]-value_range[0])/bins or 1.0
+
+        def sql_histogram(layer_ids, structure_filter, session):
+            numeric_layers = self.get_numeric_layers(property_name, layer_ids, session)
+            if len(numeric_layers)==0:
+                return {}
+
+            value = Structure.properties[path].as_float()
+            bin_value = (value - value_range[0]) / bin_width
+            if self.engine.dialect.name=='sqlite':
+                # Values are >= the lower limit so truncating is the same as floor (which isn't in every SQLite build)
+                bin_floor = cast(bin_value, Integer)
+            else:
+                bin_floor = func.floor(bin_value)
+            bin_index = case((value >= value_range[1], bins-1), else_ = bin_floor).label('bin_index')
+
+            layer_counts = {}
+            for l_id, b_idx, count in session.execute(
+                select(Structure.layer, bin_index, func.count()).where(
+                    structure_filter,
+                    Structure.layer.in_(numeric_layers),
+                    value >= value_range[0],
+                    value <= value_range[1]
+                ).group_by(Structure.layer, bin_index)
+            ).all():
+                if not l_id in layer_counts:
+                    layer_counts[l_id] = [0]*bins
+                layer_counts[l_id][min(int(b_idx),bins-1)] += count
+
+            return layer_counts
+
+        layer_aggregates = self.aggregate_layers(
+            property_name,
+            layer_info,
+            bbox,
+            lambda column: get_column_histogram(column, value_range, bins),
+            sql_histogram
+        )
+
+        edges = [value_range[0] + b*bin_width for b in range(bins)] + [value_range[1]]
+        return self.group_aggregates(
+            layer_info,
+            layer_aggregates,
+            group_by,
+            lambda partials: {'edges': edges, 'counts': [sum(c) for c in zip(*partials)] if len(partials)>0 else [0]*bins}
+        )
+
+    def get_property_counts(self, property_name:str, item_id:Union[str,list,None] = None, layer_id:Union[str,list,None] = None, bbox:Union[list,None] = None, group_by:Union[str,None] = None, user_token:Union[str,None] = None) -> Union[dict,list]:
+        """Counting the number of structures with each value of a (categorical) structure property
+
+        :param property_name: Property key path (ex: "main_prop --> sub_prop")
+        :type property_name: str
+        :param item_id: String uuid for one or multiple items, defaults to None
+        :type item_id: Union[str,list,None], optional
+        :param layer_id: String uuid for one or multiple layers, defaults to None
+        :type layer_id: Union[str,list,None], optional
+        :param bbox: Only include structures whose bounding box intersects this box (minx, miny, maxx, maxy), defaults to None
+        :type bbox: Union[list,None], optional
+        :param group_by: Either None (one result), "layer", or "item", defaults to None
+        :type group_by: Union[str,None], optional
+        :param user_token: User token used to check access to non-public items, defaults to None
+        :type user_token: Union[str,None], optional
+        :return: Dictionary containing "values" and their "counts" (most common first), or a list of these for each group
+        :rtype: Union[dict,list]
+        """
+        layer_info = self.get_aggregate_layers(item_id, layer_id, user_token)
+        path = property_name.split(' --> ')
+
+        def sql_counts(layer_ids, structure_filter, session):
+            value = Structure.properties[path].label('value')
+            layer_counts = {}
+            for l_id, v, count in session.execute(
+                select(Structure.layer, value, func.count()).where(structure_filter).group_by(Structure.layer, value)
+            ).all():
+                # Nested dictionaries/lists can't be counted as values
+                if type(v) in [int,float,str,bool]:
+                    if not l_id in layer_counts:
+                        layer_counts[l_id] = {}
+                    layer_counts[l_id][v] = count
+
+            return layer_counts
+
+        def combine(partials):
+            value_counts = {}
+            for p in partials:
+                for v, count in p.items():
+                    value_counts[v] = value_counts.get(v,0) + count
+
+            value_counts = sorted(value_counts.items(), key = lambda v: v[1], reverse = True)
+            return {
+                'values': [v[0] for v in value_counts],
+                'counts': [v[1] for v in value_counts]
+            }
+
+        layer_aggregates = self.aggregate_layers(property_name, layer_info, bbox, get_column_counts, sql_counts)
+
+        return self.group_aggregates(layer_info, layer_aggregates, group_by, combine)
+
+    def get_cohort_property_data(self, item_id:Union[str,list], include_keys:list, include_anns:Union[str,list,None] = None, filters:Union[list,None] = None, user_token:Union[str,None] = None) -> dict:
+        """Getting selected properties of structures across many items at once (filters are applied while reading each layer so only matching structures are returned)
+
+        :param item_id: String uuid for one or multiple items
+        :type item_id: Union[str,list]
+        :param include_keys: Columns to return. Either property names (nested keys separated by "-->", optionally prefixed with "data.") or one of "annotation.id", "annotation.name", "item.id", "item.name", "bbox.x0", "bbox.y0", "bbox.x1", "bbox.y1"
+        :type include_keys: list
+        :param include_anns: Which layers to include (names/ids or "__all__"), defaults to None (all layers)
+        :type include_anns: Union[str,list,None], optional
+        :param filters: List of dictionaries containing "name" (a key as in include_keys), "range" (numeric range or list of values), and "mod" ("and", "or", or "not"), defaults to None
+        :type filters: Union[list,None], optional
+        :param user_token: User token used to check access to non-public items, defaults to None
+        :type user_token: Union[str,None], optional
+        :return: Dictionary containing "columns" (include_keys), "data" (one list of values for each structure), and "items" (ids of items that were found)
+        :rtype: dict
+        """
+        if type(item_id)==str:
+            item_id = [item_id]
+        if include_anns is None:
+            include_anns = '__all__'
+        elif type(include_anns)==str and not include_anns=='__all__':
+            include_anns = [include_anns]
+        if filters is None:
+            filters = []
+
+        # Accepting either layer name or id
+        layer_info = [
+            l for l in self.get_aggregate_layers(item_id, None, user_token)
+            if include_anns=='__all__' or l[0] in include_anns or l[1] in include_anns
+        ]
+
+        bbox_list = ['bbox.x0','bbox.y0','bbox.x1','bbox.y1']
+        non_feature_keys = {
+            'annotation.id': 'layer.id',
+            'annotation.name': 'layer.name',
+            'item.id': 'item.id',
+            'item.name': 'item.name'
+        }
+
+        def get_value(record, key):
+            key = key.replace('data.','')
+            if key in non_feature_keys:
+                return record.get(non_feature_keys[key])
+            elif key in bbox_list:
+                return record['bbox'][bbox_list.index(key)]
+
+            value = record.get(' --> '.join([sk.strip() for sk in key.split('-->')]))
+            # Converting to float if able
+            if value is not None and not type(value) in [dict,list]:
+                try:
+                    value = float(value)
+                except ValueError:
+                    pass
+
+            return value
+
+        def get_filter_name(key):
+            key = key.replace('data.','')
+            if key in non_feature_keys:
+                return non_feature_keys[key]
+            elif key in bbox_list:
+                return key
+            return ' --> '.join([sk.strip() for sk in key.split('-->')])
+
+        property_list = list(set([
+            get_filter_name(k) for k in include_keys
+            if not k.replace('data.','') in list(non_feature_keys.keys())+bbox_list
+        ]))
+
+        data_list = []
+        if len(layer_info)>0:
+            structure_data = self.get_structure_property_data(
+                layer_id = [l[0] for l in layer_info],
+                property_list = property_list,
+                filters = [f | {'name': get_filter_name(f['name'])} for f in filters]
+            )
+            for f in structure_data:
+                data_list.append([get_value(f, k) for k in include_keys])
+
+        return {
+            'columns': include_keys,
+            'data': data_list,
+            'items': list(dict.fromkeys([l[2] for l in layer_info]))
+        }
 
-    def get_structures_in_bbox(self, bbox:list, item_id:Union[str,None] = None, layer_id:Union[str,list,None] = None, structure_id:Union[str,list,None] = None, user_token:Union[str,list,None] = None):
-        """Querying database for structures that intersect with a 
+    def get_structures_in_bbox(self, bbox:list, item_id:Union[str,None] = None, layer_id:Union[str,list,None] = None, structure_id:Union[str,list,None] = None, user_token:Union[str,list,None] = None, ids_only:bool = True):
+        """Querying database for structures that intersect with a bounding box.
 
-        :param bbox: _description_
+        Candidate structures are selected using the spatial index (or the indexed bounding box columns) so only those structures are checked for exact intersection.
+
+        :param bbox: Bounding box to query (minx, miny, maxx, maxy)
         :type bbox: list
-        :param item_id: _description_, defaults to None
+        :param item_id: String uuid for an item, defaults to None
         :type item_id: Union[str,None], optional
-        :param layer_id: _description_, defaults to None
+        :param layer_id: String uuid for one or multiple layers, defaults to None
         :type layer_id: Union[str,list,None], optional
-        :param structure_id: _description_, defaults to None
+        :param structure_id: String uuid for one or multiple structures, defaults to None
         :type structure_id: Union[str,list,None], optional
-        :return: _description_
-        :rtype: _type_
+        :param user_token: User token used to check access to non-public items, defaults to None (public items only)
+        :type user_token: Union[str,list,None], optional
+        :param ids_only: Whether to return only structure ids or dictionaries containing "id", "geom", "properties", and "layer", defaults to True
+        :type ids_only: bool, optional
+        :return: List of intersecting structure ids (or dictionaries if ids_only = False)
+        :rtype: list
         """
         
-        #TODO: Test the performance of this using shape().intersects() vs. checking min/max ranges for bounding boxes
         with self.get_db() as session:
-            start = time.time()
+            # Geometries are read without decoding so that WKB can go straight to shapely
             search_query = session.query(
                 Structure.id,
-                Structure.geom
+                type_coerce(Structure.geom, LargeBinary),
+                Structure.properties,
+                Structure.layer
             ).filter(Layer.item==Item.id).filter(Structure.layer==Layer.id)
 
+            # Same access rules as the other item reads (structures in items without access are excluded whether or not item_id is provided)
+            search_query = search_query.filter(self.item_access_filter(user_token))
+
             if not item_id is None:
                 if type(item_id)==str:
-                    search_query = search_query.filter(Item.id == item_id)
-
-                if not user_token is None:
-                    query_user = self.get_user(
-                        user_token = user_token
-                    )
-                    if not query_user is None:
-                        search_query = search_query.filter(or_(Item.public==True,Item.user_access.any(id = query_user.get('id'))))
-                    else:
-                        search_query = search_query.filter(Item.public==True)
-                else:
-                    search_query = search_query.filter(Item.public==True)
+                    search_query = search_query.filter(Structure.item == item_id)
 
             if not layer_id is None:
                 if type(layer_id)==list:
-                    search_query = search_query.filter(Layer.id.in_(layer_id))
+                    search_query = search_query.filter(Structure.layer.in_(layer_id))
                 elif type(layer_id)==str:
-                    search_query = search_query.filter(Layer.id==layer_id)
+                    search_query = search_query.filter(Structure.layer==layer_id)
 
             if not structure_id is None:
                 if type(structure_id)==list:
@@ -880,42 +2859,57 @@ class fusionDB:
                     search_query = search_query.filter(Structure.id==structure_id)
 
             # Box should be minx, miny, maxx, maxy
+            search_query = search_query.filter(self.structure_bbox_filter(bbox))
+
             query_box = box(*bbox)
             return_list = []
-            for idx,i in enumerate(search_query.all()):
-                structure_id = i[0]
-                structure_geom = i[1]
-                if shape(structure_geom).intersects(query_box):
-                    return_list.append(structure_id)
+            for i in search_query.order_by(self.structure_order).all():
+                if geometry_to_shape(i[1]).intersects(query_box):
+                    if ids_only:
+                        return_list.append(i[0])
+                    else:
+                        return_list.append({
+                            'id': i[0],
+                            'geom': decode_geometry(i[1]),
+                            'properties': i[2],
+                            'layer': i[3]
+                        })
 
             return return_list
 
-    def get_structure_generator(self, item_id: Union[str,list,None] = None, layer_id:Union[str,list,None] = None, structure_id:Union[str,list,None] = None, user_token:Union[str,None] = None):
+    def get_structure_generator(self, item_id: Union[str,list,None] = None, layer_id:Union[str,list,None] = None, structure_id:Union[str,list,None] = None, user_token:Union[str,None] = None, chunk_size:int = 1000) -> Generator:
+        """Generator for structures matching id filters, rows are fetched from the database in chunks as they are consumed
 
-        with self.get_db() as session:
+        :param item_id: String uuid for one or multiple items, defaults to None
+        :type item_id: Union[str,list,None], optional
+        :param layer_id: String uuid for one or multiple layers, defaults to None
+        :type layer_id: Union[str,list,None], optional
+        :param structure_id: String uuid for one or multiple structures, defaults to None
+        :type structure_id: Union[str,list,None], optional
+        :param user_token: User token used to check access to non-public items, defaults to None (public items only)
+        :type user_token: Union[str,None], optional
+        :param chunk_size: Number of rows fetched from the cursor at a time, defaults to 1000
+        :type chunk_size: int, optional
+        :yield: Rows containing (id, geom, properties)
+        :rtype: Generator
+        """
+
+        with self.get_db(stream = True) as session:
             search_query = session.query(
                 Structure.id,
                 Structure.geom,
                 Structure.properties
             ).filter(Layer.item==Item.id).filter(Structure.layer==Layer.id)
 
+            # Same access rules as the other item reads (structures in items without access are excluded whether or not item_id is provided)
+            search_query = search_query.filter(self.item_access_filter(user_token))
+
             if not item_id is None:
                 if type(item_id)==list:
                     search_query = search_query.filter(Item.id.in_(item_id))
                 elif type(item_id)==str:
                     search_query = search_query.filter(Item.id == item_id)
 
-                if not user_token is None:
-                    query_user = self.get_user(
-                        user_token = user_token
-                    )
-                    if not query_user is None:
-                        search_query = search_query.filter(or_(Item.public==True,Item.user_access.any(id = query_user.get('id'))))
-                    else:
-                        search_query = search_query.filter(Item.public==True)
-                else:
-                    search_query = search_query.filter(Item.public==True)
-
             if not layer_id is None:
                 if type(layer_id)==list:
                     search_query = search_query.filter(Layer.id.in_(layer_id))
@@ -928,79 +2922,47 @@ class fusionDB:
                 elif type(structure_id)==str:
                     search_query = search_query.filter(Structure.id==structure_id)
             
-            #returned_props = ['structure.id','geometry','structure.properties']
-            #return_list = []
-            #for idx,i in enumerate(search_query.all()):
-            #    i_dict = {'_index': idx}
-            #    for prop,prop_name in zip(i,returned_props):
-            #        i_dict[prop_name] = prop
-
-            #    return_list.append(i_dict)
-
-            #return return_list
-            return search_query.all()
+            for row in search_query.yield_per(chunk_size):
+                yield row
 
     def get_layers(self, item_id, user_token: Union[str,None] = None) -> list:
-        
-        # Check user has access to item (or item is public)
-        # Get layer ids associated with that item
-        # Get structures associated with that layer
-        # Assemble FeatureCollection objects
-
-        if not user_token is None:
-            query_user = self.get_user(
-                user_token = user_token
-            )
+        """Getting all layers for an item as GeoJSON FeatureCollections (empty if the user can't access the item)
 
-            user_access_list = self.check_user_access(user_id = query_user.get('id'), admin = query_user.get('admin'))
-        else:
-            user_access_list = []
-
-        with self.get_db() as session:
-            item_query = session.query(
-                Item
-            ).filter(Item.id==item_id).first()
-
-            if not item_query.to_dict().get('public'):
-                if not item_id in user_access_list:
-                    return []
-            
-            layer_query = session.query(
-                Layer.name,
-                Layer.id,
-                Layer.item
-            ).filter(Layer.item==item_id)
+        :param item_id: String uuid for an item
+        :type item_id: str
+        :param user_token: User token used to check access to non-public items, defaults to None
+        :type user_token: Union[str,None], optional
+        :return: List of FeatureCollections, one per layer
+        :rtype: list
+        """
 
-            feature_collection_list = []
-            for l in layer_query.all():
-                #print(f'{l=}, (item_id={item_id})')
-                if not l[2]==item_id:
-                    continue
+        # Layer metadata (access checked in the same query), then one cursor for structures in all layers
+        item_layers = self.get_layer_counts(item_id, user_token)
+        if len(item_layers)==0:
+            return []
 
-                feature_collection = {
-                    'type': 'FeatureCollection',
-                    'features': [],
-                    'properties': {
-                        'name': l[0],
-                        '_id': l[1]
-                    }
+        layer_structures = {
+            l_id: [
+                {
+                    'type': 'Feature',
+                    'geometry': s.geom,
+                    'properties': s.properties
                 }
+                for s in l_structures
+            ]
+            for l_id, l_structures in groupby(self.get_item_structures(item_id, user_token = user_token), key = lambda s: s[0])
+        }
 
-                structure_query = session.query(
-                    Structure.geom,
-                    Structure.properties,
-                    Structure.layer
-                ).filter(Structure.layer==l[1])
-
-                for s in structure_query.all():
-                    feature_collection['features'].append({
-                        'type': 'Feature',
-                        'geometry': s[0],
-                        'properties': s[1]
-                    })
-
-
-                feature_collection_list.append(feature_collection)
-
-            return feature_collection_list
+        feature_collection_list = [
+            {
+                'type': 'FeatureCollection',
+                'features': layer_structures.get(l.get('id'),[]),
+                'properties': {
+                    'name': l.get('name'),
+                    '_id': l.get('id')
+                }
+            }
+            for l in item_layers
+        ]
 
+        return feature_collection_list
@@ -2,31 +2,200 @@
 Defining models for fusionDB
 """
 import enum
+import json
 from typing import List
+from typing_extensions import Union
 from sqlalchemy import (
     Table, Column, String, 
-    Boolean, Integer, ForeignKey, 
-    JSON, DateTime, Enum
+    Boolean, Integer, Float, ForeignKey, 
+    JSON, DateTime, Enum, Index, LargeBinary, MetaData
 )
+from sqlalchemy.types import TypeDecorator
 from sqlalchemy.orm import (
     declarative_base, mapped_column, relationship,
     Mapped    
 )
 import bcrypt
 
-from shapely.geometry import box
+import shapely
+from shapely.geometry import box, shape
 
 #TODO: Current access control rules specify that if an item is not public then everything associated with that item is also not public
 # Likewise, if a user has access to an item, they will have access to everything on that item.
 
 Base = declarative_base()
 
+# Prefixes for WKB-encoded geometries (JSON-encoded geometries start with "{")
+WKB_FLOAT_PREFIX = b'W'
+WKB_INT_PREFIX = b'I'
+
+GEOMETRY_DEPTHS = {
+    'Point': 0,
+    'MultiPoint': 1,
+    'LineString': 1,
+    'MultiLineString': 2,
+    'Polygon': 2,
+    'MultiPolygon': 3
+}
+
+def check_wkb_coordinates(coords, depth:int, coord_types:set) -> bool:
+    """Checking that GeoJSON coordinates are 2D positions nested to the expected depth (collecting the types of coordinate values)
+
+    :param coords: GeoJSON coordinates (nested lists)
+    :type coords: list
+    :param depth: Nesting depth of positions in coords (0 for a single position)
+    :type depth: int
+    :param coord_types: Set which collects the types of coordinate values
+    :type coord_types: set
+    :return: Whether these coordinates are valid for WKB encoding
+    :rtype: bool
+    """
+    if not type(coords)==list:
+        return False
+
+    if depth==0:
+        if not len(coords)==2:
+            return False
+        coord_types.update([type(coords[0]),type(coords[1])])
+        return True
+
+    if len(coords)==0:
+        return False
+
+    return all([check_wkb_coordinates(c, depth-1, coord_types) for c in coords])
+
+def check_wkb_parts(geom:dict) -> bool:
+    """Checking that line strings have at least 2 positions and polygon rings are closed with at least 4 positions (otherwise shapely would modify them)
+
+    :param geom: GeoJSON geometry
+    :type geom: dict
+    :return: Whether all parts are valid
+    :rtype: bool
+    """
+    if geom.get('type')=='LineString':
+        return len(geom.get('coordinates'))>=2
+    elif geom.get('type')=='MultiLineString':
+        return all([len(l)>=2 for l in geom.get('coordinates')])
+    elif geom.get('type') in ['Polygon','MultiPolygon']:
+        polygons = [geom.get('coordinates')] if geom.get('type')=='Polygon' else geom.get('coordinates')
+        return all([len(r)>=4 and r[0]==r[-1] for p in polygons for r in p])
+
+    return True
+
+def encode_geometry(geom:Union[dict,None], geometry_format:str = 'json') -> Union[bytes,None]:
+    """Encoding a GeoJSON geometry for storage in the database. Geometries which can't be exactly recovered from WKB are stored as JSON.
+
+    :param geom: GeoJSON geometry
+    :type geom: Union[dict,None]
+    :param geometry_format: Either "json" or "wkb", defaults to "json"
+    :type geometry_format: str, optional
+    :return: Encoded geometry
+    :rtype: Union[bytes,None]
+    """
+    if geom is None:
+        return None
+
+    if geometry_format=='wkb' and geom.get('type') in GEOMETRY_DEPTHS and len(geom)==2:
+        coord_types = set()
+        if check_wkb_coordinates(geom.get('coordinates'), GEOMETRY_DEPTHS.get(geom.get('type')), coord_types) and check_wkb_parts(geom):
+            shapely_geom = shape(geom)
+            if coord_types=={float}:
+                return WKB_FLOAT_PREFIX + shapely.to_wkb(shapely_geom)
+            elif coord_types=={int} and max([abs(v) for v in shapely_geom.bounds])<2**53:
+                # Integer coordinates are converted back to int when decoding
+                return WKB_INT_PREFIX + shapely.to_wkb(shapely_geom)
+
+    return json.dumps(geom).encode('utf-8')
+
+def shape_to_coordinates(geom, int_coords:bool = False) -> dict:
+    """Converting a shapely geometry back to a GeoJSON geometry (lists instead of tuples, optionally integer coordinates)
+
+    :param geom: Shapely geometry
+    :type geom: shapely.Geometry
+    :param int_coords: Whether coordinate values should be converted to int, defaults to False
+    :type int_coords: bool, optional
+    :return: GeoJSON geometry
+    :rtype: dict
+    """
+    if int_coords:
+        position = lambda c: [int(c[0]),int(c[1])]
+    else:
+        position = lambda c: [c[0],c[1]]
+
+    geom_type = geom.geom_type
+    if geom_type=='Point':
+        coordinates = position(geom.coords[0])
+    elif geom_type=='LineString':
+        coordinates = [position(c) for c in geom.coords]
+    elif geom_type=='Polygon':
+        coordinates = [[position(c) for c in geom.exterior.coords]] + [[position(c) for c in r.coords] for r in geom.interiors]
+    else:
+        coordinates = [shape_to_coordinates(g, int_coords)['coordinates'] for g in geom.geoms]
+
+    return {
+        'type': geom_type,
+        'coordinates': coordinates
+    }
+
+def decode_geometry(value:Union[bytes,str,None]) -> Union[dict,None]:
+    """Decoding a geometry stored in the database (WKB or JSON) to a GeoJSON geometry
+
+    :param value: Encoded geometry
+    :type value: Union[bytes,str,None]
+    :return: GeoJSON geometry
+    :rtype: Union[dict,None]
+    """
+    if value is None:
+        return None
+    if type(value)==str:
+        return json.loads(value)
+
+    value = bytes(value)
+    if value[:1] in [WKB_FLOAT_PREFIX,WKB_INT_PREFIX]:
+        return shape_to_coordinates(shapely.from_wkb(value[1:]), value[:1]==WKB_INT_PREFIX)
+    else:
+        return json.loads(value)
+
+def geometry_to_shape(value:Union[bytes,str,None]):
+    """Getting a shapely geometry directly from an encoded geometry (skips GeoJSON conversion for WKB)
+
+    :param value: Encoded geometry
+    :type value: Union[bytes,str,None]
+    :return: Shapely geometry
+    :rtype: shapely.Geometry
+    """
+    if value is None:
+        return None
+    if not type(value)==str:
+        value = bytes(value)
+        if value[:1] in [WKB_FLOAT_PREFIX,WKB_INT_PREFIX]:
+            return shapely.from_wkb(value[1:])
+
+    return shape(json.loads(value))
+
+class Geometry(TypeDecorator):
+    """GeoJSON geometry column stored as either JSON or WKB (see fusionDB geometry_format), decoded to GeoJSON when loaded"""
+    impl = LargeBinary
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        if value is None or type(value)==bytes:
+            return value
+        return encode_geometry(value)
+
+    def process_result_value(self, value, dialect):
+        return decode_geometry(value)
+
+
 # Which users can access which items
 UserAccess = Table(
     'user_access',
     Base.metadata,
     Column('user_id',String,ForeignKey('user.id',ondelete='CASCADE')),
-    Column('item_id',String,ForeignKey('item.id',ondelete='CASCADE'))
+    Column('item_id',String,ForeignKey('item.id',ondelete='CASCADE')),
+    # Access checks look up items by user and users by item
+    Index('ix_user_access_user_item','user_id','item_id'),
+    Index('ix_user_access_item','item_id')
 )
 
 class User(Base):
@@ -42,7 +211,10 @@ class User(Base):
     admin = Column(Boolean)
     updated = Column(DateTime)
 
-    token = Column(String)
+    # Users created for guest visualization sessions (removed by fusionDB.expire_sessions once they have no sessions)
+    guest = Column(Boolean)
+
+    token = Column(String, index = True)
 
     item_access: Mapped[List["Item"]] = relationship(
         secondary = UserAccess, back_populates="user_access"
@@ -67,6 +239,7 @@ class User(Base):
             'meta': self.meta,
             'external': self.external,
             'admin': self.admin,
+            'guest': self.guest,
             'updated': self.updated,
             'token': self.token
         }
@@ -116,6 +289,9 @@ class Item(Base):
 
     public = Column(Boolean)
 
+    # Hash of the image/annotation sources this item was ingested from (used to skip unchanged items on restart)
+    source_hash = Column(String)
+
     user_access: Mapped[List["User"]] = relationship(
         secondary = UserAccess, back_populates="item_access"
     )
@@ -195,10 +371,22 @@ class Layer(Base):
 
         return layer_dict
 
+# SQLite R*Tree spatial index on structure bounding boxes (id is the structure rowid), kept in sync by triggers created in fusionDB.create_spatial_index
+# Defined on its own MetaData since virtual tables aren't created by create_all
+StructureRTree = Table(
+    'structure_rtree',
+    MetaData(),
+    Column('id',Integer,primary_key=True),
+    Column('minx',Float),
+    Column('maxx',Float),
+    Column('miny',Float),
+    Column('maxy',Float)
+)
+
 class Structure(Base):
     __tablename__ = 'structure'
     id = mapped_column(String(24),primary_key = True)
-    geom = Column(JSON)
+    geom = Column(Geometry)
 
     properties = Column(JSON)
 
@@ -206,8 +394,21 @@ class Structure(Base):
     item = mapped_column(ForeignKey('item.id'))
     updated = Column(DateTime)
 
+    # Bounding box of geom, filled in at ingest and used for spatial queries
+    minx = Column(Float)
+    miny = Column(Float)
+    maxx = Column(Float)
+    maxy = Column(Float)
+    centroid_x = Column(Float)
+    centroid_y = Column(Float)
+
     meta = Column(JSON)
 
+    __table_args__ = (
+        Index('ix_structure_layer_bbox','layer','minx','maxx','miny','maxy'),
+        Index('ix_structure_item_bbox','item','minx','maxx','miny','maxy'),
+    )
+
     def to_dict(self):
         structure_dict = {
             'id': self.id,
@@ -229,6 +430,51 @@ class Structure(Base):
 
         return geojson_dict
 
+class PropertyCatalog(Base):
+    __tablename__ = 'property_catalog'
+    id = mapped_column(String(24),primary_key = True)
+
+    # Property key path (nested keys joined with " --> ")
+    key = Column(String)
+    dtype = Column(String)
+    count = Column(Integer)
+
+    # Numeric range
+    min = Column(Float)
+    max = Column(Float)
+
+    # Unique values (None if the number of unique values is greater than the cardinality limit)
+    distinct = Column(JSON)
+    distinct_count = Column(Integer)
+
+    layer = mapped_column(ForeignKey('layer.id'))
+    item = mapped_column(ForeignKey('item.id'))
+    updated = Column(DateTime)
+
+    meta = Column(JSON)
+
+    __table_args__ = (
+        Index('ix_property_catalog_item_layer','item','layer','key'),
+    )
+
+    def to_dict(self):
+        catalog_dict = {
+            'id': self.id,
+            'key': self.key,
+            'dtype': self.dtype,
+            'count': self.count,
+            'min': self.min,
+            'max': self.max,
+            'distinct': self.distinct,
+            'distinct_count': self.distinct_count,
+            'layer': self.layer,
+            'item': self.item,
+            'meta': self.meta,
+            'updated': self.updated
+        }
+
+        return catalog_dict
+
 class ImageOverlay(Base):
     __tablename__ = 'image_overlay'
     id = mapped_column(String(24),primary_key = True)
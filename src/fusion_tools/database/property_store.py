@@ -0,0 +1,364 @@
+"""
+Columnar (Parquet) storage for structure properties in fusionDB
+"""
+import os
+import json
+import uuid
+import numpy as np
+
+from typing_extensions import Union
+
+try:
+    import pyarrow
+    import pyarrow.parquet as parquet
+    import pyarrow.compute as compute
+except ImportError:
+    pyarrow = None
+    parquet = None
+    compute = None
+
+from fusion_tools.utils.shapes import extract_nested_prop, extract_listed_prop, find_nested_levels
+
+# Columns stored alongside the structure properties in each layer file
+STRUCTURE_ID_COLUMN = '__structure_id__'
+BBOX_COLUMNS = ['__minx__','__miny__','__maxx__','__maxy__']
+# Schema metadata key listing columns with mixed value types (saved as JSON strings)
+JSON_COLUMNS_KEY = b'json_columns'
+# Bounding box filter keys (see fusionDB.get_structure_property_data) to stored columns
+BBOX_FILTER_KEYS = dict(zip(['bbox.x0','bbox.y0','bbox.x1','bbox.y1'], BBOX_COLUMNS))
+
+
+def flatten_properties(properties:Union[dict,None]) -> dict:
+    """Flattening nested structure properties into key paths (the same paths used in the property catalog)
+
+    :param properties: Structure properties dictionary
+    :type properties: Union[dict,None]
+    :return: Dictionary of key path (ex: "main_prop --> sub_prop") to value
+    :rtype: dict
+    """
+    flat_properties = {}
+    if properties is None:
+        return flat_properties
+
+    for p,v in properties.items():
+        if type(v)==dict:
+            values_list = extract_nested_prop({p: v}, find_nested_levels({p: v}), (), [])
+        elif type(v)==list:
+            values_list = extract_listed_prop(v, (p,), [])
+        elif type(v) in [int,float,str,bool]:
+            values_list = [{p: v}]
+        else:
+            continue
+
+        for val in values_list:
+            flat_properties.update(val)
+
+    return flat_properties
+
+
+def get_column_array(values:list):
+    """Converting a list of property values to a typed arrow array (int, float, bool, or string, mixed types are JSON-encoded)
+
+    :param values: List of property values (None where a structure doesn't have this property)
+    :type values: list
+    :return: Arrow array and whether the values were JSON-encoded
+    :rtype: tuple
+    """
+    value_types = set([type(v) for v in values if not v is None])
+    if value_types==set([int]):
+        return pyarrow.array(values, type = pyarrow.int64()), False
+    elif len(value_types)>0 and value_types <= set([int,float]):
+        return pyarrow.array(values, type = pyarrow.float64()), False
+    elif value_types==set([bool]):
+        return pyarrow.array(values, type = pyarrow.bool_()), False
+    elif value_types <= set([str]):
+        return pyarrow.array(values, type = pyarrow.string()), False
+    else:
+        return pyarrow.array([json.dumps(v) if not v is None else None for v in values], type = pyarrow.string()), True
+
+
+def is_numeric_column(column) -> bool:
+    return pyarrow.types.is_integer(column.type) or pyarrow.types.is_floating(column.type)
+
+
+def is_numeric_range(value_range:list) -> bool:
+    return len(value_range)==2 and all([type(r) in [int,float] for r in value_range])
+
+
+def get_filter_expression(layer_schema, filters:list, layer_values:dict):
+    """Arrow filter expression for structure property filters on one layer's file (same rules as fusionDB's SQL property filters)
+
+    :param layer_schema: Schema of the layer file
+    :type layer_schema: pyarrow.Schema
+    :param filters: List of dictionaries containing "name" (property key path, "bbox.x0", "bbox.y0", "bbox.x1", "bbox.y1", or a key in layer_values), "range" (numeric range or list of values), and "mod" ("and", "or", or "not")
+    :type filters: list
+    :param layer_values: Dictionary containing "layer.id", "layer.name", "item.id", and "item.name" for this layer
+    :type layer_values: dict
+    :return: Filter expression or None if a filter can't be applied to this file (nested dictionary, mixed value types, or a numeric range on a string column)
+    :rtype: Union[pyarrow.compute.Expression,None]
+    """
+    json_columns = json.loads((layer_schema.metadata or {}).get(JSON_COLUMNS_KEY,b'[]'))
+
+    def filter_condition(f):
+        name = BBOX_FILTER_KEYS.get(f['name'],f['name'])
+        numeric_range = is_numeric_range(f['range'])
+        if name in layer_values:
+            # Same value for every structure in this layer
+            value = layer_values[name]
+            if numeric_range:
+                matched = type(value) in [int,float] and f['range'][0]<=value<=f['range'][1]
+            else:
+                matched = value in f['range']
+            return compute.scalar(matched!=(f.get('mod')=='not'))
+
+        if not name in layer_schema.names:
+            if any([c.startswith(f'{name} --> ') or c.startswith(f'{name} --+ ') for c in layer_schema.names]):
+                return None
+            # Property isn't in this layer (every value is null)
+            return compute.scalar(f.get('mod')=='not')
+
+        column_type = layer_schema.field(name).type
+        numeric = pyarrow.types.is_integer(column_type) or pyarrow.types.is_floating(column_type) or pyarrow.types.is_boolean(column_type)
+        if name in json_columns or not (numeric or pyarrow.types.is_string(column_type)):
+            return None
+
+        field = compute.field(name)
+        if numeric_range:
+            if not numeric:
+                return None
+            condition = (field.cast(pyarrow.float64())>=f['range'][0]) & (field.cast(pyarrow.float64())<=f['range'][1])
+        elif numeric:
+            condition = field.cast(pyarrow.float64()).isin([float(r) for r in f['range'] if type(r) in [int,float]])
+        else:
+            condition = field.isin([r for r in f['range'] if type(r)==str])
+
+        if f.get('mod')=='not':
+            # Structures without this property pass "not" filters
+            condition = ~condition | field.is_null()
+
+        return condition
+
+    # Structures must pass all "and"/"not" filters, "or" filters are only used if there aren't any "and"/"not" filters
+    and_filters = [f for f in filters if f.get('mod') in ['and','not']]
+    conditions = [filter_condition(f) for f in (and_filters if len(and_filters)>0 else [f for f in filters if f.get('mod')=='or'])]
+    if any([c is None for c in conditions]):
+        return None
+    elif len(conditions)==0:
+        return compute.scalar(True)
+
+    filter_expression = conditions[0]
+    for c in conditions[1:]:
+        filter_expression = filter_expression & c if len(and_filters)>0 else filter_expression | c
+
+    return filter_expression
+
+
+def get_column_stats(column) -> dict:
+    """Partial summary statistics for a property column (combined across layers by fusionDB)
+
+    :param column: Arrow array of property values
+    :type column: pyarrow.ChunkedArray
+    :return: Dictionary containing "count" (non-null values), "numeric" (number of numeric values), and "sum", "min", "max" (floats, None for non-numeric columns)
+    :rtype: dict
+    """
+    column_stats = {
+        'count': len(column) - column.null_count,
+        'numeric': 0,
+        'sum': None,
+        'min': None,
+        'max': None
+    }
+    if is_numeric_column(column) and column_stats['count']>0:
+        min_max = compute.min_max(column).as_py()
+        column_stats |= {
+            'numeric': column_stats['count'],
+            'sum': compute.sum(column).as_py(),
+            'min': float(min_max['min']),
+            'max': float(min_max['max'])
+        }
+
+    return column_stats
+
+
+def get_column_histogram(column, value_range:list, bins:int) -> list:
+    """Counting numeric values of a property column in equal-width bins (values equal to the upper limit are counted in the last bin)
+
+    :param column: Arrow array of property values
+    :type column: pyarrow.ChunkedArray
+    :param value_range: Lower and upper limits of the histogram
+    :type value_range: list
+    :param bins: Number of bins
+    :type bins: int
+    :return: Count of values in each bin
+    :rtype: list
+    """
+    if not is_numeric_column(column):
+        return [0]*bins
+
+    values = compute.drop_null(column).to_numpy()
+    values = values[(values>=value_range[0]) & (values<=value_range[1])]
+    bin_width = (value_range[1]-value_range[0])/bins or 1.0
+    bin_index = np.minimum(np.floor((values-value_range[0])/bin_width).astype(int), bins-1)
+
+    return np.bincount(bin_index, minlength = bins).tolist()
+
+
+def get_column_counts(column) -> dict:
+    """Counting each unique (non-null) value in a property column
+
+    :param column: Arrow array of property values
+    :type column: pyarrow.ChunkedArray
+    :return: Dictionary of value to count
+    :rtype: dict
+    """
+    return {
+        v['values']: v['counts']
+        for v in compute.value_counts(compute.drop_null(column)).to_pylist()
+    }
+
+
+class PropertyStore:
+    def __init__(self, store_dir:str):
+        """One Parquet file per layer containing each structure's id, bounding box, and (flattened) properties
+
+        :param store_dir: Directory where layer files are saved
+        :type store_dir: str
+        """
+        self.store_dir = store_dir
+        os.makedirs(self.store_dir, exist_ok = True)
+
+    def layer_path(self, layer_id:str) -> str:
+        return os.path.join(self.store_dir, f'{layer_id}.parquet')
+
+    def has_layer(self, layer_id:str) -> bool:
+        return os.path.exists(self.layer_path(layer_id))
+
+    def write_layer(self, layer_id:str, structure_rows:list):
+        """Writing (or replacing) the property file for a layer
+
+        :param layer_id: String uuid for the layer
+        :type layer_id: str
+        :param structure_rows: List of dictionaries containing "id", "properties", "minx", "miny", "maxx", and "maxy" for every structure in this layer
+        :type structure_rows: list
+        """
+        flat_rows = [flatten_properties(r.get('properties')) for r in structure_rows]
+        property_keys = list(dict.fromkeys([k for f in flat_rows for k in f]))
+
+        columns = {
+            STRUCTURE_ID_COLUMN: pyarrow.array([r.get('id') for r in structure_rows], type = pyarrow.string())
+        }
+        for b_col, b_key in zip(BBOX_COLUMNS,['minx','miny','maxx','maxy']):
+            columns[b_col] = pyarrow.array([r.get(b_key) for r in structure_rows], type = pyarrow.float64())
+
+        json_columns = []
+        for k in property_keys:
+            columns[k], is_json = get_column_array([f.get(k) for f in flat_rows])
+            if is_json:
+                json_columns.append(k)
+
+        # Writing to a temporary file first so readers never see a partially written layer
+        tmp_path = os.path.join(self.store_dir, f'.{layer_id}.{uuid.uuid4().hex[:8]}.tmp')
+        parquet.write_table(
+            pyarrow.table(columns).replace_schema_metadata({JSON_COLUMNS_KEY: json.dumps(json_columns)}),
+            tmp_path
+        )
+        os.replace(tmp_path, self.layer_path(layer_id))
+
+    def remove_layer(self, layer_id:str):
+        if self.has_layer(layer_id):
+            os.remove(self.layer_path(layer_id))
+
+    def read_layer(self, layer_id:str, property_list:list, structure_id:Union[str,list,None] = None, filters:Union[list,None] = None, layer_values:Union[dict,None] = None) -> Union[dict,None]:
+        """Reading only the requested property columns from a layer's file, optionally only for structures which pass property filters
+
+        :param layer_id: String uuid for the layer
+        :type layer_id: str
+        :param property_list: List of property key paths (ex: "main_prop --> sub_prop")
+        :type property_list: list
+        :param structure_id: String uuid for one or multiple structures (applied as a filter while reading), defaults to None
+        :type structure_id: Union[str,list,None], optional
+        :param filters: Property filters applied while reading (see get_filter_expression), defaults to None
+        :type filters: Union[list,None], optional
+        :param layer_values: Layer/item ids and names used by filters (see get_filter_expression), defaults to None
+        :type layer_values: Union[dict,None], optional
+        :return: Dictionary of column name to list of values (properties not in this layer are all None) or None if the layer can't be read from the store (no file, a requested property is a nested dictionary, or the filters can't be applied)
+        :rtype: Union[dict,None]
+        """
+        if not self.has_layer(layer_id):
+            return None
+
+        layer_schema = parquet.read_schema(self.layer_path(layer_id))
+        layer_columns = layer_schema.names
+        read_columns = [STRUCTURE_ID_COLUMN] + BBOX_COLUMNS
+        for p in property_list:
+            if p in layer_columns:
+                read_columns.append(p)
+            elif any([c.startswith(f'{p} --> ') or c.startswith(f'{p} --+ ') for c in layer_columns]):
+                # Nested dictionaries/lists aren't stored as single columns
+                return None
+
+        read_filter = None
+        if not filters is None and len(filters)>0:
+            read_filter = get_filter_expression(layer_schema, filters, layer_values or {})
+            if read_filter is None:
+                return None
+
+        if not structure_id is None:
+            structure_filter = compute.field(STRUCTURE_ID_COLUMN).isin([structure_id] if type(structure_id)==str else structure_id)
+            read_filter = structure_filter if read_filter is None else read_filter & structure_filter
+
+        layer_data = parquet.read_table(
+            self.layer_path(layer_id),
+            columns = list(dict.fromkeys(read_columns)),
+            filters = read_filter
+        ).to_pydict()
+
+        json_columns = json.loads((layer_schema.metadata or {}).get(JSON_COLUMNS_KEY,b'[]'))
+        n_rows = len(layer_data[STRUCTURE_ID_COLUMN])
+        for p in property_list:
+            if not p in layer_data:
+                layer_data[p] = [None]*n_rows
+            elif p in json_columns:
+                layer_data[p] = [json.loads(v) if not v is None else None for v in layer_data[p]]
+
+        return layer_data
+
+    def read_column(self, layer_id:str, property_name:str, bbox:Union[list,None] = None):
+        """Reading a single property column (used for aggregation), optionally only for structures whose bounding box intersects bbox
+
+        :param layer_id: String uuid for the layer
+        :type layer_id: str
+        :param property_name: Property key path (ex: "main_prop --> sub_prop")
+        :type property_name: str
+        :param bbox: Bounding box (minx, miny, maxx, maxy), defaults to None
+        :type bbox: Union[list,None], optional
+        :return: Arrow array of values (empty if the property isn't in this layer) or None if the layer can't be aggregated from the store (no file, nested dictionary, or mixed value types)
+        :rtype: Union[pyarrow.ChunkedArray,None]
+        """
+        if not self.has_layer(layer_id):
+            return None
+
+        layer_schema = parquet.read_schema(self.layer_path(layer_id))
+        if not property_name in layer_schema.names:
+            if any([c.startswith(f'{property_name} --> ') or c.startswith(f'{property_name} --+ ') for c in layer_schema.names]):
+                return None
+            return pyarrow.chunked_array([], type = pyarrow.null())
+
+        if property_name in json.loads((layer_schema.metadata or {}).get(JSON_COLUMNS_KEY,b'[]')):
+            return None
+
+        filters = None
+        if not bbox is None:
+            filters = [
+                (BBOX_COLUMNS[0], '<=', bbox[2]),
+                (BBOX_COLUMNS[2], '>=', bbox[0]),
+                (BBOX_COLUMNS[1], '<=', bbox[3]),
+                (BBOX_COLUMNS[3], '>=', bbox[1])
+            ]
+
+        return parquet.read_table(
+            self.layer_path(layer_id),
+            columns = [property_name],
+            filters = filters
+        ).column(property_name)
+
@@ -31,6 +31,7 @@ from typing import Callable
 from typing_extensions import Union
 
 from fusion_tools.tileserver import TileServer
+from fusion_tools.utils.images import get_region_array
 from io import BytesIO
 import requests
 
@@ -153,7 +154,15 @@ class ParallelFeatureExtractor:
         try:
             bbox = self.get_bbox(coords)
 
-            if isinstance(self.image_source,TileServer):
+            if isinstance(self.image_source,TileServer) and not getattr(self.image_source,'regions_array_url',None) is None:
+                # Reading all frames in one request at native dtype
+                image_region = get_region_array(
+                    self.image_source.regions_array_url,
+                    bbox,
+                    frames = 'all' if 'frames' in self.image_metadata else None
+                )
+
+            elif isinstance(self.image_source,TileServer):
                 if 'frames' in self.image_metadata:
                     image_region = np.zeros((int(bbox[3]-bbox[1]),int(bbox[2]-bbox[0]),len(self.image_metadata['frames'])))
                     for i in range(0,len(self.image_metadata['frames'])):
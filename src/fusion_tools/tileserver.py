@@ -5,6 +5,8 @@ Tile server components
 """
 import os
 from fastapi import FastAPI, APIRouter, Response, Request, Depends
+from fastapi.responses import StreamingResponse, FileResponse
+from starlette.background import BackgroundTask
 from fastapi.middleware.cors import CORSMiddleware
 import large_image
 import requests
@@ -13,14 +15,35 @@ from typing import Annotated
 from typing_extensions import Union
 
 from copy import deepcopy
+from collections import OrderedDict
+from functools import partial
+from itertools import chain
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from queue import PriorityQueue, Empty
 import numpy as np
+from PIL import Image, ImageColor
+from io import BytesIO
 import uvicorn
+import tifffile
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
 
 import asyncio
+import threading
+import multiprocessing
+import time
+import hashlib
+import shutil
+import struct
+import tempfile
 
 from shapely.geometry import box, shape
 
-from fusion_tools.database.database import fusionDB
+from fusion_tools.database.database import fusionDB, get_source_hash
 from fusion_tools.utils.shapes import (
     load_annotations,
     histomics_to_geojson,
@@ -175,392 +198,1731 @@ class Slide:
         return geojson_annotations, annotations_metadata
 
 
-class TileServer:
-    """Components which pull information from a slide(s)
-    """
-
-    def get_slide_urls(slide_dict,**kwargs):
-        raise NotImplementedError
-
-
-class LocalTileServer(TileServer):
-    """Tile server from image saved locally. Uses large-image to read and parse image formats (default: [common])
+class TileSourcePool:
+    """Bounded LRU pool of open large-image tile sources keyed by (item id, style)
     """
     def __init__(self,
-                 database: Union[fusionDB,None] = None,
-                 tile_server_port:int = 8050,
-                 host: str = 'localhost',
-                 protocol: str = 'http',
-                 jupyter_server_url: Union[str,None] = None,
-                 cors_options: dict = {}
-                 ):
+                 max_size: int = 32,
+                 max_idle: Union[int,float,None] = 600,
+                 max_open_files: Union[int,None] = None):
         """Constructor method
-        """
-
-        self.database = database
-        self.tile_server_port = tile_server_port
-        self.host = host
-        self.protocol = protocol
-        self.cors_options = cors_options
-        self.jupyter_server_url = jupyter_server_url
-
-        if self.jupyter_server_url is None or self.jupyter_server_url=='':
-            self.access_url = f'{self.protocol}://{self.host}:{self.tile_server_port}'
-        else:
-            self.access_url = self.jupyter_server_url
-
-        self.app = FastAPI(
-            title = 'TileServer',
-            description = 'Locally deployed tileserver for high-resolution microscopy images',
-            version = '3.6.42'
-        )
-
-        self.app.add_middleware(
-            CORSMiddleware,
-            allow_origins=self.cors_options.get('allow_origins',['*']),
-            allow_methods=self.cors_options.get('allow_methods',['GET','OPTIONS']),
-            allow_headers = self.cors_options.get('allow_headers',['*']),
-            expose_headers = self.cors_options.get('expose_headers',['*']),
-            allow_credentials = self.cors_options.get('allow_credentials',False)
-        )
-
-        self.router = APIRouter()
-        self.router.add_api_route('/',self.root,methods=["GET","OPTIONS"])
-        self.router.add_api_route('/ids',self.get_ids,methods=["GET","OPTIONS"])
-        self.router.add_api_route('/names',self.get_names,methods=["GET","OPTIONS"])
-        self.router.add_api_route('/{id}/info',self.get_id_info,methods=["GET","OPTIONS"])
-        self.router.add_api_route('/{id}/tiles/{z}/{x}/{y}',self.get_tile,methods=["GET","OPTIONS"])
-        self.router.add_api_route('/{id}/image_metadata',self.get_image_metadata,methods=["GET","OPTIONS"])
-        self.router.add_api_route('/{id}/metadata',self.get_metadata,methods=["GET","OPTIONS"])
-        self.router.add_api_route('/{id}/tiles/region',self.get_region,methods=["GET","OPTIONS"])
-        self.router.add_api_route('/{id}/tiles/thumbnail',self.get_thumbnail,methods=["GET","OPTIONS"])
-        self.router.add_api_route('/{id}/annotations',self.get_annotations,methods=["GET","OPTIONS"])
-        self.router.add_api_route('/{id}/annotations/metadata',self.get_annotations_metadata,methods=["GET", "OPTIONS"])
-        self.router.add_api_route('/{id}/annotations/data/list',self.get_annotations_property_keys,methods=["GET","OPTIONS"])
-        self.router.add_api_route('/{id}/annotations/data',self.get_annotations_property_data,methods=["GET","OPTIONS"])
 
-    def __str__(self):
-        return f'TileServer class to {self.host}:{self.tile_server_port}'
+        :param max_size: Maximum number of (item, style) tile sources kept open, defaults to 32
+        :type max_size: int, optional
+        :param max_idle: Seconds a tile source can go unused before it is closed, defaults to 600
+        :type max_idle: Union[int,float,None], optional
+        :param max_open_files: Maximum number of distinct image files held open at once, defaults to None
+        :type max_open_files: Union[int,None], optional
+        """
 
-    def add_new_image(self,
-        new_image_id:str,
-        new_image_path:str,
-        new_annotations:Union[str,list,dict,None] = None,
-        new_metadata:Union[dict,None] = None,
-        new_image_style:Union[dict,None] = None,
-        new_image_public: bool = False,
-        session_id: Union[str,None] = None,
-        user_id: Union[str,None] = None
-        ):
+        self.max_size = max_size
+        self.max_idle = max_idle
+        self.max_open_files = max_open_files
 
-        # Verifying filepaths and loading annotations
-        new_local_item = Slide(
-            image_filepath=new_image_path,
-            annotations = new_annotations,
-            metadata = new_metadata,
-            image_style=new_image_style,
-            public = new_image_public
-        )
+        self.sources = OrderedDict()
+        self.lock = threading.Lock()
 
-        self.add_new_slide(new_local_item,session_id,user_id)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
 
-    def add_new_slide(self, slide_id: str, slide_obj: Slide, session_id: Union[str,None] = None, user_id: Union[str,None] = None):
+    @staticmethod
+    def get_style_key(style: Union[str,dict,None] = None) -> str:
+        """Normalizing style so that equivalent style JSON strings share a pool entry
 
-        slide_name = slide_obj.image_filepath.split(os.sep)[-1]
-        # Adding information to database
-        self.database.add_slide(
-            slide_id = slide_id,
-            slide_name = slide_name,
-            item_type = 'local_item',
-            metadata = slide_obj.metadata,
-            image_metadata = slide_obj.image_metadata,
-            image_filepath = slide_obj.image_filepath,
-            annotations_metadata = slide_obj.annotations_metadata,
-            annotations = slide_obj.processed_annotations,
-            vis_session_id = session_id,
-            user_id = user_id,
-            public = slide_obj.public
-        )
+        :param style: Style dict or JSON string passed to large-image, defaults to None
+        :type style: Union[str,dict,None], optional
+        :return: Canonical JSON representation of style ('' if no style)
+        :rtype: str
+        """
+        if style is None or style=='':
+            return ''
 
-        # If this is not a public slide, add to UserAccess table
-        #if not slide_obj.public:
+        if type(style)==str:
+            style = json.loads(style)
 
-        #    self.database.add_access(
-        #        item_id = slide_id,
-        #        user_id = user_id
-        #    )
+        return json.dumps(style, sort_keys=True, separators=(',',':'))
 
-    def root(self):
-        return {'message': "Oh yeah, now we're cooking"}
+    def get(self, item_id:str, image_filepath:str, style: Union[str,dict,None] = None):
+        """Getting an open tile source from the pool, opening one if it is not present
 
-    async def get_item(self,item_id:str, token:Union[str,None] = None):
-        """Grabbing item from database
+        Sources returned by get() can be closed once they are evicted, use lease() while reading from a source in a worker thread.
 
         :param item_id: String uuid for local item
         :type item_id: str
-        :return: Item instance
-        :rtype: None
+        :param image_filepath: Path to image file for this item
+        :type image_filepath: str
+        :param style: Style dict or JSON string passed to large-image, defaults to None
+        :type style: Union[str,dict,None], optional
+        :return: Tile source
         """
+        return self.get_entry(item_id, image_filepath, style, lease = False)['source']
 
-        if not token is None:
-            user_filter = {
-                'user': {
-                    'token': token
-                }
-            }
-        else:
-            user_filter = {}
-
-        image_item = await self.database.search(
-            search_kwargs = {
-                'type': 'item',
-                'filters': {
-                    'item': {
-                        'id': item_id
-                    }
-                }| user_filter
-            }
-        )
-
-        return image_item
-
-    async def get_tile_source(self,item_id:str,style:Union[str,None]=None, token: Union[str,None] = None):
-        """Getting large-image tile source for a given id+style combo.
+    @contextmanager
+    def lease(self, item_id:str, image_filepath:str, style: Union[str,dict,None] = None):
+        """Getting an open tile source from the pool which won't be closed until the lease is released (even if it is evicted in the meantime)
 
-        :param item_id: String uuid for local image
+        :param item_id: String uuid for local item
         :type item_id: str
-        :param style: Style dict for large-image reader, specifying bands/palettes, etc., defaults to None
-        :type style: Union[str,None], optional
-        :return: Tile source
-        :rtype: None
+        :param image_filepath: Path to image file for this item
+        :type image_filepath: str
+        :param style: Style dict or JSON string passed to large-image, defaults to None
+        :type style: Union[str,dict,None], optional
+        :yield: Tile source
         """
+        entry = self.get_entry(item_id, image_filepath, style, lease = True)
+        try:
+            yield entry['source']
+        finally:
+            self.release(entry)
 
-        image_item = await asyncio.gather(self.get_item(item_id,token))
-        if len(image_item[0])==0:
-            return None
-        else:
-            image_item = image_item[0][0]
-            image_filepath = image_item.get('filepath')
+    def get_entry(self, item_id:str, image_filepath:str, style: Union[str,dict,None] = None, lease: bool = False) -> dict:
+        """Getting (or opening) the pool entry for an (item, style) combination
 
-            tile_source = large_image.open(
-                image_filepath,
-                style = json.loads(style) if type(style)==str else None
-            )
+        :param lease: Whether to add a lease to the entry (see lease() and release()), defaults to False
+        :type lease: bool, optional
+        :return: Pool entry containing "source", "filepath", "last_used", and "leases"
+        :rtype: dict
+        """
+        style_key = self.get_style_key(style)
+        key = (item_id, style_key)
 
-            return tile_source
+        with self.lock:
+            self.evict_idle()
 
-    async def get_item_annotations(self, item_id:str, request: Request = None):
-        """Loading annotations from item database
+            entry = self.sources.get(key)
+            if entry is not None and entry['filepath']==image_filepath:
+                self.sources.move_to_end(key)
+                entry['last_used'] = time.monotonic()
+                entry['leases'] += int(lease)
+                self.hits += 1
 
-        :param item_id: String uuid for local image
-        :type item_id: str
-        """
-        user_filter = {}
-        if not request is None:
-            if request.query_params.get('token'):
-                user_filter = {
-                    'user': {
-                        'token': request.query_params.get('token')
-                    }
-                }
+                return entry
 
-        item_annotations = []
+            self.misses += 1
 
-        item_layers = await self.database.search(
-            search_kwargs = {
-                'type': 'layer',
-                'filters': {
-                    'item': {
-                        'id': item_id
-                    }
-                } | user_filter
-            }
+        tile_source = large_image.open(
+            image_filepath,
+            style = json.loads(style_key) if not style_key=='' else None
         )
 
-        for l in item_layers:
-            layer_name = l.get('name')
-            layer_id = l.get('id')
-
-            #TODO: Check if this also needs the user token
-            layer_structures = await self.database.search(
-                search_kwargs={
-                    'type': 'structure',
-                    'filters': {
-                        'layer': {
-                            'id': layer_id
-                        }
-                    }| user_filter
+        with self.lock:
+            entry = self.sources.get(key)
+            if entry is not None and entry['filepath']==image_filepath:
+                # Another thread opened this source at the same time, keeping the pooled one
+                self.close_source(tile_source)
+            else:
+                # Closing the previous source for this key (e.g. the item's filepath changed)
+                self.pop(key)
+                entry = {
+                    'source': tile_source,
+                    'filepath': image_filepath,
+                    'last_used': time.monotonic(),
+                    'leases': 0,
+                    'retired': False
                 }
-            )
+                self.sources[key] = entry
 
-            if len(layer_structures)>0:
-                item_annotations.append(
-                    {
-                        'type': 'FeatureCollection',
-                        'properties': {
-                            'name': layer_name,
-                            '_id': layer_id
-                        },
-                        'features': [
-                            {
-                                'type': 'Feature',
-                                'geometry': s.get('geom'),
-                                'properties': s.get('properties')
-                            }
-                            for s in layer_structures
-                        ]
-                    }
-                )
-            else:
-                #TODO: Check if this needs a user_token argument
-                # This could be an ImageOverlay layer
-                image_overlays = await self.database.search(
-                    search_kwargs = {
-                        'type': 'image_overlay',
-                        'filters': {
-                            'layer': {
-                                'id': layer_id
-                            }
-                        } | user_filter
-                    }
-                )
+            self.sources.move_to_end(key)
+            entry['last_used'] = time.monotonic()
+            entry['leases'] += int(lease)
+            self.evict_overflow()
 
-                if len(image_overlays)>0:
-                    item_annotations.extend(
-                        [
-                            i.to_dict() for i in image_overlays
-                        ]
-                    )
+        return entry
 
-        return item_annotations
+    def release(self, entry: dict):
+        """Releasing a lease on a pool entry, closing its tile source if it was evicted while leased
 
-    def get_names(self, request: Request):
-        """Get names of items in fusionDB
+        :param entry: Pool entry from get_entry
+        :type entry: dict
+        """
+        with self.lock:
+            entry['leases'] -= 1
+            if entry['leases']==0 and entry['retired']:
+                self.close_source(entry['source'])
 
-        :return: Message dictionary containing list of all item names
-        :rtype: dict
+    def evict_idle(self):
+        """Closing tile sources which have not been used in the past max_idle seconds (lock must be held)
         """
+        if self.max_idle is None:
+            return
 
-        item_names = self.database.get_names(
-            table_name = 'item',
-        )
+        now = time.monotonic()
+        while len(self.sources)>0:
+            key, entry = next(iter(self.sources.items()))
+            if now - entry['last_used'] < self.max_idle:
+                break
 
-        return {'message': item_names}
+            self.pop(key)
 
-    def get_ids(self):
-        """Get all available ids in the database
+    def evict_overflow(self):
+        """Closing least recently used tile sources until size and open file limits are met (lock must be held)
         """
-        item_ids = self.database.get_ids(
-            table_name = 'item'
-        )
+        while len(self.sources)>self.max_size:
+            self.pop(next(iter(self.sources)))
 
-        return {'message': item_ids}
+        if not self.max_open_files is None:
+            while len(set([i['filepath'] for i in self.sources.values()]))>self.max_open_files:
+                self.pop(next(iter(self.sources)))
 
-    async def get_id_info(self, id:str):
-        """Get info for a single id
-        """
-        image_item = await asyncio.gather(self.get_item(id))
+    def pop(self, key: tuple):
+        """Removing a single entry from the pool and closing its tile source (lock must be held)
 
-        if len(image_item[0])>0:
-            item_info = image_item[0][0]
-            return Response(
-                content = json.dumps(item_info,default=str),
-                media_type = 'application/json'
-            )
+        :param key: (item_id, style_key) tuple
+        :type key: tuple
+        """
+        entry = self.sources.pop(key, None)
+        if entry is None:
+            return
+
+        self.evictions += 1
+        if entry['leases']>0:
+            # Closed once the last lease is released
+            entry['retired'] = True
         else:
-            return Response(
-                content = 'invalid image id',
-                media_type='application/json',
-                status_code=400,
-            )
+            self.close_source(entry['source'])
 
-    def get_item_names_ids(self, filters = None, size = None, offset = 0):
-        """Get list of names and ids of all locally stored images in this tileserver
+    @staticmethod
+    def close_source(tile_source):
+        """Closing a tile source's file handles (if it has a close method)
         """
+        close_method = getattr(tile_source,'close',None)
+        if callable(close_method):
+            try:
+                close_method()
+            except Exception:
+                pass
 
-        item_names_ids = self.database.search(
-            search_kwargs={
-                'type': 'item',
-                'filters': filters
-            },
-            size = size,
-            offset = offset
-        )
-
-        item_names_ids = [
-            {
-                'name': i.name,
-                'id': i.id
-            }
-            for i in item_names_ids
-        ]
+    def invalidate(self, item_id: str):
+        """Removing all tile sources for a given item (e.g. when the item is replaced)
 
-        return item_names_ids
+        :param item_id: String uuid for local item
+        :type item_id: str
+        """
+        with self.lock:
+            for key in [k for k in self.sources if k[0]==item_id]:
+                self.pop(key)
 
-    @staticmethod
-    def get_slide_urls(slide_dict,user_token,standalone = False):
+    def clear(self):
+        """Closing all tile sources in the pool
+        """
+        with self.lock:
+            for key in list(self.sources.keys()):
+                self.pop(key)
 
-        slide_id = slide_dict.get('id')
-        url = slide_dict.get('url')
+    def stats(self) -> dict:
+        """Current pool size and hit/miss counters
 
-        if not standalone:
-            slide_url_dict = {
-                'tiles': f'{url}/tileserver/{slide_id}/tiles/'+'{z}/{x}/{y}',
-                'regions': f'{url}/tileserver/{slide_id}/tiles/region',
-                'image_metadata': f'{url}/tileserver/{slide_id}/image_metadata',
-                'metadata': f'{url}/tileserver/{slide_id}/metadata',
-                'annotations': f'{url}/tileserver/{slide_id}/annotations',
-                'annotations_metadata':f'{url}/tileserver/{slide_id}/annotations/metadata',
-                'annotations_region':f'{url}/tileserver/{slide_id}/annotations'
-            }
-        else:
-            slide_url_dict = {
-                'tiles': f'{url}/{slide_id}/tiles/'+'{z}/{x}/{y}',
-                'regions': f'{url}/{slide_id}/tiles/region',
-                'image_metadata': f'{url}/{slide_id}/image_metadata',
-                'metadata': f'{url}/{slide_id}/metadata',
-                'annotations': f'{url}/{slide_id}/annotations',
-                'annotations_metadata':f'{url}/{slide_id}/annotations/metadata',
-                'annotations_region':f'{url}/{slide_id}/annotations'
+        :return: Dictionary containing pool statistics
+        :rtype: dict
+        """
+        with self.lock:
+            return {
+                'size': len(self.sources),
+                'open_files': len(set([i['filepath'] for i in self.sources.values()])),
+                'max_size': self.max_size,
+                'max_open_files': self.max_open_files,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions
             }
 
-        if not user_token is None:
-            for k,v in slide_url_dict.items():
-                slide_url_dict[k] = v + f'?token={user_token}'
 
-        return slide_url_dict
+class TileCache:
+    """Two-tier (memory LRU + optional size-capped disk) cache of encoded tile bytes
+    """
+    def __init__(self,
+                 max_memory: int = 128*1024*1024,
+                 disk_path: Union[str,None] = None,
+                 max_disk: int = 1024*1024*1024):
+        """Constructor method
 
-    def get_tiles_url(self,slide_id):
-        tiles_url = f'{self.protocol}://{self.host}:{self.tile_server_port}/{slide_id}/tiles/'+'{z}/{x}/{y}'
+        :param max_memory: Maximum number of bytes held in memory, defaults to 128MB
+        :type max_memory: int, optional
+        :param disk_path: Folder to store cached tiles in, if None then tiles are only cached in memory, defaults to None
+        :type disk_path: Union[str,None], optional
+        :param max_disk: Maximum number of bytes stored on disk, defaults to 1GB
+        :type max_disk: int, optional
+        """
 
-        return tiles_url
+        self.max_memory = max_memory
+        self.disk_path = disk_path
+        self.max_disk = max_disk
 
-    def get_regions_url(self,slide_id):
-        regions_url = f'{self.protocol}://{self.host}:{self.tile_server_port}/{slide_id}/tiles/region'
+        self.memory = OrderedDict()
+        self.memory_size = 0
+        self.disk = OrderedDict()
+        self.disk_size = 0
+        self.lock = threading.Lock()
 
-        return regions_url
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
 
-    def get_annotations_url(self,slide_id):
-        annotations_url = f'{self.protocol}://{self.host}:{self.tile_server_port}/{slide_id}/annotations'
+        if not self.disk_path is None:
+            self.load_disk_index()
 
-        return annotations_url
+    @staticmethod
+    def get_etag(content: bytes) -> str:
+        """Strong ETag derived from the encoded content
 
-    def get_annotations_metadata_url(self,slide_id):
-        annotations_metadata_url = f'{self.protocol}://{self.host}:{self.tile_server_port}/{slide_id}/annotations/metadata'
+        :param content: Encoded tile bytes
+        :type content: bytes
+        :return: Quoted ETag string
+        :rtype: str
+        """
+        return '"'+hashlib.sha1(content).hexdigest()+'"'
 
-        return annotations_metadata_url
+    def get_disk_filepath(self, key: tuple) -> str:
+        """Path to cached tile on disk, stored in one folder per item
 
-    def get_metadata_url(self,slide_id):
-        metadata_url = f'{self.protocol}://{self.host}:{self.tile_server_port}/{slide_id}/metadata'
+        :param key: Cache key
+        :type key: tuple
+        :return: Filepath
+        :rtype: str
+        """
+        key_hash = hashlib.sha1(json.dumps(key[1:],default=str).encode()).hexdigest()
+        return os.path.join(self.disk_path,str(key[0]),key_hash)
 
-        return metadata_url
+    def load_disk_index(self):
+        """Indexing tiles that were cached on disk by a previous instance (oldest first)
+        """
+        if not os.path.exists(self.disk_path):
+            os.makedirs(self.disk_path)
+
+        disk_files = []
+        for item_folder in os.listdir(self.disk_path):
+            if not os.path.isdir(os.path.join(self.disk_path,item_folder)):
+                continue
+            for f in os.listdir(os.path.join(self.disk_path,item_folder)):
+                if f.endswith('.tmp'):
+                    # Partially written tile from an interrupted instance
+                    os.remove(os.path.join(self.disk_path,item_folder,f))
+                    continue
+                f_stat = os.stat(os.path.join(self.disk_path,item_folder,f))
+                disk_files.append((f_stat.st_mtime, os.path.join(self.disk_path,item_folder,f), f_stat.st_size))
+
+        for _, f_path, f_size in sorted(disk_files):
+            self.disk[f_path] = f_size
+            self.disk_size += f_size
+
+        self.evict_disk()
+
+    def get(self, key: tuple) -> Union[tuple,None]:
+        """Getting cached tile bytes and ETag
+
+        :param key: Cache key, (item id, ...) tuple
+        :type key: tuple
+        :return: (content, etag) if present in either cache tier, otherwise None
+        :rtype: Union[tuple,None]
+        """
+        with self.lock:
+            if key in self.memory:
+                self.memory.move_to_end(key)
+                self.memory_hits += 1
+                return self.memory[key]
 
-    def get_image_metadata_url(self,slide_id):
+            if self.disk_path is None:
+                self.misses += 1
+                return None
+
+            disk_filepath = self.get_disk_filepath(key)
+            if not disk_filepath in self.disk:
+                self.misses += 1
+                return None
+
+            self.disk.move_to_end(disk_filepath)
+
+        try:
+            with open(disk_filepath,'rb') as f:
+                content = f.read()
+        except OSError:
+            with self.lock:
+                self.disk_size -= self.disk.pop(disk_filepath,0)
+                self.misses += 1
+            return None
+
+        entry = (content, self.get_etag(content))
+        with self.lock:
+            self.disk_hits += 1
+            self.add_memory(key, entry)
+
+        return entry
+
+    def contains(self, key: tuple) -> bool:
+        """Checking if a key is in either cache tier without updating hit/miss counters
+
+        :param key: Cache key, (item id, ...) tuple
+        :type key: tuple
+        :rtype: bool
+        """
+        with self.lock:
+            if key in self.memory:
+                return True
+
+            if not self.disk_path is None:
+                return self.get_disk_filepath(key) in self.disk
+
+        return False
+
+    def set(self, key: tuple, content: bytes) -> tuple:
+        """Adding encoded tile bytes to the cache
+
+        :param key: Cache key, (item id, ...) tuple
+        :type key: tuple
+        :param content: Encoded tile bytes
+        :type content: bytes
+        :return: (content, etag)
+        :rtype: tuple
+        """
+        entry = (content, self.get_etag(content))
+        with self.lock:
+            self.add_memory(key, entry)
+
+        if not self.disk_path is None:
+            disk_filepath = self.get_disk_filepath(key)
+            try:
+                os.makedirs(os.path.dirname(disk_filepath),exist_ok=True)
+                tmp_filepath = disk_filepath+f'.{threading.get_ident()}.tmp'
+                with open(tmp_filepath,'wb') as f:
+                    f.write(content)
+                os.replace(tmp_filepath,disk_filepath)
+            except OSError:
+                return entry
+
+            with self.lock:
+                self.disk_size -= self.disk.pop(disk_filepath,0)
+                self.disk[disk_filepath] = len(content)
+                self.disk_size += len(content)
+                self.evict_disk()
+
+        return entry
+
+    def add_memory(self, key: tuple, entry: tuple):
+        """Adding an entry to the memory tier and evicting least recently used entries (lock must be held)
+        """
+        if len(entry[0])>self.max_memory:
+            return
+
+        if key in self.memory:
+            self.memory_size -= len(self.memory.pop(key)[0])
+
+        self.memory[key] = entry
+        self.memory_size += len(entry[0])
+
+        while self.memory_size>self.max_memory:
+            _, old_entry = self.memory.popitem(last=False)
+            self.memory_size -= len(old_entry[0])
+
+    def evict_disk(self):
+        """Removing least recently used tiles on disk until under max_disk (lock must be held)
+        """
+        while self.disk_size>self.max_disk and len(self.disk)>0:
+            old_filepath, old_size = self.disk.popitem(last=False)
+            self.disk_size -= old_size
+            try:
+                os.remove(old_filepath)
+            except OSError:
+                pass
+
+    def invalidate(self, item_id: str):
+        """Removing all cached tiles for a given item
+
+        :param item_id: String uuid for local item
+        :type item_id: str
+        """
+        with self.lock:
+            for key in [k for k in self.memory if k[0]==item_id]:
+                self.memory_size -= len(self.memory.pop(key)[0])
+
+            if not self.disk_path is None:
+                item_folder = os.path.join(self.disk_path,str(item_id))
+                for f in [k for k in self.disk if os.path.dirname(k)==item_folder]:
+                    self.disk_size -= self.disk.pop(f)
+                if os.path.exists(item_folder):
+                    shutil.rmtree(item_folder,ignore_errors=True)
+
+    def stats(self) -> dict:
+        """Current cache sizes and hit/miss counters
+
+        :return: Dictionary containing cache statistics
+        :rtype: dict
+        """
+        with self.lock:
+            return {
+                'memory_items': len(self.memory),
+                'memory_bytes': self.memory_size,
+                'disk_items': len(self.disk),
+                'disk_bytes': self.disk_size,
+                'memory_hits': self.memory_hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses
+            }
+
+
+class FrameTileCache:
+    """In-memory LRU cache of decoded (native dtype) single-frame tiles used for compositing channels
+    """
+    def __init__(self,
+                 max_memory: int = 256*1024*1024):
+        """Constructor method
+
+        :param max_memory: Maximum number of bytes held in memory, defaults to 256MB
+        :type max_memory: int, optional
+        """
+
+        self.max_memory = max_memory
+
+        self.memory = OrderedDict()
+        self.memory_size = 0
+        self.lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: tuple) -> Union[np.ndarray,None]:
+        """Getting a decoded frame tile
+
+        :param key: (item_id, z, x, y, frame)
+        :type key: tuple
+        :return: Frame tile array or None if not cached
+        :rtype: Union[np.ndarray,None]
+        """
+        with self.lock:
+            if key in self.memory:
+                self.memory.move_to_end(key)
+                self.hits += 1
+                return self.memory[key]
+
+            self.misses += 1
+            return None
+
+    def set(self, key: tuple, frame_tile: np.ndarray):
+        """Adding a decoded frame tile, evicting least recently used tiles if over the memory limit
+
+        :param key: (item_id, z, x, y, frame)
+        :type key: tuple
+        :param frame_tile: Decoded frame tile
+        :type frame_tile: np.ndarray
+        """
+        if frame_tile.nbytes>self.max_memory:
+            return
+
+        with self.lock:
+            if key in self.memory:
+                self.memory_size -= self.memory.pop(key).nbytes
+
+            self.memory[key] = frame_tile
+            self.memory_size += frame_tile.nbytes
+
+            while self.memory_size>self.max_memory:
+                _, old_tile = self.memory.popitem(last=False)
+                self.memory_size -= old_tile.nbytes
+
+    def invalidate(self, item_id: str):
+        """Removing all frame tiles for an item
+
+        :param item_id: Item id
+        :type item_id: str
+        """
+        with self.lock:
+            for key in [k for k in self.memory if k[0]==item_id]:
+                self.memory_size -= self.memory.pop(key).nbytes
+
+    def stats(self) -> dict:
+        """Current cache size and hit/miss counters
+
+        :return: Dictionary containing cache statistics
+        :rtype: dict
+        """
+        with self.lock:
+            return {
+                'memory_items': len(self.memory),
+                'memory_bytes': self.memory_size,
+                'hits': self.hits,
+                'misses': self.misses
+            }
+
+
+def call_tile_source(tile_source, method: str, **kwargs):
+    """Calling a method of a tile source (e.g. getTile, getRegion, getThumbnail) in an executor worker
+
+    :param tile_source: large-image tile source
+    :param method: Name of tile source method
+    :type method: str
+    :return: Output of tile source method
+    """
+    return getattr(tile_source, method)(**kwargs)
+
+
+# Encodings accepted by the "encoding" parameter of the tiles, region, and thumbnail routes
+TILE_ENCODINGS = {
+    'PNG': 'image/png',
+    'JPEG': 'image/jpeg',
+    'WEBP': 'image/webp'
+}
+
+def get_media_type(content: bytes) -> str:
+    """Getting the media type of encoded image bytes from the file signature
+
+    :param content: Encoded image
+    :type content: bytes
+    :return: Media type (defaults to "application/octet-stream" if not recognized)
+    :rtype: str
+    """
+    if content[:8]==b'\x89PNG\r\n\x1a\n':
+        return 'image/png'
+    elif content[:3]==b'\xff\xd8\xff':
+        return 'image/jpeg'
+    elif content[:4]==b'RIFF' and content[8:12]==b'WEBP':
+        return 'image/webp'
+    elif content[:4] in [b'II*\x00',b'MM\x00*']:
+        return 'image/tiff'
+
+    return 'application/octet-stream'
+
+def encode_image(image: np.ndarray, encoding: str = 'PNG', quality: int = 90, grayscale: bool = False) -> bytes:
+    """Encoding a numpy image array (from large-image) as PNG, JPEG, or WEBP
+
+    :param image: Image array (height, width, channels)
+    :type image: np.ndarray
+    :param encoding: One of TILE_ENCODINGS, defaults to 'PNG'
+    :type encoding: str, optional
+    :param quality: JPEG/WEBP quality (1-100), defaults to 90
+    :type quality: int, optional
+    :param grayscale: Whether to output a single-channel 8-bit image, defaults to False
+    :type grayscale: bool, optional
+    :return: Encoded image
+    :rtype: bytes
+    """
+    if image.ndim==2:
+        image = image[:,:,None]
+
+    if not image.dtype==np.uint8:
+        if image.dtype==np.uint16:
+            image = np.floor_divide(image,256)
+        elif np.issubdtype(image.dtype,np.floating) and np.nanmax(image)<=1.0:
+            image = np.nan_to_num(image)*255
+        image = np.clip(image,0,255).astype(np.uint8)
+
+    # Dropping alpha channels that don't contain any transparency
+    if image.shape[-1] in [2,4] and np.all(image[:,:,-1]==255):
+        image = image[:,:,:-1]
+
+    n_channels = image.shape[-1]
+    if grayscale:
+        if n_channels>=3:
+            pil_image = Image.fromarray(image[:,:,:3],'RGB').convert('L')
+        else:
+            pil_image = Image.fromarray(image[:,:,0],'L')
+    else:
+        if n_channels==1:
+            pil_image = Image.fromarray(image[:,:,0],'L')
+        elif n_channels==2:
+            pil_image = Image.fromarray(image,'LA')
+        elif n_channels==3:
+            pil_image = Image.fromarray(image,'RGB')
+        else:
+            pil_image = Image.fromarray(image[:,:,:4],'RGBA')
+
+        # JPEG does not support transparency
+        if encoding=='JPEG' and pil_image.mode in ['LA','RGBA']:
+            pil_image = pil_image.convert(pil_image.mode[:-1])
+
+    encoded_image = BytesIO()
+    if encoding=='PNG':
+        pil_image.save(encoded_image, format = encoding)
+    else:
+        pil_image.save(encoded_image, format = encoding, quality = quality)
+
+    return encoded_image.getvalue()
+
+def call_tile_source_encoded(tile_source, method: str, encoding_args: tuple, **kwargs) -> bytes:
+    """Calling an image method of a tile source (getTile, getRegion, getThumbnail) and encoding the output in an executor worker
+
+    :param tile_source: large-image tile source
+    :param method: Name of tile source method
+    :type method: str
+    :param encoding_args: (encoding, quality, grayscale), if encoding is None the output of large-image is returned as-is
+    :type encoding_args: tuple
+    :return: Encoded image
+    :rtype: bytes
+    """
+    encoding, quality, grayscale = encoding_args
+    if encoding is None:
+        image_output = getattr(tile_source, method)(**kwargs)
+        if type(image_output)==tuple:
+            return image_output[0]
+        return image_output
+
+    if method=='getTile':
+        image = tile_source.getTile(numpyAllowed = 'always', **kwargs)
+    else:
+        image, _ = getattr(tile_source, method)(format = large_image.constants.TILE_FORMAT_NUMPY, **kwargs)
+
+    return encode_image(image, encoding, quality, grayscale)
+
+
+def read_region_array(tile_source, region: dict, frames: Union[list,None] = None, compress: Union[str,None] = None) -> bytes:
+    """Reading a region at native dtype and serializing it as a .npy array (optionally zstd-compressed) in an executor worker
+
+    :param tile_source: large-image tile source
+    :param region: Region dictionary ("left", "top", "right", "bottom") passed to getRegion
+    :type region: dict
+    :param frames: List of frames to read, concatenated along the last axis, defaults to None (default frame)
+    :type frames: Union[list,None], optional
+    :param compress: Either "zstd" or None, defaults to None
+    :type compress: Union[str,None], optional
+    :return: Serialized array
+    :rtype: bytes
+    """
+    if frames is None:
+        region_array, _ = tile_source.getRegion(region = region, format = large_image.constants.TILE_FORMAT_NUMPY)
+    else:
+        region_array = np.concatenate([
+            tile_source.getRegion(region = region, frame = f, format = large_image.constants.TILE_FORMAT_NUMPY)[0]
+            for f in frames
+        ], axis = -1)
+
+    # Dropping alpha channels that don't contain any transparency (e.g. RGBA regions from openslide)
+    if frames is None and region_array.shape[-1]==4 and np.all(region_array[:,:,-1]==np.max(region_array[:,:,-1])):
+        region_array = region_array[:,:,:-1]
+
+    serialized_array = BytesIO()
+    np.save(serialized_array, region_array, allow_pickle = False)
+    serialized_array = serialized_array.getvalue()
+
+    if compress=='zstd':
+        serialized_array = zstandard.ZstdCompressor(level = 3).compress(serialized_array)
+
+    return serialized_array
+
+
+def read_frame_tiles(tile_source, x: int, y: int, z: int, frames: list) -> list:
+    """Decoding the same tile from multiple frames at native dtype in an executor worker
+
+    :param tile_source: large-image tile source (without a style)
+    :param frames: Frame indices
+    :type frames: list
+    :raises ValueError: Frame index outside of the image
+    :return: List of (height, width) arrays, one per frame
+    :rtype: list
+    """
+    n_frames = max(len(tile_source.getMetadata().get('frames',[])),1)
+    if any([f<0 or f>=n_frames for f in frames]):
+        raise ValueError(f'invalid frame, must be between 0 and {n_frames-1}')
+
+    frame_tiles = []
+    for f in frames:
+        frame_tile = tile_source.getTile(x = x, y = y, z = z, frame = f, numpyAllowed = 'always')
+        if frame_tile.ndim==3:
+            frame_tile = frame_tile[:,:,0]
+        frame_tiles.append(frame_tile)
+
+    return frame_tiles
+
+def composite_frames(frame_tiles: list, channels: list, blend: str = 'lighten') -> np.ndarray:
+    """Blending single-frame tiles into an RGBA image using per-channel colors and contrast limits
+
+    :param frame_tiles: List of (height, width) arrays, one per channel
+    :type frame_tiles: list
+    :param channels: List of channel dicts with "color" ([r,g,b,a], 0-255) and "min"/"max" (None uses the dtype range)
+    :type channels: list
+    :param blend: Either "lighten" (maximum of each channel's color) or "add" (sum, clipped), defaults to 'lighten'
+    :type blend: str, optional
+    :return: RGBA uint8 image
+    :rtype: np.ndarray
+    """
+    frame_stack = np.stack(frame_tiles,axis=0).astype(np.float32)
+
+    if np.issubdtype(frame_tiles[0].dtype,np.integer):
+        dtype_min, dtype_max = np.iinfo(frame_tiles[0].dtype).min, np.iinfo(frame_tiles[0].dtype).max
+    else:
+        dtype_min, dtype_max = 0.0, 1.0
+
+    mins = np.array([c['min'] if not c.get('min') is None else dtype_min for c in channels],dtype=np.float32)
+    maxs = np.array([c['max'] if not c.get('max') is None else dtype_max for c in channels],dtype=np.float32)
+    colors = np.array([c['color'] for c in channels],dtype=np.float32)
+
+    # (channels, height, width) intensities scaled to [0,1] by contrast limits
+    scaled = np.clip((frame_stack-mins[:,None,None])/np.maximum(maxs-mins,1e-6)[:,None,None],0,1)
+
+    if blend=='add':
+        rgb = np.einsum('chw,cd->hwd',scaled,colors[:,:3])
+    else:
+        rgb = np.max(scaled[:,:,:,None]*colors[:,None,None,:3],axis=0)
+    alpha = np.max(scaled*colors[:,3][:,None,None],axis=0)
+
+    return np.dstack((np.clip(rgb,0,255),alpha)).astype(np.uint8)
+
+def encode_composite(frame_tiles: list, channels: list, blend: str, encoding_args: tuple) -> bytes:
+    """Compositing and encoding frame tiles (run in a worker thread)
+
+    :param frame_tiles: List of (height, width) arrays, one per channel
+    :type frame_tiles: list
+    :param channels: List of channel dicts
+    :type channels: list
+    :param blend: Blend mode
+    :type blend: str
+    :param encoding_args: (encoding, quality, grayscale)
+    :type encoding_args: tuple
+    :return: Encoded composite tile
+    :rtype: bytes
+    """
+    return encode_image(composite_frames(frame_tiles, channels, blend), *encoding_args)
+
+
+def write_region_tiff(tile_source, filepath: str, region: dict, output: Union[dict,None] = None, frame: Union[int,None] = None, compression: str = 'zlib', tile_size: int = 512):
+    """Writing a region to a tiled TIFF one tile at a time (in an executor worker)
+
+    :param tile_source: large-image tile source
+    :param filepath: Output filepath
+    :type filepath: str
+    :param region: Region dictionary ("left", "top", "right", "bottom") in full resolution pixels
+    :type region: dict
+    :param output: Output size ("maxWidth", "maxHeight"), defaults to None (full resolution)
+    :type output: Union[dict,None], optional
+    :param frame: Frame to read, defaults to None
+    :type frame: Union[int,None], optional
+    :param compression: TIFF compression ("zlib", "jpeg", or "none"), defaults to 'zlib'
+    :type compression: str, optional
+    :param tile_size: Size of TIFF tiles (multiple of 16), defaults to 512
+    :type tile_size: int, optional
+    """
+    region_width = region['right']-region['left']
+    region_height = region['bottom']-region['top']
+    if output is None:
+        output_width, output_height = region_width, region_height
+    else:
+        output_width, output_height = output['maxWidth'], output['maxHeight']
+
+    x_scale = region_width/output_width
+    y_scale = region_height/output_height
+    n_x = int(np.ceil(output_width/tile_size))
+    n_y = int(np.ceil(output_height/tile_size))
+
+    def read_output_tile(t_x, t_y):
+        # Reading one output tile from the matching pyramid level and padding to the full tile size
+        out_left, out_top = t_x*tile_size, t_y*tile_size
+        out_right, out_bottom = min(out_left+tile_size,output_width), min(out_top+tile_size,output_height)
+
+        tile_kwargs = {
+            'region': {
+                'left': region['left']+int(round(out_left*x_scale)),
+                'top': region['top']+int(round(out_top*y_scale)),
+                'right': region['left']+int(round(out_right*x_scale)),
+                'bottom': region['top']+int(round(out_bottom*y_scale))
+            },
+            'format': large_image.constants.TILE_FORMAT_NUMPY
+        }
+        if not output is None:
+            tile_kwargs['output'] = {'maxWidth': out_right-out_left, 'maxHeight': out_bottom-out_top}
+        if not frame is None:
+            tile_kwargs['frame'] = frame
+
+        tile, _ = tile_source.getRegion(**tile_kwargs)
+        tile = tile[:out_bottom-out_top,:out_right-out_left]
+        # JPEG does not support transparency
+        if compression=='jpeg' and tile.shape[-1] in [2,4]:
+            tile = tile[:,:,:-1]
+
+        padded_tile = np.zeros((tile_size,tile_size,tile.shape[-1]),dtype=tile.dtype)
+        padded_tile[:tile.shape[0],:tile.shape[1]] = tile
+
+        return padded_tile
+
+    first_tile = read_output_tile(0,0)
+    n_channels = first_tile.shape[-1]
+    if compression=='jpeg' and not first_tile.dtype==np.uint8:
+        raise ValueError('jpeg compression requires 8-bit images')
+
+    def tile_generator():
+        for t_y in range(n_y):
+            for t_x in range(n_x):
+                if t_x==0 and t_y==0:
+                    yield first_tile
+                else:
+                    yield read_output_tile(t_x,t_y)
+
+    tifffile.imwrite(
+        filepath,
+        data = tile_generator(),
+        shape = (output_height, output_width, n_channels),
+        dtype = first_tile.dtype,
+        tile = (tile_size, tile_size),
+        photometric = 'rgb' if n_channels in [3,4] else 'minisblack',
+        planarconfig = 'contig',
+        compression = None if compression=='none' else compression,
+        bigtiff = output_width*output_height*n_channels*first_tile.dtype.itemsize>2**31
+    )
+
+
+# Tile sources opened by each worker process when TileExecutor uses a process pool
+PROCESS_TILE_SOURCE_POOL = None
+
+def run_in_process(source_args: tuple, func, args: tuple, kwargs: dict):
+    """Opening (or reusing) a tile source in a worker process and running func with it
+
+    :param source_args: (item_id, image_filepath, style_key) used to open the tile source
+    :type source_args: tuple
+    :param func: Module-level function with tile source as the first argument
+    :type func: Callable
+    :return: Output of func
+    """
+    global PROCESS_TILE_SOURCE_POOL
+    if PROCESS_TILE_SOURCE_POOL is None:
+        PROCESS_TILE_SOURCE_POOL = TileSourcePool(max_size = 8)
+
+    with PROCESS_TILE_SOURCE_POOL.lease(*source_args) as tile_source:
+        return func(tile_source, *args, **kwargs)
+
+
+class TileExecutorBusy(Exception):
+    """Raised when the TileExecutor queue is full"""
+    pass
+
+
+class RegionTooLarge(Exception):
+    """Raised when a requested region is larger than LocalTileServer's max_region_pixels"""
+    pass
+
+
+class TileExecutor:
+    """Runs blocking large-image decode/encode work off of the event loop with per-route concurrency limits
+    """
+    def __init__(self,
+                 tile_source_pool: TileSourcePool,
+                 executor_type: str = 'thread',
+                 max_workers: Union[int,None] = None,
+                 max_queue: int = 256,
+                 route_limits: dict = {}):
+        """Constructor method
+
+        :param tile_source_pool: Pool of open tile sources used by thread workers
+        :type tile_source_pool: TileSourcePool
+        :param executor_type: Either "thread" or "process" (for GIL-heavy re-encoding), defaults to 'thread'
+        :type executor_type: str, optional
+        :param max_workers: Number of worker threads/processes, defaults to None (os.cpu_count()+4 for threads, os.cpu_count() for processes)
+        :type max_workers: Union[int,None], optional
+        :param max_queue: Maximum number of running + waiting tasks before new tasks are rejected, defaults to 256
+        :type max_queue: int, optional
+        :param route_limits: Maximum number of concurrently running tasks per route ("tiles", "regions", "thumbnails"), defaults to {}
+        :type route_limits: dict, optional
+        """
+
+        assert executor_type in ['thread','process']
+
+        self.tile_source_pool = tile_source_pool
+        self.executor_type = executor_type
+        self.max_queue = max_queue
+
+        cpu_count = os.cpu_count() or 1
+        if executor_type=='thread':
+            self.max_workers = max_workers if not max_workers is None else min(32, cpu_count+4)
+            self.pool = ThreadPoolExecutor(
+                max_workers = self.max_workers,
+                thread_name_prefix = 'fusion_tile_worker'
+            )
+        else:
+            self.max_workers = max_workers if not max_workers is None else cpu_count
+            self.pool = ProcessPoolExecutor(
+                max_workers = self.max_workers,
+                mp_context = multiprocessing.get_context('spawn')
+            )
+
+        # Large regions get a small share of workers so that tile latency stays flat during exports
+        self.route_limits = {
+            'tiles': self.max_workers,
+            'regions': max(1,self.max_workers//4),
+            'thumbnails': max(1,self.max_workers//4)
+        } | route_limits
+
+        self.semaphores = {}
+        self.lock = threading.Lock()
+        self.queued = 0
+        self.route_stats = {}
+
+    def get_semaphore(self, route: str) -> asyncio.Semaphore:
+        """Getting the concurrency limiting semaphore for a route in the running event loop
+        """
+        loop = asyncio.get_running_loop()
+        if not route in self.semaphores or not self.semaphores[route][0] is loop:
+            self.semaphores[route] = (loop, asyncio.Semaphore(self.route_limits.get(route,self.max_workers)))
+
+        return self.semaphores[route][1]
+
+    async def run(self, route: str, source_args: tuple, func, *args, **kwargs):
+        """Running func(tile_source, *args, **kwargs) in the executor
+
+        :param route: Name of route, used for concurrency limits ("tiles", "regions", "thumbnails")
+        :type route: str
+        :param source_args: (item_id, image_filepath, style_key) used to get the tile source
+        :type source_args: tuple
+        :param func: Module-level function with tile source as the first argument
+        :type func: Callable
+        :raises TileExecutorBusy: If max_queue tasks are already running or waiting
+        :return: Output of func
+        """
+        with self.lock:
+            if self.queued>=self.max_queue:
+                self.get_route_stats(route)['rejected'] += 1
+                raise TileExecutorBusy(f'Tile executor queue is full ({self.max_queue})')
+            self.queued += 1
+
+        try:
+            async with self.get_semaphore(route):
+                loop = asyncio.get_running_loop()
+                start = time.monotonic()
+                if self.executor_type=='thread':
+                    result = await loop.run_in_executor(
+                        self.pool,
+                        partial(self.run_in_thread, source_args, func, args, kwargs)
+                    )
+                else:
+                    result = await loop.run_in_executor(
+                        self.pool,
+                        partial(run_in_process, source_args, func, args, kwargs)
+                    )
+
+                with self.lock:
+                    route_stats = self.get_route_stats(route)
+                    route_stats['completed'] += 1
+                    route_stats['seconds'] += time.monotonic()-start
+
+                return result
+        finally:
+            with self.lock:
+                self.queued -= 1
+
+    def run_in_thread(self, source_args: tuple, func, args: tuple, kwargs: dict):
+        """Getting the tile source from the shared pool and running func in a worker thread
+        """
+        with self.tile_source_pool.lease(*source_args) as tile_source:
+            return func(tile_source, *args, **kwargs)
+
+    def get_route_stats(self, route: str) -> dict:
+        """Per-route counters (lock must be held)
+        """
+        if not route in self.route_stats:
+            self.route_stats[route] = {'completed': 0, 'rejected': 0, 'seconds': 0.0}
+
+        return self.route_stats[route]
+
+    def stats(self) -> dict:
+        """Current queue size and per-route counters
+
+        :return: Dictionary containing executor statistics
+        :rtype: dict
+        """
+        with self.lock:
+            return {
+                'executor_type': self.executor_type,
+                'max_workers': self.max_workers,
+                'max_queue': self.max_queue,
+                'queued': self.queued,
+                'route_limits': self.route_limits,
+                'routes': deepcopy(self.route_stats)
+            }
+
+    def shutdown(self):
+        """Stopping worker threads/processes
+        """
+        self.pool.shutdown(wait=False, cancel_futures=True)
+
+
+class SingleFlight:
+    """Coalesces concurrent identical requests so that they share one in-flight computation
+    """
+    def __init__(self):
+        """Constructor method
+        """
+        self.in_flight = {}
+        self.lock = threading.Lock()
+
+        self.coalesced = {}
+
+    async def run(self, route: str, key: tuple, func, *args, **kwargs):
+        """Awaiting func(*args, **kwargs), or the already running computation for the same key
+
+        :param route: Name of route, used for counting coalesced requests
+        :type route: str
+        :param key: Unique key for this computation (e.g. tile cache key)
+        :type key: tuple
+        :param func: Coroutine function
+        :type func: Callable
+        :return: Output of func
+        """
+        loop = asyncio.get_running_loop()
+        flight_key = (id(loop), key)
+
+        with self.lock:
+            task = self.in_flight.get(flight_key)
+            if task is None:
+                # Running as a separate task so one client disconnecting doesn't cancel it for everyone else
+                task = loop.create_task(func(*args, **kwargs))
+                self.in_flight[flight_key] = task
+                task.add_done_callback(partial(self.remove, flight_key))
+            else:
+                self.coalesced[route] = self.coalesced.get(route,0)+1
+
+        return await asyncio.shield(task)
+
+    def remove(self, flight_key: tuple, task: asyncio.Task):
+        """Removing finished computation
+        """
+        with self.lock:
+            if self.in_flight.get(flight_key) is task:
+                del self.in_flight[flight_key]
+
+    def stats(self) -> dict:
+        """Number of in-flight computations and coalesced requests per route
+
+        :return: Dictionary containing request coalescing statistics
+        :rtype: dict
+        """
+        with self.lock:
+            return {
+                'in_flight': len(self.in_flight),
+                'coalesced': sum(list(self.coalesced.values())),
+                'routes': deepcopy(self.coalesced)
+            }
+
+
+class TilePrefetcher:
+    """Background worker which speculatively renders tiles at a lower priority than incoming requests
+    """
+    def __init__(self,
+                 executor: TileExecutor,
+                 cpu_budget: float = 0.25,
+                 max_queue: int = 1024,
+                 n_workers: int = 1):
+        """Constructor method
+
+        :param executor: TileExecutor handling real requests, prefetching waits while it has queued work
+        :type executor: TileExecutor
+        :param cpu_budget: Fraction (0-1] of each worker's time that can be spent prefetching, defaults to 0.25
+        :type cpu_budget: float, optional
+        :param max_queue: Maximum number of pending prefetch jobs, new jobs are dropped when full, defaults to 1024
+        :type max_queue: int, optional
+        :param n_workers: Number of prefetch worker threads, defaults to 1
+        :type n_workers: int, optional
+        """
+
+        assert 0 < cpu_budget <= 1
+
+        self.executor = executor
+        self.cpu_budget = cpu_budget
+        self.max_queue = max_queue
+        self.n_workers = n_workers
+
+        self.queue = PriorityQueue()
+        self.pending = set()
+        self.lock = threading.Lock()
+        self.sequence = 0
+
+        self.completed = 0
+        self.dropped = 0
+        self.errors = 0
+
+        self.stop_event = threading.Event()
+        self.workers = []
+
+    def start(self):
+        """Starting prefetch worker threads (if they aren't already running)
+        """
+        with self.lock:
+            if len(self.workers)>0:
+                return
+
+            for w in range(self.n_workers):
+                new_thread = threading.Thread(
+                    target = self.run,
+                    name = f'fusion_tile_prefetch_{w}',
+                    daemon = True
+                )
+                new_thread.start()
+                self.workers.append(new_thread)
+
+    def stop(self):
+        """Stopping prefetch worker threads
+        """
+        self.stop_event.set()
+
+    def add(self, priority: int, job_key: tuple, func, *args) -> bool:
+        """Adding a job to the prefetch queue (lower priority values run first)
+
+        :param priority: Job priority
+        :type priority: int
+        :param job_key: Unique key for this job, duplicate pending jobs are ignored
+        :type job_key: tuple
+        :param func: Function to call in the prefetch worker
+        :type func: Callable
+        :return: Whether the job was added
+        :rtype: bool
+        """
+        with self.lock:
+            if job_key in self.pending:
+                return False
+
+            if len(self.pending)>=self.max_queue:
+                self.dropped += 1
+                return False
+
+            self.pending.add(job_key)
+            self.sequence += 1
+            self.queue.put((priority, self.sequence, job_key, func, args))
+
+        self.start()
+
+        return True
+
+    def run(self):
+        """Prefetch worker loop
+        """
+        while not self.stop_event.is_set():
+            try:
+                priority, _, job_key, func, args = self.queue.get(timeout = 1)
+            except Empty:
+                continue
+
+            # Yielding to real requests
+            while self.executor.queued>0 and not self.stop_event.is_set():
+                time.sleep(0.05)
+
+            start = time.monotonic()
+            try:
+                func(*args)
+                with self.lock:
+                    self.completed += 1
+            except Exception:
+                with self.lock:
+                    self.errors += 1
+            finally:
+                with self.lock:
+                    self.pending.discard(job_key)
+
+            # Idling so that prefetching uses at most cpu_budget of this worker's time
+            elapsed = time.monotonic()-start
+            if self.cpu_budget<1:
+                self.stop_event.wait(elapsed*(1-self.cpu_budget)/self.cpu_budget)
+
+    def stats(self) -> dict:
+        """Current prefetch queue size and counters
+
+        :return: Dictionary containing prefetch statistics
+        :rtype: dict
+        """
+        with self.lock:
+            return {
+                'pending': len(self.pending),
+                'completed': self.completed,
+                'dropped': self.dropped,
+                'errors': self.errors,
+                'cpu_budget': self.cpu_budget
+            }
+
+
+class TileServer:
+    """Components which pull information from a slide(s)
+    """
+
+    def get_slide_urls(slide_dict,**kwargs):
+        raise NotImplementedError
+
+
+class LocalTileServer(TileServer):
+    """Tile server from image saved locally. Uses large-image to read and parse image formats (default: [common])
+    """
+    def __init__(self,
+                 database: Union[fusionDB,None] = None,
+                 tile_server_port:int = 8050,
+                 host: str = 'localhost',
+                 protocol: str = 'http',
+                 jupyter_server_url: Union[str,None] = None,
+                 cors_options: dict = {},
+                 cache_options: dict = {},
+                 executor_options: dict = {},
+                 prefetch_options: dict = {},
+                 encoding_options: dict = {}
+                 ):
+        """Constructor method
+
+        :param cache_options: Options for cached resources, "tile_sources" accepts "max_size", "max_idle" (seconds), and "max_open_files". "tiles" accepts "max_memory" (bytes), "disk_path", "max_disk" (bytes), and "max_age" (seconds, Cache-Control header). "frames" accepts "max_memory" (bytes, decoded frame tiles used for compositing). "export_path" sets the folder for temporary region exports, defaults to {}
+        :type cache_options: dict, optional
+        :param executor_options: Options for decode/encode workers, accepts "executor_type" ("thread" or "process"), "max_workers", "max_queue", and "route_limits" (dict of "tiles", "regions", "thumbnails" concurrency limits), "max_batch_size" (maximum tiles/regions in one /tiles/batch request), and "max_region_pixels" (larger regions must be scaled or exported), defaults to {}
+        :type executor_options: dict, optional
+        :param prefetch_options: Options for background tile prefetching, accepts "enabled" (default False), "pyramid_levels" (number of low-zoom levels rendered when a slide is opened), "neighbors" (radius of same-level tiles rendered around each requested tile), "parents", "children", "cpu_budget", "max_queue", and "n_workers", defaults to {}
+        :type prefetch_options: dict, optional
+        :param encoding_options: Default output encoding for tiles, regions, and thumbnails (can be overridden per-request), accepts "encoding" ("PNG", "JPEG", "WEBP", or None to return large-image's output as-is), and "quality" (1-100, JPEG/WEBP only), defaults to {}
+        :type encoding_options: dict, optional
+        """
+
+        self.database = database
+        self.tile_server_port = tile_server_port
+        self.host = host
+        self.protocol = protocol
+        self.cors_options = cors_options
+        self.cache_options = cache_options
+        self.executor_options = executor_options
+        self.prefetch_options = {
+            'enabled': False,
+            'pyramid_levels': 4,
+            'neighbors': 1,
+            'parents': True,
+            'children': True
+        } | prefetch_options
+        self.encoding_options = {
+            'encoding': None,
+            'quality': 90
+        } | encoding_options
+        self.jupyter_server_url = jupyter_server_url
+
+        tile_source_options = self.cache_options.get('tile_sources',{})
+        self.tile_source_pool = TileSourcePool(
+            max_size = tile_source_options.get('max_size',32),
+            max_idle = tile_source_options.get('max_idle',600),
+            max_open_files = tile_source_options.get('max_open_files',None)
+        )
+
+        tile_cache_options = self.cache_options.get('tiles',{})
+        self.tile_cache = TileCache(
+            max_memory = tile_cache_options.get('max_memory',128*1024*1024),
+            disk_path = tile_cache_options.get('disk_path',None),
+            max_disk = tile_cache_options.get('max_disk',1024*1024*1024)
+        )
+        self.tile_max_age = tile_cache_options.get('max_age',604800)
+        self.frame_cache = FrameTileCache(
+            max_memory = self.cache_options.get('frames',{}).get('max_memory',256*1024*1024)
+        )
+        self.max_batch_size = self.executor_options.get('max_batch_size',1024)
+        self.max_region_pixels = self.executor_options.get('max_region_pixels',100000000)
+        self.export_path = self.cache_options.get('export_path',None)
+
+        self.executor = TileExecutor(
+            tile_source_pool = self.tile_source_pool,
+            executor_type = self.executor_options.get('executor_type','thread'),
+            max_workers = self.executor_options.get('max_workers',None),
+            max_queue = self.executor_options.get('max_queue',256),
+            route_limits = self.executor_options.get('route_limits',{})
+        )
+        self.single_flight = SingleFlight()
+
+        self.prefetcher = TilePrefetcher(
+            executor = self.executor,
+            cpu_budget = self.prefetch_options.get('cpu_budget',0.25),
+            max_queue = self.prefetch_options.get('max_queue',1024),
+            n_workers = self.prefetch_options.get('n_workers',1)
+        )
+
+        if self.jupyter_server_url is None or self.jupyter_server_url=='':
+            self.access_url = f'{self.protocol}://{self.host}:{self.tile_server_port}'
+        else:
+            self.access_url = self.jupyter_server_url
+
+        self.app = FastAPI(
+            title = 'TileServer',
+            description = 'Locally deployed tileserver for high-resolution microscopy images',
+            version = '3.6.42'
+        )
+
+        self.app.add_middleware(
+            CORSMiddleware,
+            allow_origins=self.cors_options.get('allow_origins',['*']),
+            allow_methods=self.cors_options.get('allow_methods',['GET','POST','OPTIONS']),
+            allow_headers = self.cors_options.get('allow_headers',['*']),
+            expose_headers = self.cors_options.get('expose_headers',['*']),
+            allow_credentials = self.cors_options.get('allow_credentials',False)
+        )
+
+        self.router = APIRouter()
+        self.router.add_api_route('/',self.root,methods=["GET","OPTIONS"])
+        self.router.add_api_route('/ids',self.get_ids,methods=["GET","OPTIONS"])
+        self.router.add_api_route('/names',self.get_names,methods=["GET","OPTIONS"])
+        self.router.add_api_route('/stats',self.get_stats,methods=["GET","OPTIONS"])
+        self.router.add_api_route('/{id}/info',self.get_id_info,methods=["GET","OPTIONS"])
+        self.router.add_api_route('/{id}/tiles/{z}/{x}/{y}',self.get_tile,methods=["GET","OPTIONS"])
+        self.router.add_api_route('/{id}/image_metadata',self.get_image_metadata,methods=["GET","OPTIONS"])
+        self.router.add_api_route('/{id}/metadata',self.get_metadata,methods=["GET","OPTIONS"])
+        self.router.add_api_route('/{id}/tiles/region',self.get_region,methods=["GET","OPTIONS"])
+        self.router.add_api_route('/{id}/tiles/region/array',self.get_region_array,methods=["GET","OPTIONS"])
+        self.router.add_api_route('/{id}/tiles/region/export',self.get_region_export,methods=["GET","OPTIONS"])
+        self.router.add_api_route('/{id}/tiles/thumbnail',self.get_thumbnail,methods=["GET","OPTIONS"])
+        self.router.add_api_route('/{id}/tiles/prefetch',self.get_prefetch,methods=["GET","OPTIONS"])
+        self.router.add_api_route('/{id}/tiles/batch',self.get_tile_batch,methods=["GET","POST","OPTIONS"])
+        self.router.add_api_route('/{id}/tiles/composite/{z}/{x}/{y}',self.get_composite_tile,methods=["GET","OPTIONS"])
+        self.router.add_api_route('/{id}/annotations',self.get_annotations,methods=["GET","OPTIONS"])
+        self.router.add_api_route('/{id}/annotations/metadata',self.get_annotations_metadata,methods=["GET", "OPTIONS"])
+        self.router.add_api_route('/{id}/annotations/data/list',self.get_annotations_property_keys,methods=["GET","OPTIONS"])
+        self.router.add_api_route('/{id}/annotations/data',self.get_annotations_property_data,methods=["GET","OPTIONS"])
+        self.router.add_api_route('/{id}/annotations/data/aggregate',self.get_annotations_property_aggregate,methods=["GET","OPTIONS"])
+
+    def __str__(self):
+        return f'TileServer class to {self.host}:{self.tile_server_port}'
+
+    def add_new_image(self,
+        new_image_id:str,
+        new_image_path:str,
+        new_annotations:Union[str,list,dict,None] = None,
+        new_metadata:Union[dict,None] = None,
+        new_image_style:Union[dict,None] = None,
+        new_image_public: bool = False,
+        session_id: Union[str,None] = None,
+        user_id: Union[str,None] = None,
+        skip_unchanged: bool = False
+        ) -> bool:
+        """Adding a new image (and its annotations) to this tile server
+
+        :param new_image_id: String uuid for this image
+        :type new_image_id: str
+        :param new_image_path: Path to the image file
+        :type new_image_path: str
+        :param new_annotations: Annotations for this image (file path(s) or GeoJSON), defaults to None
+        :type new_annotations: Union[str,list,dict,None], optional
+        :param new_metadata: Additional metadata for this image, defaults to None
+        :type new_metadata: Union[dict,None], optional
+        :param new_image_style: Style dict for large-image reader, defaults to None
+        :type new_image_style: Union[dict,None], optional
+        :param new_image_public: Whether this image is accessible by all users, defaults to False
+        :type new_image_public: bool, optional
+        :param session_id: String uuid for the current visualization session, defaults to None
+        :type session_id: Union[str,None], optional
+        :param user_id: String uuid for the user which is given access to this image (if not public), defaults to None
+        :type user_id: Union[str,None], optional
+        :param skip_unchanged: Whether to skip loading the image/annotations if they haven't changed since this id was last added to the database, defaults to False
+        :type skip_unchanged: bool, optional
+        :return: Whether the image was (re-)ingested
+        :rtype: bool
+        """
+
+        source_hash = get_source_hash([new_image_path, new_annotations, new_metadata, new_image_style, new_image_public])
+        if skip_unchanged and self.database.get_item_source_hash(new_image_id)==source_hash:
+            # Reading the image and annotations isn't necessary, only granting access to this user
+            if not new_image_public and not user_id is None:
+                self.database.add_access(new_image_id, user_id)
+            return False
+
+        # Verifying filepaths and loading annotations
+        new_local_item = Slide(
+            image_filepath=new_image_path,
+            annotations = new_annotations,
+            metadata = new_metadata,
+            image_style=new_image_style,
+            public = new_image_public
+        )
+
+        self.add_new_slide(new_image_id,new_local_item,session_id,user_id,source_hash = source_hash)
+
+        return True
+
+    def add_new_slide(self, slide_id: str, slide_obj: Slide, session_id: Union[str,None] = None, user_id: Union[str,None] = None, skip_unchanged: bool = False, source_hash: Union[str,None] = None) -> bool:
+        """Adding a Slide object to this tile server
+
+        :param slide_id: String uuid for this slide
+        :type slide_id: str
+        :param slide_obj: Slide containing the image path and loaded annotations
+        :type slide_obj: Slide
+        :param session_id: String uuid for the current visualization session, defaults to None
+        :type session_id: Union[str,None], optional
+        :param user_id: String uuid for the user which is given access to this slide (if not public), defaults to None
+        :type user_id: Union[str,None], optional
+        :param skip_unchanged: Whether to skip adding the slide to the database if its sources haven't changed since this id was last added, defaults to False
+        :type skip_unchanged: bool, optional
+        :param source_hash: Hash of the slide's sources (computed from the Slide if not provided), defaults to None
+        :type source_hash: Union[str,None], optional
+        :return: Whether the slide was (re-)ingested
+        :rtype: bool
+        """
+        if source_hash is None:
+            source_hash = get_source_hash([slide_obj.image_filepath, slide_obj.annotations, slide_obj.metadata, slide_obj.image_style, slide_obj.public])
+
+        if skip_unchanged and self.database.get_item_source_hash(slide_id)==source_hash:
+            if not slide_obj.public and not user_id is None:
+                self.database.add_access(slide_id, user_id)
+            return False
+
+        slide_name = slide_obj.image_filepath.split(os.sep)[-1]
+        # Adding information to database
+        self.database.add_slide(
+            slide_id = slide_id,
+            slide_name = slide_name,
+            item_type = 'local_item',
+            metadata = slide_obj.metadata,
+            image_metadata = slide_obj.image_metadata,
+            image_filepath = slide_obj.image_filepath,
+            annotations_metadata = slide_obj.annotations_metadata,
+            annotations = slide_obj.processed_annotations,
+            vis_session_id = session_id,
+            user_id = user_id,
+            public = slide_obj.public,
+            source_hash = source_hash
+        )
+
+        # Closing any tile sources opened for a previous version of this item
+        self.tile_source_pool.invalidate(slide_id)
+        self.tile_cache.invalidate(slide_id)
+        self.frame_cache.invalidate(slide_id)
+
+        return True
+
+    @staticmethod
+    def get_local_slide_id(image_filepath:str, occurrence:int = 0) -> str:
+        """Getting a stable id for a local image (the same across restarts) from its path
+
+        :param image_filepath: Path to the image file
+        :type image_filepath: str
+        :param occurrence: Index used to distinguish repeated uses of the same image, defaults to 0
+        :type occurrence: int, optional
+        :return: 24 character id
+        :rtype: str
+        """
+        id_source = os.path.abspath(image_filepath) if occurrence==0 else f'{os.path.abspath(image_filepath)}:{occurrence}'
+
+        return hashlib.sha1(id_source.encode()).hexdigest()[:24]
+
+    def root(self):
+        return {'message': "Oh yeah, now we're cooking"}
+
+    async def get_item(self,item_id:str, token:Union[str,None] = None):
+        """Grabbing item from database
+
+        :param item_id: String uuid for local item
+        :type item_id: str
+        :return: Item instance
+        :rtype: None
+        """
+
+        # Resolved from fusionDB's access cache so that tile requests don't query the database each time
+        image_item = await self.database.get_accessible_item_async(item_id, token)
+
+        return image_item
+
+    async def get_tile_source_args(self, item_id:str, style:Union[str,None] = None, token: Union[str,None] = None):
+        """Getting arguments needed to open a tile source for a given id+style combo (checks access to the item).
+
+        :param item_id: String uuid for local image
+        :type item_id: str
+        :param style: Style dict for large-image reader, specifying bands/palettes, etc., defaults to None
+        :type style: Union[str,None], optional
+        :return: (item_id, image_filepath, style_key) or None if the item is not found/accessible
+        :rtype: Union[tuple,None]
+        """
+
+        image_item = await asyncio.gather(self.get_item(item_id,token))
+        if len(image_item[0])==0:
+            return None
+        else:
+            image_item = image_item[0][0]
+            image_filepath = image_item.get('filepath')
+
+            return (item_id, image_filepath, TileSourcePool.get_style_key(style))
+
+    async def get_tile_source(self,item_id:str,style:Union[str,None]=None, token: Union[str,None] = None):
+        """Getting large-image tile source for a given id+style combo.
+
+        :param item_id: String uuid for local image
+        :type item_id: str
+        :param style: Style dict for large-image reader, specifying bands/palettes, etc., defaults to None
+        :type style: Union[str,None], optional
+        :return: Tile source
+        :rtype: None
+        """
+
+        source_args = await self.get_tile_source_args(item_id, style, token)
+        if source_args is None:
+            return None
+
+        return self.tile_source_pool.get(*source_args)
+
+    async def get_item_annotations(self, item_id:str, request: Request = None, bbox:Union[list,None] = None):
+        """Loading annotations from item database
+
+        :param item_id: String uuid for local image
+        :type item_id: str
+        :param bbox: Bounding box (minx, miny, maxx, maxy) to restrict structures to, defaults to None
+        :type bbox: Union[list,None], optional
+        """
+        token = None
+        if not request is None:
+            if request.query_params.get('token'):
+                token = request.query_params.get('token')
+
+        # Layers, structures, and image overlays are each loaded with a single query
+        item_annotations = await self.database.get_item_annotations_async(
+            item_id,
+            user_token = token,
+            bbox = bbox
+        )
+
+        return item_annotations
+
+    def get_names(self, request: Request, size:Union[int,None] = None, offset:int = 0, order:Union[str,None] = None):
+        """Get names of items in fusionDB
+
+        :param size: Number of names to return, defaults to None (all)
+        :type size: Union[int,None], optional
+        :param offset: Number of names to skip, defaults to 0
+        :type offset: int, optional
+        :param order: Column to order names by, defaults to None
+        :type order: Union[str,None], optional
+        :return: Message dictionary containing list of all item names
+        :rtype: dict
+        """
+
+        item_names = self.database.get_names(
+            table_name = 'item',
+            size = size,
+            offset = offset,
+            order = order
+        )
+
+        return {'message': item_names}
+
+    def get_ids(self, size:Union[int,None] = None, offset:int = 0, after:Union[str,None] = None):
+        """Get all available ids in the database
+
+        :param size: Number of ids to return, defaults to None (all)
+        :type size: Union[int,None], optional
+        :param offset: Number of ids to skip, defaults to 0
+        :type offset: int, optional
+        :param after: Return ids after this id (keyset pagination), defaults to None
+        :type after: Union[str,None], optional
+        """
+        item_ids = self.database.get_ids(
+            table_name = 'item',
+            size = size,
+            offset = offset,
+            after = after
+        )
+
+        return {'message': item_ids}
+
+    async def get_id_info(self, id:str):
+        """Get info for a single id
+        """
+        image_item = await asyncio.gather(self.get_item(id))
+
+        if len(image_item[0])>0:
+            item_info = image_item[0][0]
+            return Response(
+                content = json.dumps(item_info,default=str),
+                media_type = 'application/json'
+            )
+        else:
+            return Response(
+                content = 'invalid image id',
+                media_type='application/json',
+                status_code=400,
+            )
+
+    def get_stats(self):
+        """Get usage statistics for cached tile server resources
+        """
+
+        return {
+            'tile_sources': self.tile_source_pool.stats(),
+            'tiles': self.tile_cache.stats(),
+            'frames': self.frame_cache.stats(),
+            'executor': self.executor.stats(),
+            'coalescing': self.single_flight.stats(),
+            'prefetch': self.prefetcher.stats(),
+            'access': self.database.access_cache.stats()
+        }
+
+    def get_item_names_ids(self, filters = None, size = None, offset = 0):
+        """Get list of names and ids of all locally stored images in this tileserver
+        """
+
+        item_names_ids = self.database.search(
+            search_kwargs={
+                'type': 'item',
+                'filters': filters
+            },
+            size = size,
+            offset = offset,
+            columns = ['name','id']
+        )
+
+        return item_names_ids
+
+    @staticmethod
+    def get_slide_urls(slide_dict,user_token,standalone = False):
+
+        slide_id = slide_dict.get('id')
+        url = slide_dict.get('url')
+
+        if not standalone:
+            slide_url_dict = {
+                'tiles': f'{url}/tileserver/{slide_id}/tiles/'+'{z}/{x}/{y}',
+                'regions': f'{url}/tileserver/{slide_id}/tiles/region',
+                'regions_array': f'{url}/tileserver/{slide_id}/tiles/region/array',
+                'regions_export': f'{url}/tileserver/{slide_id}/tiles/region/export',
+                'prefetch': f'{url}/tileserver/{slide_id}/tiles/prefetch',
+                'batch': f'{url}/tileserver/{slide_id}/tiles/batch',
+                'composite': f'{url}/tileserver/{slide_id}/tiles/composite/'+'{z}/{x}/{y}',
+                'image_metadata': f'{url}/tileserver/{slide_id}/image_metadata',
+                'metadata': f'{url}/tileserver/{slide_id}/metadata',
+                'annotations': f'{url}/tileserver/{slide_id}/annotations',
+                'annotations_metadata':f'{url}/tileserver/{slide_id}/annotations/metadata',
+                'annotations_region':f'{url}/tileserver/{slide_id}/annotations'
+            }
+        else:
+            slide_url_dict = {
+                'tiles': f'{url}/{slide_id}/tiles/'+'{z}/{x}/{y}',
+                'regions': f'{url}/{slide_id}/tiles/region',
+                'regions_array': f'{url}/{slide_id}/tiles/region/array',
+                'regions_export': f'{url}/{slide_id}/tiles/region/export',
+                'prefetch': f'{url}/{slide_id}/tiles/prefetch',
+                'batch': f'{url}/{slide_id}/tiles/batch',
+                'composite': f'{url}/{slide_id}/tiles/composite/'+'{z}/{x}/{y}',
+                'image_metadata': f'{url}/{slide_id}/image_metadata',
+                'metadata': f'{url}/{slide_id}/metadata',
+                'annotations': f'{url}/{slide_id}/annotations',
+                'annotations_metadata':f'{url}/{slide_id}/annotations/metadata',
+                'annotations_region':f'{url}/{slide_id}/annotations'
+            }
+
+        if not user_token is None:
+            for k,v in slide_url_dict.items():
+                slide_url_dict[k] = v + f'?token={user_token}'
+
+        return slide_url_dict
+
+    def get_tiles_url(self,slide_id):
+        tiles_url = f'{self.protocol}://{self.host}:{self.tile_server_port}/{slide_id}/tiles/'+'{z}/{x}/{y}'
+
+        return tiles_url
+
+    def get_regions_url(self,slide_id):
+        regions_url = f'{self.protocol}://{self.host}:{self.tile_server_port}/{slide_id}/tiles/region'
+
+        return regions_url
+
+    def get_regions_array_url(self,slide_id):
+        regions_array_url = f'{self.protocol}://{self.host}:{self.tile_server_port}/{slide_id}/tiles/region/array'
+
+        return regions_array_url
+
+    def get_annotations_url(self,slide_id):
+        annotations_url = f'{self.protocol}://{self.host}:{self.tile_server_port}/{slide_id}/annotations'
+
+        return annotations_url
+
+    def get_annotations_metadata_url(self,slide_id):
+        annotations_metadata_url = f'{self.protocol}://{self.host}:{self.tile_server_port}/{slide_id}/annotations/metadata'
+
+        return annotations_metadata_url
+
+    def get_metadata_url(self,slide_id):
+        metadata_url = f'{self.protocol}://{self.host}:{self.tile_server_port}/{slide_id}/metadata'
+
+        return metadata_url
+
+    def get_image_metadata_url(self,slide_id):
         image_metadata_url = f'{self.protocol}://{self.host}:{self.tile_server_port}/{slide_id}/image_metadata'
 
         return image_metadata_url
 
-    async def get_tile(self,id:str,z:int, x:int, y:int, style:Union[None,str] = None, request:Request = None):
+    async def get_tile(self,id:str,z:int, x:int, y:int, style:Union[None,str] = None, encoding:Union[None,str] = None, quality:Union[None,int] = None, grayscale:bool = False, request:Request = None):
         """Tiles endpoint, returns an image tyle based on provided coordinates
 
         :param id: Local item id
@@ -573,6 +1935,12 @@ class LocalTileServer(TileServer):
         :type y: int
         :param style: Additional style arguments to pass to large-image, defaults to {}
         :type style: dict, optional
+        :param encoding: Output encoding ("PNG", "JPEG", or "WEBP"), defaults to the server's encoding_options
+        :type encoding: Union[None,str], optional
+        :param quality: JPEG/WEBP quality (1-100), defaults to the server's encoding_options
+        :type quality: Union[None,int], optional
+        :param grayscale: Whether to return a single-channel 8-bit tile, defaults to False
+        :type grayscale: bool, optional
         :return: Image tile containing bytes encoded pixel information
         :rtype: Response
         """
@@ -586,38 +1954,749 @@ class LocalTileServer(TileServer):
             if request.query_params.get('token'):
                 token = request.query_params.get('token')
 
-        tile_source = await asyncio.gather(self.get_tile_source(id,style, token))
-        tile_source = tile_source[0]
-        if tile_source is None:
-            return Response(
-                content = 'invalid image id',
-                media_type='application/json',
-                status_code=400,
-            )
+        try:
+            encoding_args = self.get_encoding_args(encoding, quality, grayscale)
+        except ValueError as e:
+            return Response(
+                content = str(e),
+                media_type = 'application/json',
+                status_code = 400
+            )
+
+        source_args = await self.get_tile_source_args(id, style, token)
+        if source_args is None:
+            return Response(
+                content = 'invalid image id',
+                media_type='application/json',
+                status_code=400,
+            )
+
+        if self.prefetch_options.get('enabled'):
+            self.schedule_tile_prefetch(source_args, z, x, y, encoding_args)
+
+        # Checking cache after get_tile_source_args so that access to the item is still validated
+        cache_key = self.get_tile_cache_key(source_args, z, x, y, encoding_args)
+        cached_tile = self.tile_cache.get(cache_key)
+        if not cached_tile is None:
+            return self.get_cached_response(cached_tile, get_media_type(cached_tile[0]), request, private = not token is None)
+
+        try:
+            # Concurrent requests for the same tile share one decode
+            cached_tile = await self.single_flight.run(
+                'tiles',
+                cache_key,
+                self.render_tile,
+                cache_key,
+                source_args,
+                x,
+                y,
+                z,
+                encoding_args
+            )
+
+        except TileExecutorBusy:
+            return self.get_busy_response()
+
+        except large_image.exceptions.TileSourceXYZRangeError:
+            # This error appears for any negative tile coordinates
+            tile_metadata = await self.executor.run('tiles', source_args, call_tile_source, 'getMetadata')
+            raw_tile = np.zeros(
+                (
+                    tile_metadata['tileHeight'],
+                    tile_metadata['tileWidth']
+                ),
+                dtype=np.uint8
+            ).tobytes()
+
+            return Response(
+                content = raw_tile,
+                media_type='image/png',
+            )
+
+        return self.get_cached_response(cached_tile, get_media_type(cached_tile[0]), request, private = not token is None)
+
+    async def get_composite_tile(self, id:str, z:int, x:int, y:int, channels:str, blend:str = 'lighten', encoding:Union[None,str] = None, quality:Union[None,int] = None, grayscale:bool = False, request:Request = None):
+        """Compositing tiles endpoint, blends any subset of frames (channels) using colors and contrast limits.
+
+        Decoded single-frame tiles are cached so changing colors/contrast limits or toggling channels only requires re-blending.
+
+        :param id: Local item id
+        :type id: str
+        :param z: Zoom level for tile
+        :type z: int
+        :param x: X tile coordinate
+        :type x: int
+        :param y: Y tile coordinate
+        :type y: int
+        :param channels: JSON list of channels, each containing "frame" and optionally "color" (CSS color string or [r,g,b,a], default white), "min", and "max" (contrast limits, default dtype range)
+        :type channels: str
+        :param blend: Either "lighten" (maximum) or "add" (sum), defaults to 'lighten'
+        :type blend: str, optional
+        :param encoding: Output encoding ("PNG", "JPEG", or "WEBP"), defaults to the server's encoding_options (PNG if not set)
+        :type encoding: Union[None,str], optional
+        :param quality: JPEG/WEBP quality (1-100), defaults to the server's encoding_options
+        :type quality: Union[None,int], optional
+        :param grayscale: Whether to return a single-channel 8-bit tile (e.g. for a single white channel), defaults to False
+        :type grayscale: bool, optional
+        :return: Composite image tile
+        :rtype: Response
+        """
+
+        if any([i<0 for i in [z,x,y]]):
+            return Response(status_code=200)
+
+        token = None
+        if not request is None:
+            if request.query_params.get('token'):
+                token = request.query_params.get('token')
+
+        try:
+            channels = self.get_composite_channels(channels)
+            if not blend in ['lighten','add']:
+                raise ValueError(f'invalid blend: {blend}, must be one of ["lighten", "add"]')
+
+            encoding_args = self.get_encoding_args(encoding, quality, grayscale)
+            if encoding_args[0] is None:
+                encoding_args = ('PNG', None, False)
+        except ValueError as e:
+            return Response(
+                content = str(e),
+                media_type = 'application/json',
+                status_code = 400
+            )
+
+        # Frames are read without a style
+        source_args = await self.get_tile_source_args(id, None, token)
+        if source_args is None:
+            return Response(
+                content = 'invalid image id',
+                media_type = 'application/json',
+                status_code = 400
+            )
+
+        composite_key = 'composite:'+json.dumps([channels,blend],sort_keys=True,separators=(',',':'))
+        cache_key = (id, z, x, y, composite_key, self.get_encoding_key(encoding_args))
+        cached_tile = self.tile_cache.get(cache_key)
+        if cached_tile is None:
+            try:
+                cached_tile = await self.single_flight.run(
+                    'tiles',
+                    cache_key,
+                    self.render_composite_tile,
+                    cache_key,
+                    source_args,
+                    x,
+                    y,
+                    z,
+                    channels,
+                    blend,
+                    encoding_args
+                )
+            except TileExecutorBusy:
+                return self.get_busy_response()
+            except ValueError as e:
+                return Response(
+                    content = str(e),
+                    media_type = 'application/json',
+                    status_code = 400
+                )
+            except large_image.exceptions.TileSourceXYZRangeError:
+                return Response(status_code = 204)
+
+        return self.get_cached_response(cached_tile, get_media_type(cached_tile[0]), request, private = not token is None)
+
+    def get_composite_channels(self, channels: str) -> list:
+        """Parsing and normalizing the channels parameter of the composite tiles endpoint
+
+        :param channels: JSON list of channel dicts
+        :type channels: str
+        :raises ValueError: Invalid channels
+        :return: List of {"frame", "color" ([r,g,b,a]), "min", "max"} dicts
+        :rtype: list
+        """
+        try:
+            channels = json.loads(channels)
+            if type(channels)==dict:
+                channels = [channels]
+
+            composite_channels = []
+            for c in channels:
+                color = c.get('color','rgba(255,255,255,255)')
+                if type(color)==str and color.replace(' ','').startswith('rgba('):
+                    color = [float(i) for i in color.replace(' ','')[5:-1].split(',')]
+                    # CSS alpha is 0-1, large-image palettes use 0-255
+                    if color[3]<=1:
+                        color[3] *= 255
+                elif type(color)==str:
+                    color = list(ImageColor.getrgb(color))
+                color = [int(i) for i in color]
+                if len(color)==3:
+                    color += [255]
+
+                composite_channels.append({
+                    'frame': int(c['frame']),
+                    'color': color[:4],
+                    'min': float(c['min']) if not c.get('min') is None else None,
+                    'max': float(c['max']) if not c.get('max') is None else None
+                })
+        except (TypeError, KeyError, IndexError, AttributeError, json.JSONDecodeError, ValueError):
+            raise ValueError('invalid channels, must be a JSON list of {"frame": int, "color": str/list, "min": number, "max": number}')
+
+        if len(composite_channels)==0:
+            raise ValueError('invalid channels, at least one channel is required')
+
+        return composite_channels
+
+    async def render_composite_tile(self, cache_key: tuple, source_args: tuple, x: int, y: int, z: int, channels: list, blend: str, encoding_args: tuple):
+        """Decoding any frames that aren't already cached, then blending and encoding the composite tile
+
+        :param cache_key: Tile cache key
+        :type cache_key: tuple
+        :param source_args: (item_id, image_filepath, style_key) from get_tile_source_args
+        :type source_args: tuple
+        :param channels: Normalized channels from get_composite_channels
+        :type channels: list
+        :param blend: Blend mode
+        :type blend: str
+        :param encoding_args: (encoding, quality, grayscale)
+        :type encoding_args: tuple
+        :return: (content, etag) tuple
+        :rtype: tuple
+        """
+        frames = list(dict.fromkeys([c['frame'] for c in channels]))
+        frame_tiles = {f: self.frame_cache.get((source_args[0], z, x, y, f)) for f in frames}
+
+        missing_frames = [f for f in frames if frame_tiles[f] is None]
+        if len(missing_frames)>0:
+            decoded_tiles = await self.executor.run(
+                'tiles',
+                source_args,
+                read_frame_tiles,
+                x,
+                y,
+                z,
+                missing_frames
+            )
+            for f, frame_tile in zip(missing_frames, decoded_tiles):
+                self.frame_cache.set((source_args[0], z, x, y, f), frame_tile)
+                frame_tiles[f] = frame_tile
+
+        # Blending is vectorized numpy so it is run in the default thread pool instead of the decode executor
+        composite_tile = await asyncio.get_running_loop().run_in_executor(
+            None,
+            encode_composite,
+            [frame_tiles[c['frame']] for c in channels],
+            channels,
+            blend,
+            encoding_args
+        )
+
+        return self.tile_cache.set(cache_key, composite_tile)
+
+    def get_encoding_args(self, encoding: Union[str,None] = None, quality: Union[int,None] = None, grayscale: bool = False) -> tuple:
+        """Combining requested encoding parameters with the server defaults
+
+        :param encoding: Requested encoding ("PNG", "JPEG", or "WEBP"), defaults to None
+        :type encoding: Union[str,None], optional
+        :param quality: Requested JPEG/WEBP quality (1-100), defaults to None
+        :type quality: Union[int,None], optional
+        :param grayscale: Whether to output a single-channel 8-bit image, defaults to False
+        :type grayscale: bool, optional
+        :raises ValueError: Unsupported encoding
+        :return: (encoding, quality, grayscale), encoding is None if large-image's output should be returned as-is
+        :rtype: tuple
+        """
+        if encoding is None:
+            encoding = self.encoding_options.get('encoding')
+        if quality is None:
+            quality = self.encoding_options.get('quality',90)
+
+        if encoding is None:
+            if not grayscale:
+                return (None, None, False)
+            # Single-channel output has to be re-encoded
+            encoding = 'PNG'
+
+        encoding = encoding.upper().replace('JPG','JPEG')
+        if not encoding in TILE_ENCODINGS:
+            raise ValueError(f'invalid encoding: {encoding}, must be one of {list(TILE_ENCODINGS.keys())}')
+
+        return (encoding, int(min(max(quality,1),100)), grayscale)
+
+    def get_encoding_key(self, encoding_args: tuple) -> str:
+        """Cache key component for an encoding (e.g. "native", "png-gray", "jpeg-90")
+
+        :param encoding_args: (encoding, quality, grayscale) from get_encoding_args
+        :type encoding_args: tuple
+        :return: Encoding key
+        :rtype: str
+        """
+        encoding, quality, grayscale = encoding_args
+        if encoding is None:
+            return 'native'
+
+        encoding_key = encoding.lower()
+        if not encoding=='PNG':
+            encoding_key += f'-{quality}'
+        if grayscale:
+            encoding_key += '-gray'
+
+        return encoding_key
+
+    def get_tile_cache_key(self, source_args: tuple, z: int, x: int, y: int, encoding_args: tuple) -> tuple:
+        """Tile cache key for a given tile
+
+        :param source_args: (item_id, image_filepath, style_key) from get_tile_source_args
+        :type source_args: tuple
+        :param encoding_args: (encoding, quality, grayscale) from get_encoding_args
+        :type encoding_args: tuple
+        :return: (item_id, z, x, y, style_key, encoding_key)
+        :rtype: tuple
+        """
+        return (source_args[0], z, x, y, source_args[2], self.get_encoding_key(encoding_args))
+
+    async def get_prefetch(self, id: str, style: Union[None,str] = None, request: Request = None):
+        """Pre-rendering the low-zoom pyramid levels of an image in the background (e.g. when a slide is opened)
+
+        :param id: Local item id
+        :type id: str
+        :param style: Additional style arguments to pass to large-image, defaults to None
+        :type style: Union[None,str], optional
+        """
+        token = None
+        if not request is None:
+            if request.query_params.get('token'):
+                token = request.query_params.get('token')
+
+        if not self.prefetch_options.get('enabled'):
+            return {'message': 'prefetch disabled'}
+
+        source_args = await self.get_tile_source_args(id, style, token)
+        if source_args is None:
+            return Response(
+                content = 'invalid image id',
+                media_type='application/json',
+                status_code=400,
+            )
+
+        self.prefetcher.add(
+            0,
+            ('pyramid',)+source_args,
+            self.prefetch_pyramid,
+            source_args
+        )
+
+        return {'message': 'prefetching'}
+
+    def prefetch_pyramid(self, source_args: tuple):
+        """Adding every tile in the lowest zoom levels to the prefetch queue (lowest zoom first)
+
+        :param source_args: (item_id, image_filepath, style_key) from get_tile_source_args
+        :type source_args: tuple
+        """
+        with self.tile_source_pool.lease(*source_args) as tile_source:
+            tile_metadata = tile_source.getMetadata()
+        encoding_args = self.get_encoding_args()
+
+        for z in range(min(tile_metadata['levels'],self.prefetch_options.get('pyramid_levels',4))):
+            level_scale = 2**(tile_metadata['levels']-1-z)
+            n_x = int(np.ceil(tile_metadata['sizeX']/(tile_metadata['tileWidth']*level_scale)))
+            n_y = int(np.ceil(tile_metadata['sizeY']/(tile_metadata['tileHeight']*level_scale)))
+            for x in range(n_x):
+                for y in range(n_y):
+                    self.prefetcher.add(
+                        10+z,
+                        self.get_tile_cache_key(source_args, z, x, y, encoding_args),
+                        self.prefetch_tile,
+                        source_args, z, x, y, encoding_args
+                    )
+
+    def schedule_tile_prefetch(self, source_args: tuple, z: int, x: int, y: int, encoding_args: tuple):
+        """Adding neighbors, parent, and children of a requested tile to the prefetch queue
+
+        :param source_args: (item_id, image_filepath, style_key) from get_tile_source_args
+        :type source_args: tuple
+        :param encoding_args: (encoding, quality, grayscale) of the requested tile
+        :type encoding_args: tuple
+        """
+        prefetch_tiles = []
+        radius = self.prefetch_options.get('neighbors',1)
+        for dx in range(-radius,radius+1):
+            for dy in range(-radius,radius+1):
+                if not (dx==0 and dy==0):
+                    prefetch_tiles.append((1, z, x+dx, y+dy))
+
+        if self.prefetch_options.get('parents') and z>0:
+            prefetch_tiles.append((2, z-1, x//2, y//2))
+
+        if self.prefetch_options.get('children'):
+            prefetch_tiles.extend([
+                (3, z+1, 2*x+dx, 2*y+dy)
+                for dx in range(2) for dy in range(2)
+            ])
+
+        for priority, p_z, p_x, p_y in prefetch_tiles:
+            if p_x<0 or p_y<0:
+                continue
+
+            cache_key = self.get_tile_cache_key(source_args, p_z, p_x, p_y, encoding_args)
+            if not self.tile_cache.contains(cache_key):
+                self.prefetcher.add(
+                    priority,
+                    cache_key,
+                    self.prefetch_tile,
+                    source_args, p_z, p_x, p_y, encoding_args
+                )
+
+    def prefetch_tile(self, source_args: tuple, z: int, x: int, y: int, encoding_args: tuple):
+        """Rendering a single tile into the tile cache (called from prefetch worker threads)
+
+        :param source_args: (item_id, image_filepath, style_key) from get_tile_source_args
+        :type source_args: tuple
+        :param encoding_args: (encoding, quality, grayscale) from get_encoding_args
+        :type encoding_args: tuple
+        """
+        cache_key = self.get_tile_cache_key(source_args, z, x, y, encoding_args)
+        if self.tile_cache.contains(cache_key):
+            return
+
+        with self.tile_source_pool.lease(*source_args) as tile_source:
+            tile_metadata = tile_source.getMetadata()
+
+            # Skipping tiles outside of the image
+            if z>=tile_metadata['levels']:
+                return
+            level_scale = 2**(tile_metadata['levels']-1-z)
+            if x*tile_metadata['tileWidth']*level_scale>=tile_metadata['sizeX'] or y*tile_metadata['tileHeight']*level_scale>=tile_metadata['sizeY']:
+                return
+
+            raw_tile = call_tile_source_encoded(tile_source, 'getTile', encoding_args, x = x, y = y, z = z)
+        self.tile_cache.set(cache_key, raw_tile)
+
+    async def render_tile(self, cache_key: tuple, source_args: tuple, x: int, y: int, z: int, encoding_args: tuple):
+        """Decoding a tile in the executor and adding it to the tile cache
+
+        :param cache_key: Tile cache key
+        :type cache_key: tuple
+        :param source_args: (item_id, image_filepath, style_key) from get_tile_source_args
+        :type source_args: tuple
+        :param encoding_args: (encoding, quality, grayscale) from get_encoding_args
+        :type encoding_args: tuple
+        :return: (content, etag) tuple
+        :rtype: tuple
+        """
+        raw_tile = await self.executor.run(
+            'tiles',
+            source_args,
+            call_tile_source_encoded,
+            'getTile',
+            encoding_args,
+            x = x,
+            y = y,
+            z = z
+        )
+
+        return self.tile_cache.set(cache_key, raw_tile)
+
+    def get_busy_response(self):
+        """Response returned when the tile executor queue is full
+
+        :return: 503 response with Retry-After header
+        :rtype: Response
+        """
+        return Response(
+            content = 'tile server busy',
+            media_type = 'application/json',
+            status_code = 503,
+            headers = {'Retry-After': '1'}
+        )
+
+    def get_cached_response(self, cached_entry: tuple, media_type: str, request: Union[Request,None] = None, private: bool = False):
+        """Creating a response with ETag and Cache-Control headers, returns 304 if the client already has this version
+
+        :param cached_entry: (content, etag) tuple from TileCache
+        :type cached_entry: tuple
+        :param media_type: Media type of content
+        :type media_type: str
+        :param request: Incoming request (checked for If-None-Match header), defaults to None
+        :type request: Union[Request,None], optional
+        :param private: Whether this response should only be cached by the browser (e.g. token-protected items), defaults to False
+        :type private: bool, optional
+        :return: Response containing encoded content or 304 Not Modified
+        :rtype: Response
+        """
+        content, etag = cached_entry
+        headers = {
+            'ETag': etag,
+            'Cache-Control': f'{"private" if private else "public"}, max-age={self.tile_max_age}'
+        }
+
+        if not request is None:
+            if_none_match = request.headers.get('if-none-match')
+            if not if_none_match is None:
+                client_etags = [i.strip().removeprefix('W/') for i in if_none_match.split(',')]
+                if etag in client_etags or '*' in client_etags:
+                    return Response(
+                        status_code = 304,
+                        headers = headers
+                    )
+
+        return Response(
+            content = content,
+            media_type = media_type,
+            headers = headers
+        )
+
+    async def get_tile_batch(self, id:str, tiles:Union[str,None] = None, regions:Union[str,None] = None, style:Union[None,str] = None, encoding:Union[None,str] = None, quality:Union[None,int] = None, grayscale:bool = False, request:Request = None):
+        """Batched tiles endpoint, returns multiple tiles and/or regions in one streamed response
+
+        Tiles are specified as "z,x,y" and regions as "left,top,right,bottom", either separated by ";" in the query string (GET)
+        or as lists in a JSON body (POST, {"tiles": [[z,x,y],...], "regions": [[left,top,right,bottom],...], "style": {...}, "encoding": ...}).
+
+        Each part of the response is a 4-byte (big-endian) header length, a JSON header ("index", "type", "tile" or "region",
+        "status", "media_type", "length"), and then "length" bytes of encoded image. Parts are sent in the order that they finish decoding.
+
+        :param id: Local item id
+        :type id: str
+        :param tiles: Tile coordinates ("z,x,y;z,x,y;..."), defaults to None
+        :type tiles: Union[str,None], optional
+        :param regions: Region bounding boxes ("left,top,right,bottom;..."), defaults to None
+        :type regions: Union[str,None], optional
+        :param style: Additional style arguments to pass to large-image, defaults to None
+        :type style: Union[None,str], optional
+        :param encoding: Output encoding ("PNG", "JPEG", or "WEBP"), defaults to the server's encoding_options (PNG for regions)
+        :type encoding: Union[None,str], optional
+        :param quality: JPEG/WEBP quality (1-100), defaults to the server's encoding_options
+        :type quality: Union[None,int], optional
+        :param grayscale: Whether to return single-channel 8-bit images, defaults to False
+        :type grayscale: bool, optional
+        :return: Streamed length-prefixed image parts
+        :rtype: StreamingResponse
+        """
+        token = None
+        if not request is None:
+            if request.query_params.get('token'):
+                token = request.query_params.get('token')
+
+        try:
+            if not request is None and request.method=='POST':
+                batch_body = await request.json()
+                tile_list = batch_body.get('tiles',[]) or []
+                region_list = batch_body.get('regions',[]) or []
+                if style is None:
+                    style = batch_body.get('style')
+                if encoding is None:
+                    encoding = batch_body.get('encoding')
+                if quality is None:
+                    quality = batch_body.get('quality')
+                grayscale = grayscale or batch_body.get('grayscale',False)
+            else:
+                tile_list = [t.split(',') for t in tiles.split(';') if not t==''] if not tiles is None else []
+                region_list = [r.split(',') for r in regions.split(';') if not r==''] if not regions is None else []
+
+            tile_list = [[int(i) for i in t] for t in tile_list]
+            region_list = [[int(i) for i in r] for r in region_list]
+            if any([len(t)!=3 for t in tile_list]) or any([len(r)!=4 for r in region_list]):
+                raise ValueError
+        except (ValueError, TypeError, AttributeError, json.JSONDecodeError):
+            return Response(
+                content = 'invalid batch, tiles must be (z,x,y) and regions must be (left,top,right,bottom)',
+                media_type = 'application/json',
+                status_code = 400
+            )
+
+        try:
+            encoding_args = self.get_encoding_args(encoding, quality, grayscale)
+        except (ValueError, TypeError, AttributeError) as e:
+            return Response(
+                content = str(e),
+                media_type = 'application/json',
+                status_code = 400
+            )
+
+        if len(tile_list)+len(region_list)>self.max_batch_size:
+            return Response(
+                content = f'batch too large, maximum of {self.max_batch_size} tiles/regions per request',
+                media_type = 'application/json',
+                status_code = 413
+            )
+
+        # Access to the item is only checked once for the whole batch
+        source_args = await self.get_tile_source_args(id, style, token)
+        if source_args is None:
+            return Response(
+                content = 'invalid image id',
+                media_type = 'application/json',
+                status_code = 400
+            )
+
+        batch_entries = [('tile',t) for t in tile_list] + [('region',r) for r in region_list]
+
+        return StreamingResponse(
+            self.stream_tile_batch(source_args, batch_entries, encoding_args),
+            media_type = 'application/octet-stream',
+            headers = {
+                'Cache-Control': 'no-store'
+            }
+        )
+
+    async def stream_tile_batch(self, source_args: tuple, batch_entries: list, encoding_args: tuple):
+        """Decoding batch entries in parallel and yielding each length-prefixed part as it finishes
+
+        :param source_args: (item_id, image_filepath, style_key) from get_tile_source_args
+        :type source_args: tuple
+        :param batch_entries: List of ("tile", [z,x,y]) or ("region", [left,top,right,bottom]) entries
+        :type batch_entries: list
+        :param encoding_args: (encoding, quality, grayscale) from get_encoding_args
+        :type encoding_args: tuple
+        """
+        # Keeping the number of in-flight decodes below the executor limit so a large batch doesn't fill the executor queue
+        batch_semaphore = asyncio.Semaphore(self.executor.max_workers)
+        batch_tasks = [
+            asyncio.ensure_future(self.render_batch_entry(idx, entry_type, coords, source_args, encoding_args, batch_semaphore))
+            for idx, (entry_type, coords) in enumerate(batch_entries)
+        ]
+
+        try:
+            for next_part in asyncio.as_completed(batch_tasks):
+                part_header, part_content = await next_part
+                part_header['length'] = len(part_content)
+                encoded_header = json.dumps(part_header).encode('utf-8')
+
+                yield struct.pack('>I',len(encoded_header)) + encoded_header + part_content
+        finally:
+            # Client disconnected or the stream was closed early
+            for t in batch_tasks:
+                t.cancel()
+
+    async def render_batch_entry(self, index: int, entry_type: str, coords: list, source_args: tuple, encoding_args: tuple, semaphore: asyncio.Semaphore):
+        """Getting the encoded image for a single batch entry (uses the same cache/coalescing as the /tiles and /tiles/region endpoints)
+
+        :param index: Index of this entry in the batch
+        :type index: int
+        :param entry_type: Either "tile" or "region"
+        :type entry_type: str
+        :param coords: [z,x,y] for tiles or [left,top,right,bottom] for regions
+        :type coords: list
+        :param source_args: (item_id, image_filepath, style_key) from get_tile_source_args
+        :type source_args: tuple
+        :param encoding_args: (encoding, quality, grayscale) from get_encoding_args
+        :type encoding_args: tuple
+        :param semaphore: Semaphore limiting concurrent decodes for this batch
+        :type semaphore: asyncio.Semaphore
+        :return: (header, content) for this part
+        :rtype: tuple
+        """
+        part_header = {
+            'index': index,
+            'type': entry_type,
+            entry_type: coords,
+            'status': 200,
+            'media_type': None
+        }
+        part_content = b''
+
+        async with semaphore:
+            try:
+                if entry_type=='tile':
+                    z, x, y = coords
+                    if any([i<0 for i in [z,x,y]]):
+                        raise large_image.exceptions.TileSourceXYZRangeError
+
+                    cache_key = self.get_tile_cache_key(source_args, z, x, y, encoding_args)
+                    cached_tile = self.tile_cache.get(cache_key)
+                    if cached_tile is None:
+                        cached_tile = await self.single_flight.run(
+                            'tiles',
+                            cache_key,
+                            self.render_tile,
+                            cache_key,
+                            source_args,
+                            x,
+                            y,
+                            z,
+                            encoding_args
+                        )
+                    part_content = cached_tile[0]
+
+                else:
+                    left, top, right, bottom = coords
+                    # Same bounds and size limits as the /tiles/region endpoint
+                    region_kwargs = await self.get_region_kwargs(source_args, top, left, bottom, right)
+                    self.check_region_size(region_kwargs)
+
+                    # Regions are returned losslessly unless another encoding is requested
+                    region_encoding_args = encoding_args if not encoding_args[0] is None else ('PNG', None, False)
+                    part_content = await self.single_flight.run(
+                        'regions',
+                        (source_args[0], 'region', top, left, bottom, right, source_args[2], self.get_encoding_key(region_encoding_args)),
+                        self.executor.run,
+                        'regions',
+                        source_args,
+                        call_tile_source_encoded,
+                        'getRegion',
+                        region_encoding_args,
+                        **region_kwargs
+                    )
+
+                part_header['media_type'] = get_media_type(part_content)
+
+            except TileExecutorBusy:
+                part_header['status'] = 503
+            except RegionTooLarge:
+                part_header['status'] = 413
+            except large_image.exceptions.TileSourceXYZRangeError:
+                part_header['status'] = 404
+            except (large_image.exceptions.TileSourceError, ValueError):
+                part_header['status'] = 400
+            except Exception:
+                # Errors are reported for this part only so the rest of the batch is still streamed
+                part_header['status'] = 500
+                part_content = b''
+
+        return part_header, part_content
+
+    @staticmethod
+    def get_batch_iterator(batch_url: str, tiles: Union[list,None] = None, regions: Union[list,None] = None, style: Union[dict,None] = None, encoding: Union[str,None] = None, timeout: int = 60):
+        """Requesting multiple tiles/regions from a /tiles/batch endpoint, yielding each part as it is received
+
+        :param batch_url: "batch" url from get_slide_urls
+        :type batch_url: str
+        :param tiles: List of [z,x,y] tile coordinates, defaults to None
+        :type tiles: Union[list,None], optional
+        :param regions: List of [left,top,right,bottom] region bounding boxes, defaults to None
+        :type regions: Union[list,None], optional
+        :param style: Style dict for large-image reader, defaults to None
+        :type style: Union[dict,None], optional
+        :param encoding: Output encoding ("PNG", "JPEG", or "WEBP"), defaults to None
+        :type encoding: Union[str,None], optional
+        :param timeout: Request timeout (seconds), defaults to 60
+        :type timeout: int, optional
+        :yield: (header, content) for each tile/region, where header["index"] is the position in tiles+regions
+        :rtype: tuple
+        """
+        batch_body = {
+            'tiles': tiles if not tiles is None else [],
+            'regions': regions if not regions is None else []
+        }
+        if not style is None:
+            batch_body['style'] = style
+        if not encoding is None:
+            batch_body['encoding'] = encoding
 
-        tile_metadata = tile_source.getMetadata()
+        with requests.post(batch_url, json = batch_body, stream = True, timeout = timeout) as batch_response:
+            batch_response.raise_for_status()
+            batch_response.raw.decode_content = True
 
-        try:
-            raw_tile = tile_source.getTile(
-                x = x,
-                y = y,
-                z = z,
-            )
+            while True:
+                header_length = batch_response.raw.read(4)
+                if len(header_length)<4:
+                    break
 
-        except large_image.exceptions.TileSourceXYZRangeError:
-            # This error appears for any negative tile coordinates
-            raw_tile = np.zeros(
-                (
-                    tile_metadata['tileHeight'],
-                    tile_metadata['tileWidth']
-                ),
-                dtype=np.uint8
-            ).tobytes()
+                part_header = json.loads(batch_response.raw.read(struct.unpack('>I',header_length)[0]))
+                part_content = batch_response.raw.read(part_header['length'])
 
-        return Response(
-            content = raw_tile,
-            media_type='image/png',
-        )
+                yield part_header, part_content
 
     async def get_image_metadata(self,id:str, request:Request = None):
         """Getting large-image metadata for image
@@ -685,12 +2764,21 @@ class LocalTileServer(TileServer):
                 status_code=400,
             )
 
-    async def get_region(self, id:str, top: int, left: int, bottom:int, right:int,style:Union[None,str] = None):
-        """
-        Grabbing a specific region in the image based on bounding box coordinates
-        """
+    async def get_region(self, id:str, top: int, left: int, bottom:int, right:int,style:Union[None,str] = None, encoding:Union[None,str] = None, quality:Union[None,int] = None, grayscale:bool = False, scale:Union[None,float] = None, magnification:Union[None,float] = None, max_size:Union[None,int] = None, frame:Union[None,int] = None, request:Request = None):
         """Grabbing a specific region of the image based on bounding box coordinates
 
+        If scale, magnification, or max_size are provided, the region is read from the matching pyramid level (never upsampled).
+
+        :param id: Local item id
+        :type id: str
+        :param scale: Output scale relative to full resolution (0-1], defaults to None
+        :type scale: Union[None,float], optional
+        :param magnification: Output magnification (requires magnification in image metadata), defaults to None
+        :type magnification: Union[None,float], optional
+        :param max_size: Maximum output width/height in pixels, defaults to None
+        :type max_size: Union[None,int], optional
+        :param frame: Frame to read from a multi-frame image, defaults to None
+        :type frame: Union[None,int], optional
         :return: Image region (bytes encoded)
         :rtype: Response
         """
@@ -699,57 +2787,383 @@ class LocalTileServer(TileServer):
             if request.query_params.get('token'):
                 token = request.query_params.get('token')
 
-        tile_source = await asyncio.gather(self.get_tile_source(id,style, token))
-        tile_source = tile_source[0]
+        try:
+            encoding_args = self.get_encoding_args(encoding, quality, grayscale)
+        except ValueError as e:
+            return Response(
+                content = str(e),
+                media_type = 'application/json',
+                status_code = 400
+            )
+
+        source_args = await self.get_tile_source_args(id, style, token)
 
-        if tile_source is None:
+        if source_args is None:
             return Response(
                 content = 'invalid image id',
                 media_type = 'application/json',
                 status_code = 400,
             )
 
-        image_region, mime_type = tile_source.getRegion(
-            region = {
+        try:
+            region_kwargs = await self.get_region_kwargs(source_args, top, left, bottom, right, scale, magnification, max_size, frame)
+        except ValueError as e:
+            return Response(
+                content = str(e),
+                media_type = 'application/json',
+                status_code = 400
+            )
+
+        try:
+            self.check_region_size(region_kwargs)
+        except RegionTooLarge as e:
+            return Response(
+                content = f'{e}, use scale/max_size or the /tiles/region/export endpoint',
+                media_type = 'application/json',
+                status_code = 413
+            )
+
+        try:
+            image_region = await self.single_flight.run(
+                'regions',
+                (id, 'region', top, left, bottom, right, source_args[2], self.get_encoding_key(encoding_args), json.dumps(region_kwargs, sort_keys = True)),
+                self.executor.run,
+                'regions',
+                source_args,
+                call_tile_source_encoded,
+                'getRegion',
+                encoding_args,
+                **region_kwargs
+            )
+        except TileExecutorBusy:
+            return self.get_busy_response()
+
+        return Response(
+            content = image_region,
+            media_type = get_media_type(image_region),
+        )
+
+    def check_region_size(self, region_kwargs: dict, n_channels: int = 1):
+        """Checking that the output of a region read is within max_region_pixels
+
+        :param region_kwargs: getRegion arguments from get_region_kwargs
+        :type region_kwargs: dict
+        :param n_channels: Number of frames/channels read for each pixel, defaults to 1
+        :type n_channels: int, optional
+        :raises RegionTooLarge: Output width*height*n_channels is greater than max_region_pixels
+        """
+        region = region_kwargs['region']
+        output_size = region_kwargs.get('output',{'maxWidth': region['right']-region['left'], 'maxHeight': region['bottom']-region['top']})
+        if output_size['maxWidth']*output_size['maxHeight']*n_channels>self.max_region_pixels:
+            raise RegionTooLarge(f'region too large ({output_size["maxWidth"]}x{output_size["maxHeight"]}' + (f'x{n_channels}' if n_channels>1 else '') + ')')
+
+    async def get_region_kwargs(self, source_args: tuple, top: int, left: int, bottom: int, right: int, scale:Union[None,float] = None, magnification:Union[None,float] = None, max_size:Union[None,int] = None, frame:Union[None,int] = None) -> dict:
+        """Converting region bounds and output scaling parameters into large-image getRegion arguments
+
+        :param source_args: (item_id, image_filepath, style_key) from get_tile_source_args
+        :type source_args: tuple
+        :raises ValueError: Invalid region or scaling parameters
+        :return: Dictionary containing "region", and optionally "output" (maxWidth/maxHeight) and "frame"
+        :rtype: dict
+        """
+        if right<=left or bottom<=top:
+            raise ValueError('invalid region, right/bottom must be greater than left/top')
+
+        region_kwargs = {
+            'region': {
                 'left': left,
                 'top': top,
                 'right': right,
                 'bottom': bottom
-            },
+            }
+        }
+        if not frame is None:
+            region_kwargs['frame'] = frame
+
+        output_scale = 1.0
+        if not scale is None:
+            if scale<=0:
+                raise ValueError('invalid scale, must be greater than 0')
+            output_scale = min(output_scale, scale)
+
+        if not magnification is None:
+            image_metadata = await self.executor.run('regions', source_args, call_tile_source, 'getMetadata')
+            if image_metadata.get('magnification') is None or magnification<=0:
+                raise ValueError('invalid magnification, image does not have a native magnification')
+            output_scale = min(output_scale, magnification/image_metadata['magnification'])
+
+        if not max_size is None:
+            if max_size<=0:
+                raise ValueError('invalid max_size, must be greater than 0')
+            output_scale = min(output_scale, max_size/max(right-left,bottom-top))
+
+        if output_scale<1.0:
+            region_kwargs['output'] = {
+                'maxWidth': max(1,int(round((right-left)*output_scale))),
+                'maxHeight': max(1,int(round((bottom-top)*output_scale)))
+            }
+
+        return region_kwargs
+
+    async def get_region_export(self, id:str, top: int, left: int, bottom:int, right:int, style:Union[None,str] = None, scale:Union[None,float] = None, magnification:Union[None,float] = None, max_size:Union[None,int] = None, frame:Union[None,int] = None, compression:str = 'zlib', request:Request = None):
+        """Exporting a (possibly very large) region as a tiled TIFF, encoded one tile at a time so the full region is never held in memory
+
+        :param id: Local item id
+        :type id: str
+        :param scale: Output scale relative to full resolution (0-1], defaults to None
+        :type scale: Union[None,float], optional
+        :param magnification: Output magnification (requires magnification in image metadata), defaults to None
+        :type magnification: Union[None,float], optional
+        :param max_size: Maximum output width/height in pixels, defaults to None
+        :type max_size: Union[None,int], optional
+        :param frame: Frame to read from a multi-frame image, defaults to None
+        :type frame: Union[None,int], optional
+        :param compression: TIFF compression, one of "zlib", "jpeg", or "none", defaults to 'zlib'
+        :type compression: str, optional
+        :return: Tiled TIFF file
+        :rtype: FileResponse
+        """
+        token = None
+        if not request is None:
+            if request.query_params.get('token'):
+                token = request.query_params.get('token')
+
+        if not compression in ['zlib','jpeg','none']:
+            return Response(
+                content = 'invalid compression, must be one of ["zlib", "jpeg", "none"]',
+                media_type = 'application/json',
+                status_code = 400
+            )
+
+        source_args = await self.get_tile_source_args(id, style, token)
+        if source_args is None:
+            return Response(
+                content = 'invalid image id',
+                media_type = 'application/json',
+                status_code = 400
+            )
+
+        try:
+            region_kwargs = await self.get_region_kwargs(source_args, top, left, bottom, right, scale, magnification, max_size, frame)
+        except ValueError as e:
+            return Response(
+                content = str(e),
+                media_type = 'application/json',
+                status_code = 400
+            )
+
+        export_fd, export_path = tempfile.mkstemp(suffix = '.tiff', dir = self.export_path)
+        os.close(export_fd)
+
+        try:
+            await self.executor.run(
+                'regions',
+                source_args,
+                write_region_tiff,
+                export_path,
+                compression = compression,
+                **region_kwargs
+            )
+        except TileExecutorBusy:
+            os.remove(export_path)
+            return self.get_busy_response()
+        except Exception as e:
+            os.remove(export_path)
+            return Response(
+                content = f'error exporting region: {e}',
+                media_type = 'application/json',
+                status_code = 400
+            )
+
+        # Temporary file is removed once the response has been sent
+        return FileResponse(
+            export_path,
+            media_type = 'image/tiff',
+            filename = f'{id}_{left}_{top}_{right}_{bottom}.tiff',
+            background = BackgroundTask(os.remove, export_path)
         )
 
+    async def get_region_array(self, id:str, top: int, left: int, bottom:int, right:int, frames:Union[str,None] = None, compress:Union[str,None] = None, request: Request = None):
+        """Grabbing a region of the image as a raw .npy array at native dtype (e.g. uint16 fluorescence), intended for Python clients
+
+        :param id: Local item id
+        :type id: str
+        :param frames: Comma-separated frame indices ("0,2,5") or "all", frames are concatenated along the last axis, defaults to None (default frame)
+        :type frames: Union[str,None], optional
+        :param compress: Set to "zstd" to compress the array (requires zstandard, otherwise the array is returned uncompressed), defaults to None
+        :type compress: Union[str,None], optional
+        :return: .npy array ("application/x-npy") or zstd-compressed .npy array ("application/zstd")
+        :rtype: Response
+        """
+        token = None
+        if not request is None:
+            if request.query_params.get('token'):
+                token = request.query_params.get('token')
+
+        source_args = await self.get_tile_source_args(id, None, token)
+        if source_args is None:
+            return Response(
+                content = 'invalid image id',
+                media_type = 'application/json',
+                status_code = 400,
+            )
+
+        try:
+            region_kwargs = await self.get_region_kwargs(source_args, top, left, bottom, right)
+        except ValueError as e:
+            return Response(
+                content = str(e),
+                media_type = 'application/json',
+                status_code = 400
+            )
+
+        if not frames is None:
+            image_metadata = await self.executor.run('regions', source_args, call_tile_source, 'getMetadata')
+            n_frames = max(len(image_metadata.get('frames',[])),1)
+            try:
+                if frames=='all':
+                    frames = list(range(n_frames))
+                else:
+                    frames = [int(f) for f in frames.split(',') if not f=='']
+                    if len(frames)==0 or any([f<0 or f>=n_frames for f in frames]):
+                        raise ValueError
+            except ValueError:
+                return Response(
+                    content = f'invalid frames, must be a comma-separated list of frame indices (0-{n_frames-1}) or "all"',
+                    media_type = 'application/json',
+                    status_code = 400
+                )
+
+        if not compress is None:
+            compress = compress.lower()
+            if not compress=='zstd':
+                return Response(
+                    content = 'invalid compression, must be "zstd"',
+                    media_type = 'application/json',
+                    status_code = 400
+                )
+            if zstandard is None:
+                compress = None
+
+        # Arrays are read at native dtype, so each requested frame counts towards the size limit
+        try:
+            self.check_region_size(region_kwargs, len(frames) if not frames is None else 1)
+        except RegionTooLarge as e:
+            return Response(
+                content = f'{e}, request fewer frames or a smaller region',
+                media_type = 'application/json',
+                status_code = 413
+            )
+
+        try:
+            region_array = await self.single_flight.run(
+                'regions',
+                (id, 'region_array', top, left, bottom, right, tuple(frames) if not frames is None else None, compress),
+                self.executor.run,
+                'regions',
+                source_args,
+                read_region_array,
+                region = region_kwargs['region'],
+                frames = frames,
+                compress = compress
+            )
+        except TileExecutorBusy:
+            return self.get_busy_response()
+        except large_image.exceptions.TileSourceError as e:
+            return Response(
+                content = str(e),
+                media_type = 'application/json',
+                status_code = 400
+            )
+
         return Response(
-            content = image_region,
-            media_type = 'image/png',
+            content = region_array,
+            media_type = 'application/zstd' if compress=='zstd' else 'application/x-npy'
         )
 
-    async def get_thumbnail(self, id:str, style:Union[None,str] = None, request: Request = None):
+    async def get_thumbnail(self, id:str, style:Union[None,str] = None, encoding:Union[None,str] = None, quality:Union[None,int] = None, grayscale:bool = False, request: Request = None):
         """Grabbing an image thumbnail
 
         :param id: Unique id for locally stored item
         :type id: str
+        :param encoding: Output encoding ("PNG", "JPEG", or "WEBP"), defaults to the server's encoding_options (PNG if not set)
+        :type encoding: Union[None,str], optional
+        :param quality: JPEG/WEBP quality (1-100), defaults to the server's encoding_options
+        :type quality: Union[None,int], optional
+        :param grayscale: Whether to return a single-channel 8-bit thumbnail, defaults to False
+        :type grayscale: bool, optional
         """
         token = None
         if not request is None:
             if request.query_params.get('token'):
                 token = request.query_params.get('token')
 
-        tile_source = await asyncio.gather(self.get_tile_source(id,style, token))
-        tile_source = tile_source[0]
+        try:
+            encoding_args = self.get_encoding_args(encoding, quality, grayscale)
+        except ValueError as e:
+            return Response(
+                content = str(e),
+                media_type = 'application/json',
+                status_code = 400
+            )
+
+        source_args = await self.get_tile_source_args(id, style, token)
 
-        if tile_source is None:
+        if source_args is None:
             return Response(
                 content = 'invalid image id',
                 media_type = 'application/json',
                 status_code=400,
             )
 
-        thumbnail, mime_type = tile_source.getThumbnail(encoding='PNG')
+        cache_key = (id, 'thumbnail', source_args[2], self.get_encoding_key(encoding_args))
+        cached_thumbnail = self.tile_cache.get(cache_key)
+        if cached_thumbnail is None:
+            try:
+                cached_thumbnail = await self.single_flight.run(
+                    'thumbnails',
+                    cache_key,
+                    self.render_thumbnail,
+                    cache_key,
+                    source_args,
+                    encoding_args
+                )
+            except TileExecutorBusy:
+                return self.get_busy_response()
+
+        return self.get_cached_response(cached_thumbnail, get_media_type(cached_thumbnail[0]), request, private = not token is None)
+
+    async def render_thumbnail(self, cache_key: tuple, source_args: tuple, encoding_args: tuple):
+        """Creating a thumbnail in the executor and adding it to the tile cache
+
+        :param cache_key: Tile cache key
+        :type cache_key: tuple
+        :param source_args: (item_id, image_filepath, style_key) from get_tile_source_args
+        :type source_args: tuple
+        :param encoding_args: (encoding, quality, grayscale) from get_encoding_args
+        :type encoding_args: tuple
+        :return: (content, etag) tuple
+        :rtype: tuple
+        """
+        if encoding_args[0] is None:
+            thumbnail = await self.executor.run(
+                'thumbnails',
+                source_args,
+                call_tile_source_encoded,
+                'getThumbnail',
+                encoding_args,
+                encoding = 'PNG'
+            )
+        else:
+            thumbnail = await self.executor.run(
+                'thumbnails',
+                source_args,
+                call_tile_source_encoded,
+                'getThumbnail',
+                encoding_args
+            )
 
-        return Response(
-            content = thumbnail,
-            media_type = 'image/png',
-        )
+        return self.tile_cache.set(cache_key, thumbnail)
 
     async def get_annotations(self,id:str, top:Union[int,None]=None, left:Union[int,None]=None, bottom: Union[int,None]=None, right: Union[int,None]=None, request: Request = None):
         """Getting annotations for a given item id, optionally specifying a region within which to grab annotations.
@@ -767,77 +3181,79 @@ class LocalTileServer(TileServer):
         :return: Annotations for item (optionally within a specified region)
         """
 
-        image_annotations = await asyncio.gather(self.get_item_annotations(id, request))
-
-        if len(image_annotations)>0:
-            if all([i is None for i in [top,left,bottom,right]]):
-                # Returning all annotations by default
-                return Response(
-                    content = json.dumps(image_annotations),
-                    media_type='application/json',
-                )
-            else:
-                # Parsing region of annotations:
-                if all([not i is None for i in [top,left,bottom,right]]):
-                    image_region_anns = []
-                    # Shapely box requires minx, miny, maxx, maxy
-                    query_poly = box(left,top,right,bottom)
-
-                    if type(image_annotations)==dict:
-                        image_anns = [image_annotations]
-                    for ann in image_anns:
-                        if detect_image_overlay(ann):
-                            image_bounds_box = box(*ann['image_bounds'])
-                            if image_bounds_box.intersects(query_poly):
-                                image_region_anns.append(ann)
-                                # If it doesn't intersect should it return anything?
-
-                        elif detect_geojson(ann):
-
-                            if type(ann)==dict:
-                                filtered_anns = structures_within_poly(
-                                    original = ann,
-                                    query= query_poly
-                                )
-                                if len(filtered_anns['features'])>0:
-                                    filtered_anns['properties'] = ann['properties']
-                                    image_region_anns.append(filtered_anns)
-                                else:
-                                    image_region_anns.append({
-                                        'type': 'FeatureCollection',
-                                        'features':[],
-                                        'properties':ann['properties']
-                                    })
-                            elif type(ann)==list:
-                                for g in ann:
-                                    filtered_g = structures_within_poly(
-                                        original = g,
-                                        query=query_poly
-                                    )
-                                    if len(filtered_g['features'])>0:
-                                        filtered_g['properties'] = g['properties']
-                                        image_region_anns.append(filtered_g)
-                                    else:
-                                        image_region_anns.append({
-                                            'type': 'FeatureCollection',
-                                            'features':[],
-                                            'properties':g['properties']
-                                        })
-
-                        else:
-                            print(f'Unrecognized annotation format found for image: {id}')
-                    return Response(
-                        content = json.dumps(image_region_anns),
-                        media_type='application/json',
-                    )
+        token = None
+        if not request is None:
+            if request.query_params.get('token'):
+                token = request.query_params.get('token')
 
+        if all([i is None for i in [top,left,bottom,right]]):
+            # Returning all annotations by default
+            bbox = None
+        elif all([not i is None for i in [top,left,bottom,right]]):
+            # Parsing region of annotations (bounding box is minx, miny, maxx, maxy)
+            bbox = [left,top,right,bottom]
         else:
+            return Response(
+                content = 'invalid region, provide top, left, bottom, and right',
+                media_type = 'application/json',
+                status_code = 400
+            )
+
+        # Items that can be accessed but don't have any annotation layers return an empty list
+        image_item = await asyncio.gather(self.get_item(id, token))
+        if len(image_item[0])==0:
             return Response(
                 content = 'invalid image id',
                 media_type = 'application/json',
                 status_code = 400,
             )
 
+        # Structures are read from the database and serialized as the response is streamed
+        # (the first layer, which runs the bbox query, is read on the database executor and
+        # the remaining layers are read in the response's thread pool so neither blocks the event loop)
+        annotation_iterator = self.database.iter_item_annotations(id, user_token = token, bbox = bbox)
+        first_layer = await self.database.run_async(next, annotation_iterator, None)
+        if not first_layer is None:
+            annotation_iterator = chain([first_layer],annotation_iterator)
+
+        return StreamingResponse(
+            self.stream_annotations_json(annotation_iterator),
+            media_type = 'application/json'
+        )
+
+    @staticmethod
+    def stream_annotations_json(annotation_iterator, chunk_size: int = 1000):
+        """Serializing annotation layers from fusionDB.iter_item_annotations as chunks of a JSON list
+
+        :param annotation_iterator: Iterator of (properties, features) or (image overlay, None)
+        :type annotation_iterator: Generator
+        :param chunk_size: Number of features serialized per chunk, defaults to 1000
+        :type chunk_size: int, optional
+        """
+        yield '['
+        for l_idx, (layer, features) in enumerate(annotation_iterator):
+            if l_idx>0:
+                yield ','
+
+            if features is None:
+                yield json.dumps(layer, default = str)
+                continue
+
+            yield '{"type": "FeatureCollection", "properties": ' + json.dumps(layer) + ', "features": ['
+            feature_chunk = []
+            for f_idx, f in enumerate(features):
+                feature_chunk.append(json.dumps(f))
+                if len(feature_chunk)==chunk_size:
+                    yield (',' if f_idx>=chunk_size else '') + ','.join(feature_chunk)
+                    feature_chunk = []
+
+            if len(feature_chunk)>0:
+                yield (',' if f_idx>=chunk_size else '') + ','.join(feature_chunk)
+
+            yield ']}'
+
+        yield ']'
+
     async def get_annotations_metadata(self,id:str, request: Request):
         """Getting metadata for annotations for an item
 
@@ -875,125 +3291,126 @@ class LocalTileServer(TileServer):
         :param id: String uuid for locally stored image
         :type id: int
         """
-        #print(f'id from get_annotations_property_keys: {id}')
-        image_anns = await self.get_item_annotations(id, request)
-        property_list = []
-        property_names = []
-        for a in image_anns:
-            features = a.get('features',[])
-            a_id = a.get('properties',{}).get('_id',None)
-            a_name = a.get('properties',{}).get('name',None)
+        token = None
+        if not request is None:
+            if request.query_params.get('token'):
+                token = request.query_params.get('token')
 
-            if 'annotation.name' in property_names:
-                v_info = property_list[property_names.index('annotation.name')]
-                if not v_val in v_info['distinct']:
-                    v_info['distinct'].append(v_val)
-                    v_info['distinctcount'] += 1
+        image_item = await asyncio.gather(self.get_item(id, token))
+        if len(image_item[0])==0:
+            return Response(
+                content = 'invalid image id',
+                media_type = 'application/json',
+                status_code = 400,
+            )
 
-                v_info['count'] +=1
-                property_list[property_names.index('annotation.name')] = v_info
+        # Layer names/ids and structure property summaries are read from the database (property catalog is filled in at ingest)
+        item_layers = [l for l in await self.database.run_async(self.database.get_layer_counts, id, token) if l.get('structures')>0]
+        if len(item_layers)==0:
+            return Response(
+                content = json.dumps([]),
+                media_type='application/json',
+                status_code=200,
+            )
 
-            else:
-                property_names.append('annotation.name')
-
-                v_info = {
-                    'key': 'annotation.name',
-                    'title': 'Annotation Name',
-                    'count': 1,
-                    'distinct': [a_name],
-                    'distinctcount': 1
-                }
-                property_list.append(v_info)
+        layer_names = list(dict.fromkeys([l.get('name') for l in item_layers]))
+        layer_ids = [l.get('id') for l in item_layers]
+        property_list = [
+            {
+                'key': 'annotation.name',
+                'title': 'Annotation Name',
+                'type': 'string',
+                'count': len(item_layers),
+                'distinct': layer_names,
+                'distinctcount': len(layer_names)
+            },
+            {
+                'key': 'annotation.id',
+                'title': 'Annotation ID',
+                'type': 'string',
+                'count': len(item_layers),
+                'distinct': layer_ids,
+                'distinctcount': len(layer_ids)
+            }
+        ]
 
-            if 'annotation.id' in property_names:
-                v_info = property_list[property_names.index('annotation.id')]
-                if not v_val in v_info['distinct']:
-                    v_info['distinct'].append(v_val)
-                    v_info['distinctcount'] += 1
+        property_list += await self.database.run_async(
+            self.database.get_structure_property_keys,
+            item_id = id,
+            layer_id = layer_ids
+        )
 
-                v_info['count'] += 1
+        return Response(
+            content = json.dumps(property_list),
+            media_type='application/json',
+            status_code=200,
+        )
 
-                property_list[property_names.index('annotation.id')] = v_info
+    async def get_annotations_property_data(self,id:str,include_keys:Union[str,None] = None,include_anns:Union[str,None] = None, request: Request = None):
+        """Getting data from annotations of specified image, attempting to mirror output of https://github.com/girder/large_image/blob/master/girder_annotation/girder_large_image_annotation/utils/__init__.py
 
-            else:
-                property_names.append('annotation.id')
-
-                v_info = {
-                    'key': 'annotation.id',
-                    'title': 'Annotation ID',
-                    'count': 1,
-                    'distinct': [a_id],
-                    'distinctcount': 1
-                }
-                property_list.append(v_info)
-
-
-            for f in features:
-                f_props = f.get('properties')
-                if not f_props is None:
-                    f_main_keys = list(f_props.keys())
-                    for f_m in f_main_keys:
-                        if type(f_props[f_m]) in [list,dict]:
-                            values_list = extract_nested_prop(f_props[f_m],4)
-                        elif type(f_props[f_m]) in [str,int,float]:
-                            values_list = [{f_m: f_props[f_m]}]
-
-                        for v in values_list:
-                            v_key = list(v.keys())[0]
-                            v_val = list(v.values())[0]
-
-                            if v_key in property_names:
-                                v_info = property_list[property_names.index(v_key)]
-                                if type(v_val)==str:
-                                    if not v_val in v_info['distinct']:
-                                        v_info['distinct'].append(v_val)
-                                        v_info['distinctcount'] += 1
-
-                                elif type(v_val) in [int,float]:
-                                    if v_val>v_info['max']:
-                                        v_info['max'] = v_val
-                                    elif v_val<v_info['min']:
-                                        v_info['min'] = v_val
-
-                                v_info['count'] += 1
-
-                                property_list[property_names.index(v_key)] = v_info
-                            else:
-                                property_names.append(v_key)
+        :param id: String uuid for locally stored image.
+        :type id: int
+        :param include_keys: Comma-separated property names to grab from annotations
+        :type include_keys: Union[str,None]
+        :param include_anns: Which annotations to include (comma-separated names/ids or __all__)
+        :type include_anns: Union[str,None]
+        """
 
-                                v_info = {
-                                    'key': v_key.lower().replace(' --> ','.'),
-                                    'title': v_key,
-                                    'count': 1
-                                }
+        token = None
+        if not request is None:
+            if request.query_params.get('token'):
+                token = request.query_params.get('token')
 
-                                if type(v_val)==str:
-                                    v_info['type'] = 'string'
-                                    v_info['distinct'] = [v_val]
-                                    v_info['distinctcount'] = 1
-                                else:
-                                    v_info['type'] = 'number'
-                                    v_info['max'] = v_val
-                                    v_info['min'] = v_val
+        image_item = await asyncio.gather(self.get_item(id, token))
+        if len(image_item[0])==0:
+            return Response(
+                content = 'invalid image id',
+                media_type = 'application/json',
+                status_code = 400,
+            )
 
-                                property_list.append(v_info)
+        if include_keys is None:
+            include_keys = []
+        else:
+            include_keys = include_keys.split(',')
 
+        if include_anns is None:
+            include_anns = '__all__'
+        elif not include_anns=='__all__':
+            include_anns = include_anns.split(',')
+
+        property_data = await self.database.run_async(
+            self.database.get_cohort_property_data,
+            item_id = id,
+            include_keys = include_keys,
+            include_anns = include_anns,
+            user_token = token
+        )
 
         return Response(
-            content = json.dumps(property_list),
+            content = json.dumps({'data': property_data['data'], 'columns': property_data['columns']}),
             media_type='application/json',
             status_code=200,
         )
 
-    async def get_annotations_property_data(self,id:str,include_keys:Union[str,None] = None,include_anns:Union[str,None] = None, request: Request = None):
-        """Getting data from annotations of specified image, attempting to mirror output of https://github.com/girder/large_image/blob/master/girder_annotation/girder_large_image_annotation/utils/__init__.py
+    async def get_annotations_property_aggregate(self, id:str, property:str, aggregate:str = 'stats', bins:int = 20, bbox:Union[str,None] = None, include_anns:Union[str,None] = None, group_by:Union[str,None] = None, request: Request = None):
+        """Getting summary statistics, a histogram, or value counts of one property of this image's annotations (computed by the database)
 
         :param id: String uuid for locally stored image.
-        :type id: int
-        :param include_keys: List of property names to grab from annotations
-        :type include_keys: list
-        :param include_anns: Which annotations to include (name/id or __all__ or list)
-        :type include_anns: Union[str,list,None]
+        :type id: str
+        :param property: Property name (nested keys are separated by "-->")
+        :type property: str
+        :param aggregate: One of "stats", "histogram", or "counts", defaults to "stats"
+        :type aggregate: str, optional
+        :param bins: Number of histogram bins, defaults to 20
+        :type bins: int, optional
+        :param bbox: Comma-separated bounding box (minx,miny,maxx,maxy) in slide coordinates, defaults to None
+        :type bbox: Union[str,None], optional
+        :param include_anns: Which annotations to include (comma-separated names/ids or __all__)
+        :type include_anns: Union[str,None], optional
+        :param group_by: Either "layer" for separate results for each annotation or None, defaults to None
+        :type group_by: Union[str,None], optional
         """
 
         token = None
@@ -1001,86 +3418,63 @@ class LocalTileServer(TileServer):
             if request.query_params.get('token'):
                 token = request.query_params.get('token')
 
+        if not aggregate in ['stats','histogram','counts'] or not group_by in [None,'layer']:
+            return Response(
+                content = json.dumps({'error': 'aggregate must be one of "stats", "histogram", or "counts" and group_by must be "layer" or not provided'}),
+                media_type = 'application/json',
+                status_code = 400
+            )
 
-        image_item = await self.get_item(id, token)[0]
-        image_anns = await self.get_item_annotations(id,request)
-
-        include_keys = include_keys.split(',')
+        if not bbox is None:
+            try:
+                bbox = [float(b) for b in bbox.split(',')]
+                assert len(bbox)==4
+            except (ValueError, AssertionError):
+                return Response(
+                    content = json.dumps({'error': 'bbox must be 4 comma-separated numbers (minx,miny,maxx,maxy)'}),
+                    media_type = 'application/json',
+                    status_code = 400
+                )
 
-        if include_keys is None:
-            include_keys = []
+        image_item = await asyncio.gather(self.get_item(id, token))
+        if len(image_item[0])==0:
+            return Response(
+                content = 'invalid image id',
+                media_type = 'application/json',
+                status_code = 400,
+            )
 
         if include_anns is None:
             include_anns = '__all__'
+        elif not include_anns=='__all__':
+            include_anns = include_anns.split(',')
 
-        bbox_list = ['bbox.x0','bbox.y0','bbox.x1','bbox.y1']
-
-        data_list = []
-        for a in image_anns:
-            features = a.get('features',[])
-            a_id = a.get('properties',{}).get('_id',None)
-            a_name = a.get('properties',{}).get('name',None)
-
-            # Accepting either annotation layer name or id
-            if not include_anns=='__all__':
-                if type(include_anns)==str:
-                    if not include_anns==a_id and not include_anns==a_name:
-                        continue
-                elif type(include_anns)==list:
-                    if not a_id in include_anns and not a_name in include_anns:
-                        continue
-
-            for f in features:
-                f_props = f.get('properties')
-                f_bbox = list(shape(f['geometry']).bounds)
-                f_props_cols = []
-                if not f_props is None:
-                    for k in include_keys:
-                        k = k.replace('data.','')
-                        # Need to specify non-feature keys
-                        if k in ['annotation.id','annotation.name','item.id','item.name']:
-                            if k=='annotation.id':
-                                f_props_cols.append(a_id)
-                            elif k=='annotation.name':
-                                f_props_cols.append(a_name)
-                            elif k=='item.id':
-                                f_props_cols.append(str(id))
-                            elif k=='item.name':
-                                f_props_cols.append(image_item.get('name'))
-
-                        elif k in bbox_list:
-                            # Adding bounding box coordinates
-                            f_props_cols.append(f_bbox[bbox_list.index(k)])
+        # Accepting either annotation layer name or id
+        item_layers = [
+            l.get('id') for l in await self.database.run_async(self.database.get_layer_counts, id, token)
+            if l.get('structures')>0 and (include_anns=='__all__' or l.get('id') in include_anns or l.get('name') in include_anns)
+        ]
 
-                        else:
-                            # Getting keys and nested keys
-                            if '-->' in k:
-                                f_sub_keys = k.split('-->')
-                                f_sub_props = deepcopy(f_props)
-                                for sk in f_sub_keys:
-                                    if not f_sub_props is None:
-                                        f_sub_props = f_sub_props.get(sk)
-                            else:
-                                f_sub_props = f_props.get(k)
-
-                            # Converting to float if able
-                            if f_sub_props is not None:
-                                try:
-                                    f_sub_props = float(f_sub_props)
-                                    f_props_cols.append(f_sub_props)
-                                except ValueError:
-                                    f_props_cols.append(f_sub_props)
-                            else:
-                                f_props_cols.append(f_sub_props)
-                else:
-                    f_props_cols = [None]*len(include_keys)
+        property_name = ' --> '.join([sk.strip() for sk in property.replace('data.','').split('-->')])
+        aggregate_kwargs = {
+            'item_id': id,
+            'layer_id': item_layers,
+            'bbox': bbox,
+            'group_by': group_by,
+            'user_token': token
+        }
 
-                data_list.append(f_props_cols)
+        if aggregate=='stats':
+            aggregate_data = await self.database.run_async(self.database.get_property_stats, property_name, **aggregate_kwargs)
+        elif aggregate=='histogram':
+            aggregate_data = await self.database.run_async(self.database.get_property_histogram, property_name, bins = bins, **aggregate_kwargs)
+        else:
+            aggregate_data = await self.database.run_async(self.database.get_property_counts, property_name, **aggregate_kwargs)
 
         return Response(
-            content = json.dumps({'data': data_list, 'columns': include_keys}),
-            media_type='application/json',
-            status_code=200,
+            content = json.dumps(aggregate_data),
+            media_type = 'application/json',
+            status_code = 200
         )
 
     def start(self):
@@ -1095,7 +3489,7 @@ class LocalTileServer(TileServer):
         self.app.add_middleware(
             CORSMiddleware,
             allow_origins=self.cors_options.get('allow_origins',['*']),
-            allow_methods=self.cors_options.get('allow_methods',['GET','OPTIONS']),
+            allow_methods=self.cors_options.get('allow_methods',['GET','POST','OPTIONS']),
             allow_headers = self.cors_options.get('allow_headers',['*']),
             expose_headers = self.cors_options.get('expose_headers',['*']),
             allow_credentials = self.cors_options.get('allow_credentials',False)
@@ -1286,7 +3680,8 @@ class CustomTileServer(TileServer):
                  regions_url:str,
                  image_metadata: dict,
                  annotations_url: Union[str,None] = None,
-                 name: str = None
+                 name: str = None,
+                 regions_array_url: Union[str,None] = None
                  ):
         """Constructor method
 
@@ -1296,10 +3691,13 @@ class CustomTileServer(TileServer):
         :type regions_url: str
         :param image_metadata: Dictionary containing at least ['tileWidth','tileHeight','sizeX','sizeY','levels']
         :type image_metadata: dict
+        :param regions_array_url: URL to grab native dtype .npy regions from (e.g. "regions_array" from LocalTileServer.get_slide_urls), defaults to None
+        :type regions_array_url: Union[str,None], optional
         """
 
         self.tiles_url = tiles_url
         self.regions_url = regions_url
+        self.regions_array_url = regions_array_url
         self.annotations_url = annotations_url
         self.name = name
 
@@ -23,6 +23,10 @@ from skimage.measure import block_reduce, label
 
 import large_image
 
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
 
 def get_style_dict(channel_colors:list, tile_source = None, tile_metadata = None):
     """Generate style dictionary that can be used in association with large_image.open("/path/to/file.ext",style={}) to view different channels as different colors
@@ -78,12 +82,49 @@ def get_bands(channel_dict:dict):
 
     return style_dict
 
+def get_region_array(regions_array_url: str, bbox: list, frames: Union[None,list,int,str] = None, compress: bool = True) -> np.ndarray:
+    """Requesting an image region at native dtype from a LocalTileServer ".../tiles/region/array" endpoint
+
+    :param regions_array_url: "regions_array" url from LocalTileServer.get_slide_urls (may include a token)
+    :type regions_array_url: str
+    :param bbox: Region bounding box (left, top, right, bottom)
+    :type bbox: list
+    :param frames: One or more frame indices (or "all"), concatenated along the last axis, defaults to None
+    :type frames: Union[None,list,int,str], optional
+    :param compress: Whether to request a zstd-compressed array (only if zstandard is installed), defaults to True
+    :type compress: bool, optional
+    :return: Image region array (height, width, channels)
+    :rtype: np.ndarray
+    """
+    region_params = {
+        'left': int(bbox[0]),
+        'top': int(bbox[1]),
+        'right': int(bbox[2]),
+        'bottom': int(bbox[3])
+    }
+    if not frames is None:
+        if type(frames)==int:
+            frames = [frames]
+        region_params['frames'] = frames if type(frames)==str else ','.join([str(int(f)) for f in frames])
+    if compress and not zstandard is None:
+        region_params['compress'] = 'zstd'
+
+    region_response = requests.get(regions_array_url, params = region_params)
+    region_response.raise_for_status()
+
+    region_content = region_response.content
+    # zstd frame magic number
+    if region_content[:4]==b'\x28\xb5\x2f\xfd':
+        region_content = zstandard.ZstdDecompressor().decompress(region_content)
+
+    return np.load(BytesIO(region_content), allow_pickle = False)
+
 def get_feature_image(feature:dict, tile_source:None, return_mask: bool=False, return_image:bool= True, frame_index: Union[None,list,int] = None, frame_colors: Union[None,list] = None):
     """Extract image region associated with a given feature from tile_source (a large-image object)
 
     :param feature: GeoJSON Feature with "geometry" field containing coordinates
     :type feature: dict
-    :param tile_source: A large-image tile source object or URL that accepts region inputs
+    :param tile_source: A large-image tile source object or URL that accepts region inputs (LocalTileServer "regions_array" urls return native dtype arrays)
     :type tile_source: None
     :param return_mask: Whether or not to return both the image region (bounding box) as well as a binary mask of the boundaries of that feature, defaults to False
     :type return_mask: bool, optional
@@ -149,6 +190,19 @@ def get_feature_image(feature:dict, tile_source:None, return_mask: bool=False, r
                     else:
                         feature_image += np.uint8(np.repeat(frame_image[:,:,None],repeats=3,axis=-1) * np.array(frame_colors[f_idx])[None,:])
                 
+        elif '/tiles/region/array' in tile_source:
+            # All frames are read in one request at native dtype
+            feature_image = get_region_array(tile_source, feature_bounds, frame_index)
+            if not frame_index is None and not frame_colors is None:
+                # Scaling each frame to [0,1] and combining using frame colors
+                if np.issubdtype(feature_image.dtype,np.integer):
+                    feature_image = feature_image / np.iinfo(feature_image.dtype).max
+                feature_image = np.sum(
+                    feature_image[:,:,:,None] * np.array(frame_colors)[None,None,:,:3],
+                    axis = 2
+                )
+                feature_image = np.uint8(np.clip(feature_image,0,255))
+
         else:
             if '?' in tile_source:
                 start_str = '&'
@@ -20,6 +20,7 @@ from fusion_tools.database.database import fusionDB
 from fusion_tools.database.api import fusionAPI
 
 import threading
+import shutil
 
 import uvicorn
 from fastapi import FastAPI
@@ -128,12 +129,32 @@ class Visualization:
             'layout_style': {},
             'cors': {
                 'allow_origins': ['*'],
-                'allow_methods': ['GET','OPTIONS'],
+                'allow_methods': ['GET','POST','OPTIONS'],
                 'allow_credentials': False,
                 'allow_headers': ['*'],
                 'expose_headers': ['*'],
                 'max_age': '36000000'
             },
+            'tileserver': {
+                'cache': {},
+                'executor': {},
+                'prefetch': {},
+                'encoding': {}
+            },
+            'database': {
+                # Keeping fusionDB across restarts, only re-ingesting local slides whose sources have changed
+                'persist': True,
+                # Removing local slides from fusionDB which are no longer in local_slides
+                'prune': True,
+                # Seconds between ANALYZE/vacuum runs so the database file shrinks after deletions
+                'maintenance_interval': 3600,
+                # Removing guest sessions/users which haven't been active for "max_age" seconds (see fusionDB.expire_sessions)
+                'session_retention': {
+                    'max_age': 7*24*3600,
+                    'max_sessions': 10000,
+                    'interval': 600
+                }
+            },
             'external_stylesheets': [
                 dbc.themes.LUX,
                 dbc.themes.BOOTSTRAP,
@@ -183,21 +204,26 @@ class Visualization:
         #TODO: Find some way to make it easier for components to connect to this database
         if self.database is None:
             print(f'Creating fusionDB instance at: {self.app_options.get("assets_folder","")}fusion_database.db')
-            if os.path.exists(self.app_options.get("assets_folder","")+'fusion_database.db'):
+            if os.path.exists(self.app_options.get("assets_folder","")+'fusion_database.db') and not self.app_options.get('database',{}).get('persist',True):
                 print(f'Removing previous instance of fusionDB')
                 print(self.app_options.get('assets_folder','')+'fusion_database.db')
                 os.unlink(self.app_options.get('assets_folder','')+'fusion_database.db')
+                shutil.rmtree(self.app_options.get('assets_folder','')+'fusion_database_properties', ignore_errors = True)
 
             self.database = fusionDB(
                 db_url = f'sqlite:///{self.app_options.get("assets_folder","")}fusion_database.db',
-                echo = False
+                echo = False,
+                maintenance_interval = self.app_options.get('database',{}).get('maintenance_interval'),
+                session_retention = self.app_options.get('database',{}).get('session_retention')
             )
 
         elif type(self.database)==str:
             print(f'Creating fusionDB instance at: {self.database}')
             self.database = fusionDB(
                 db_url = self.database,
-                echo = False
+                echo = False,
+                maintenance_interval = self.app_options.get('database',{}).get('maintenance_interval'),
+                session_retention = self.app_options.get('database',{}).get('session_retention')
             )
 
     def get_callbacks(self):
@@ -922,13 +948,14 @@ class Visualization:
         if self.access_count == 1:
             print('-----------------First Access-------------')
             # This is the first time the app has been accessed, set to the created guest User and VisSession
+            # (the database may contain users and sessions from previous runs)
             in_memory_store['user'] = self.database.get_user(
-                user_id = self.database.get_ids('user')[0]
+                user_id = self.vis_store_content.get('user').get('id')
             )
             del in_memory_store['user']['updated']
 
             in_memory_store['session'] = {
-                'id': self.database.get_ids('vis_session')[0]
+                'id': self.vis_store_content.get('session').get('id')
             }
 
             session_data['user'] = in_memory_store['user']
@@ -968,6 +995,7 @@ class Visualization:
                             print(f'---------New Window/Previous User/Previous Session-------------')
                             in_memory_store['user'] = session_data.get('user')
                             in_memory_store['session'] = session_data.get('session')
+                            self.database.touch_vis_session(in_memory_store.get('session').get('id'))
 
                             # Checking which items this user has specific access to
                             prev_user_access = self.database.check_user_access(user_id = in_memory_store.get('user').get('id'), admin = in_memory_store.get('user').get('admin',False))
@@ -1016,7 +1044,7 @@ class Visualization:
             elif in_memory_store.get('user').get('id') not in current_user_ids:
                 print('--------Previous Window/New User/New Session---------------')
                 # Not None user, not in current_user_ids
-                new_user = self.new_user(guest = False, id = in_memory_store.get('user').get('id'))
+                new_user = self.new_user(guest = 'guest' in in_memory_store.get('user').get('id'), id = in_memory_store.get('user').get('id'))
                 new_session = self.new_session(guest = not 'guest' in in_memory_store.get('user').get('id'))
 
                 # Since this user is not registered in User, they only have access to 'public' Items
@@ -1031,6 +1059,7 @@ class Visualization:
             elif in_memory_store.get('user').get('id') in current_user_ids:
                 if in_memory_store.get('session').get('id') in current_vis_session_ids:
                     print('------------Previous Window/Previous User/Previous Session---------------')
+                    self.database.touch_vis_session(in_memory_store.get('session').get('id'))
                     # Checking which items this user has specific access to
                     prev_user_access = self.database.check_user_access(user_id = in_memory_store.get('user').get('id'), admin = in_memory_store.get('user').get('admin',False))
                     # Adding public items and items this user has access to
@@ -1144,7 +1173,8 @@ class Visualization:
             'login': f'{uuid.uuid4().hex[:24]}',
             'firstName': 'Guest',
             'lastName': 'User',
-            'token': uuid.uuid4().hex[:24]
+            'token': uuid.uuid4().hex[:24],
+            'guest': guest
         }
 
         return user_dict
@@ -1169,7 +1199,7 @@ class Visualization:
             'user': self.new_user(guest = True),
         }
 
-        self.database.add_vis_session(slide_store)
+        self.database.add_vis_session(slide_store, retain = True)
 
         s_idx = 0
         t_idx = 0
@@ -1186,14 +1216,23 @@ class Visualization:
                 tile_server_port = self.app_options['port'],
                 host = self.app_options['host'],
                 database = self.database,
-                jupyter_server_url = self.app_options.get('jupyter_server_url','').replace(str(self.app_options['port']),str(self.app_options['port']+10))
+                jupyter_server_url = self.app_options.get('jupyter_server_url','').replace(str(self.app_options['port']),str(self.app_options['port']+10)),
+                cache_options = self.app_options.get('tileserver',{}).get('cache',{}),
+                executor_options = self.app_options.get('tileserver',{}).get('executor',{}),
+                prefetch_options = self.app_options.get('tileserver',{}).get('prefetch',{}),
+                encoding_options = self.app_options.get('tileserver',{}).get('encoding',{})
             )
 
+            # Slide ids are based on image paths so that unchanged slides in a persistent database aren't loaded again
+            skip_unchanged = self.app_options.get('database',{}).get('persist',True)
+            local_slide_paths = []
             for s_idx,(s,anns,meta) in enumerate(zip(self.local_slides,self.local_annotations,self.slide_metadata)):
                 slide_dict = {}
                 if not s is None:
                     # Adding this slide to list of local slides
-                    local_slide_id = uuid.uuid4().hex[:24]
+                    slide_path = s if not isinstance(s,Slide) else s.image_filepath
+                    local_slide_id = self.local_tile_server.get_local_slide_id(slide_path, local_slide_paths.count(slide_path))
+                    local_slide_paths.append(slide_path)
                     if not isinstance(s,Slide):
                         self.local_tile_server.add_new_image(
                             new_image_id = local_slide_id,
@@ -1201,7 +1240,8 @@ class Visualization:
                             new_annotations = anns,
                             new_metadata = meta,
                             session_id = slide_store.get('session').get('id'),
-                            user_id = slide_store.get('user').get('id')
+                            user_id = slide_store.get('user').get('id'),
+                            skip_unchanged = skip_unchanged
                         )
 
                         slide_dict = {
@@ -1218,7 +1258,8 @@ class Visualization:
                             slide_id = local_slide_id,
                             slide_obj = s,
                             session_id = slide_store.get('session').get('id'),
-                            user_id = slide_store.get('user').get('id') if not s.public else None
+                            user_id = slide_store.get('user').get('id') if not s.public else None,
+                            skip_unchanged = skip_unchanged
                         )
 
                         slide_dict = {
@@ -1234,6 +1275,9 @@ class Visualization:
                 slide_store['current'].append(slide_dict)
                 slide_store['local'].append(slide_dict)
 
+            if self.app_options.get('database',{}).get('prune',True):
+                self.database.prune_items([i.get('id') for i in slide_store['local'] if 'id' in i])
+
         else:
             self.local_tile_server = None
 
@@ -1248,8 +1292,8 @@ class Visualization:
                     for j_idx,j in enumerate(t.get_item_names_ids()):
 
                         slide_dict = {
-                            'name': j.name,
-                            'id': j.id,
+                            'name': j.get('name'),
+                            'id': j.get('id'),
                             'url': local_tile_server_url,
                             'cached': True,
                             'item_type': 'local_item',
@@ -1836,7 +1880,7 @@ class Visualization:
                 app = CORSMiddleware(
                     self.local_tile_server.app,
                     allow_origins = allowed_origins if not cors_options.get('allow_origins')==['*'] else ['*'],
-                    allow_methods = cors_options.get('allow_methods',['GET','OPTIONS']),
+                    allow_methods = cors_options.get('allow_methods',['GET','POST','OPTIONS']),
                     allow_headers = cors_options.get('allow_headers',['*']),
                     allow_credentials = cors_options.get('allow_credentials',False),
                     expose_headers = cors_options.get('expose_headers',['*']),
@@ -1849,7 +1893,7 @@ class Visualization:
             app = CORSMiddleware(
                 WSGIMiddleware(self.viewer_app.server),
                     allow_origins = allowed_origins if not cors_options.get('allow_origins')==['*'] else ['*'],
-                    allow_methods = cors_options.get('allow_methods',['GET','OPTIONS']),
+                    allow_methods = cors_options.get('allow_methods',['GET','POST','OPTIONS']),
                     allow_headers = cors_options.get('allow_headers',['*']),
                     allow_credentials = cors_options.get('allow_credentials',False),
                     expose_headers = cors_options.get('expose_headers',['*']),
@@ -1860,7 +1904,7 @@ class Visualization:
         return CORSMiddleware(
             app,
             allow_origins = allowed_origins if not cors_options.get('allow_origins')==['*'] else ['*'],
-            allow_methods = cors_options.get('allow_methods',['GET','OPTIONS']),
+            allow_methods = cors_options.get('allow_methods',['GET','POST','OPTIONS']),
             allow_headers = cors_options.get('allow_headers',['*']),
             allow_credentials = cors_options.get('allow_credentials',False),
             expose_headers = cors_options.get('expose_headers',['*']),
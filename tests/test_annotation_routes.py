@@ -0,0 +1,130 @@
+"""
+
+Testing LocalTileServer annotation routes for items with and without annotations and with invalid ids
+
+"""
+
+import os
+import sys
+sys.path.append('./src/')
+
+import json
+import uuid
+import asyncio
+import tempfile
+from copy import deepcopy
+
+from starlette.requests import Request
+
+from fusion_tools.tileserver import LocalTileServer
+from fusion_tools.database.database import fusionDB
+
+
+def make_request(token = None):
+    return Request({
+        'type': 'http',
+        'method': 'GET',
+        'headers': [],
+        'query_string': f'token={token}'.encode() if not token is None else b''
+    })
+
+
+async def read_response(route, *args, **kwargs):
+    response = await route(*args, **kwargs)
+    if hasattr(response,'body_iterator'):
+        body = ''
+        async for chunk in response.body_iterator:
+            body += chunk if type(chunk)==str else chunk.decode()
+        return response.status_code, body
+
+    return response.status_code, response.body.decode()
+
+
+def main():
+
+    db_dir = tempfile.mkdtemp()
+    database = fusionDB(
+        db_url = f'sqlite:///{db_dir}/fusion_database.db',
+        echo = False
+    )
+    tile_server = LocalTileServer(
+        database = database,
+        tile_server_port = 8080
+    )
+
+    annotations = {
+        'type': 'FeatureCollection',
+        'properties': {'name': 'Layer 0', '_id': uuid.uuid4().hex[:24]},
+        'features': [
+            {
+                'type': 'Feature',
+                'geometry': {'type': 'Polygon', 'coordinates': [[[i,i],[i+1,i],[i+1,i+1],[i,i]]]},
+                'properties': {'_id': uuid.uuid4().hex[:24], 'name': 'Layer 0', 'area': float(i)}
+            }
+            for i in range(10)
+        ]
+    }
+
+    user = {'id': 'guestuser' + 'a'*15, 'login': 'guest', 'firstName': 'Guest', 'lastName': 'User', 'token': 'b'*24}
+    database.add_vis_session({'user': user, 'session': {'id': 'guestsession' + 'c'*12, 'data': {}}, 'data': {}})
+
+    empty_id = 'empty'*4 + '0000'
+    annotated_id = 'annot'*4 + '0000'
+    private_id = 'priva'*4 + '0000'
+    # Private slide gets its own layer/structure ids so that it doesn't share a layer with the public slide
+    private_annotations = deepcopy(annotations)
+    private_annotations['properties']['_id'] = uuid.uuid4().hex[:24]
+    for f in private_annotations['features']:
+        f['properties']['_id'] = uuid.uuid4().hex[:24]
+
+    for slide_id, slide_anns, public in [(empty_id, None, True), (annotated_id, annotations, True), (private_id, private_annotations, False)]:
+        database.add_slide(
+            slide_id = slide_id,
+            slide_name = f'{slide_id}.tif',
+            item_type = 'local_item',
+            metadata = {},
+            image_metadata = {},
+            image_filepath = None,
+            annotations_metadata = [],
+            annotations = slide_anns,
+            user_id = user['id'],
+            public = public
+        )
+
+    # Accessible items without annotation layers return an empty list
+    status, body = asyncio.run(read_response(tile_server.get_annotations, empty_id, request = make_request()))
+    assert status==200 and json.loads(body)==[]
+
+    status, body = asyncio.run(read_response(tile_server.get_annotations, annotated_id, request = make_request()))
+    assert status==200 and len(json.loads(body))==1 and len(json.loads(body)[0]['features'])==10
+
+    # Missing items are still invalid
+    status, body = asyncio.run(read_response(tile_server.get_annotations, 'missing'*3 + 'abc', request = make_request()))
+    assert status==400
+
+    # Aggregates for items that can't be accessed are invalid instead of empty
+    status, body = asyncio.run(read_response(tile_server.get_annotations_property_aggregate, annotated_id, 'area', request = make_request()))
+    assert status==200 and json.loads(body)['area']['count']==10
+
+    status, body = asyncio.run(read_response(tile_server.get_annotations_property_aggregate, 'missing'*3 + 'abc', 'area', request = make_request()))
+    assert status==400
+
+    status, body = asyncio.run(read_response(tile_server.get_annotations_property_aggregate, private_id, 'area', request = make_request()))
+    assert status==400
+
+    status, body = asyncio.run(read_response(tile_server.get_annotations_property_aggregate, private_id, 'area', request = make_request(user['token'])))
+    assert status==200 and json.loads(body)['area']['count']==10
+
+    # Property keys and data are also only returned for accessible items
+    for slide_id, token, expected_status in [(annotated_id, None, 200), (empty_id, None, 200), ('missing'*3 + 'abc', None, 400), (private_id, None, 400), (private_id, user['token'], 200)]:
+        status, body = asyncio.run(read_response(tile_server.get_annotations_property_keys, slide_id, request = make_request(token)))
+        assert status==expected_status
+
+        status, body = asyncio.run(read_response(tile_server.get_annotations_property_data, slide_id, include_keys = 'area', request = make_request(token)))
+        assert status==expected_status
+        if status==200:
+            assert len(json.loads(body)['data'])==(0 if slide_id==empty_id else 10)
+
+
+if __name__=='__main__':
+    main()
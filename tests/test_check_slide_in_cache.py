@@ -0,0 +1,60 @@
+"""
+
+Testing SlideMap.check_slide_in_cache against a populated fusionDB
+
+"""
+
+import os
+import sys
+sys.path.append('./src/')
+
+import tempfile
+
+from fusion_tools.database.database import fusionDB
+from fusion_tools.components.maps import SlideMap
+
+
+def main():
+
+    db_dir = tempfile.mkdtemp()
+    database = fusionDB(
+        db_url = f'sqlite:///{db_dir}/fusion_database.db',
+        echo = False
+    )
+
+    user = {'id': 'guestuser' + 'a'*15, 'login': 'guest', 'firstName': 'Guest', 'lastName': 'User', 'token': 'b'*24}
+    session = {'id': 'guestsession' + 'c'*12, 'data': {}}
+    database.add_vis_session({'user': user, 'session': session, 'data': {}})
+
+    slide_ids = ['slide'*4 + f'{i:04d}' for i in range(2)]
+    for slide_id in slide_ids:
+        database.add_slide(
+            slide_id = slide_id,
+            slide_name = f'{slide_id}.tif',
+            item_type = 'remote_item',
+            metadata = {},
+            image_metadata = {},
+            image_filepath = None,
+            annotations_metadata = [],
+            annotations = None,
+            vis_session_id = session['id'],
+            user_id = user['id']
+        )
+
+    slide_map = SlideMap()
+    slide_map.add_database(database)
+
+    cached_item = slide_map.check_slide_in_cache(image_id = slide_ids[0], user_id = user['id'], vis_session_id = session['id'])
+    print(f'cached item: {cached_item}')
+    assert type(cached_item)==dict and cached_item.get('id')==slide_ids[0]
+
+    assert slide_map.check_slide_in_cache(image_id = 'missing'*3+'abc', user_id = user['id'], vis_session_id = session['id']) is False
+
+    session_items = slide_map.check_slide_in_cache(image_id = None, user_id = user['id'], vis_session_id = session['id'])
+    print(f'session items: {[i.get("id") for i in session_items]}')
+    assert type(session_items)==list
+    assert sorted([i.get('id') for i in session_items])==slide_ids
+
+
+if __name__=='__main__':
+    main()
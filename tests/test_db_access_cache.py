@@ -0,0 +1,125 @@
+"""
+
+Testing that fusionDB's access cache is cleared when access is granted or revoked, only once the change is committed
+
+"""
+
+import os
+import sys
+sys.path.append('./src/')
+
+import tempfile
+import threading
+
+from sqlalchemy import select, func
+from fusion_tools.database.database import fusionDB
+from fusion_tools.database.models import UserAccess
+
+
+def read_in_thread(method, *args):
+    # Separate thread so the read uses its own (thread-local) session
+    result = []
+    read_thread = threading.Thread(target = lambda: result.append(method(*args)))
+    read_thread.start()
+    read_thread.join()
+    return result[0]
+
+
+def main():
+
+    db_dir = tempfile.mkdtemp()
+    database = fusionDB(
+        db_url = f'sqlite:///{db_dir}/fusion_database.db',
+        echo = False
+    )
+
+    user = {'id': 'guestuser' + 'a'*15, 'login': 'guest', 'firstName': 'Guest', 'lastName': 'User', 'token': 'b'*24}
+    database.add_vis_session({'user': user, 'session': {'id': 'guestsession' + 'c'*12, 'data': {}}, 'data': {}})
+
+    slide_id = 'slide'*4 + '0000'
+    database.add_slide(
+        slide_id = slide_id,
+        slide_name = 'private_slide.tif',
+        item_type = 'remote_item',
+        metadata = {},
+        image_metadata = {},
+        image_filepath = None,
+        annotations_metadata = [],
+        annotations = None,
+        public = False
+    )
+
+    assert not database.check_item_access(slide_id, user['token'])
+
+    # Granting access
+    database.add_access(slide_id, user['id'])
+    assert database.check_item_access(slide_id, user['token'])
+    print(f'after grant: {database.access_cache.stats()}')
+
+    # Granting access again (e.g. when a persisted slide is re-added each session) doesn't add duplicate rows
+    database.add_access(slide_id, user['id'])
+    with database.get_db() as session:
+        n_access = session.scalar(
+            select(func.count()).select_from(UserAccess).where(UserAccess.c.user_id==user['id'], UserAccess.c.item_id==slide_id)
+        )
+    assert n_access==1
+
+    # Revoking access
+    database.remove_access(slide_id, user['id'])
+    assert not database.check_item_access(slide_id, user['token'])
+    print(f'after revoke: {database.access_cache.stats()}')
+
+    # Reads made while a grant isn't committed yet see (and cache) the previous access, the cache is cleared by the commit
+    invalidations = database.access_cache.stats()['invalidations']
+    with database.get_db() as session:
+        session.execute(UserAccess.insert().values(user_id = user['id'], item_id = slide_id))
+        session.flush()
+
+        assert database.access_cache.stats()['invalidations']==invalidations
+        assert not read_in_thread(database.check_item_access, slide_id, user['token'])
+
+    assert database.access_cache.stats()['invalidations']==invalidations+1
+    assert database.check_item_access(slide_id, user['token'])
+
+    # Rolled back changes don't clear the cache
+    try:
+        with database.get_db() as session:
+            session.execute(UserAccess.delete().where(UserAccess.c.item_id==slide_id))
+            raise ValueError
+    except ValueError:
+        pass
+    assert database.access_cache.stats()['invalidations']==invalidations+1
+    assert database.check_item_access(slide_id, user['token'])
+
+    # Values read before an invalidation aren't stored after it
+    cache_generation = database.access_cache.generation
+    database.access_cache.invalidate()
+    database.access_cache.set(('readable',user['token']), frozenset(), cache_generation)
+    assert database.access_cache.get(('readable',user['token'])) is None
+    assert database.check_item_access(slide_id, user['token'])
+
+    # Structure reads use the same access rules, including when they aren't restricted to one item
+    layer_id = 'layer'*4 + '0000'
+    database.add_layer(
+        {
+            'type': 'FeatureCollection',
+            'properties': {'name': 'Private', '_id': layer_id},
+            'features': [
+                {
+                    'type': 'Feature',
+                    'geometry': {'type': 'Polygon', 'coordinates': [[[i,i],[i+1,i],[i+1,i+1],[i,i]]]},
+                    'properties': {'_id': f'structure{i:015d}', 'name': 'Private'}
+                }
+                for i in range(5)
+            ]
+        },
+        item_id = slide_id
+    )
+    for token, n_expected in [(None, 0), ('d'*24, 0), (user['token'], 5)]:
+        assert len(database.get_structures_in_bbox([0,0,10,10], layer_id = layer_id, user_token = token))==n_expected
+        assert len(list(database.get_structure_generator(layer_id = layer_id, user_token = token)))==n_expected
+        assert len(list(database.get_structure_generator(item_id = slide_id, user_token = token)))==n_expected
+
+
+if __name__=='__main__':
+    main()
@@ -0,0 +1,120 @@
+"""
+
+Testing that property filters in fusionDB.get_cohort_property_data (applied while reading the property store or in the SQL query) match checking every structure
+
+"""
+
+import os
+import sys
+sys.path.append('./src/')
+
+import uuid
+import tempfile
+
+from fusion_tools.database.database import fusionDB
+
+
+def add_slide(database, slide_id, layer_id, name, n_features, scale):
+    database.add_slide(
+        slide_id = slide_id,
+        slide_name = f'{name}_slide',
+        item_type = 'local_item',
+        metadata = {},
+        image_metadata = {},
+        image_filepath = None,
+        annotations_metadata = [],
+        annotations = [{
+            'type': 'FeatureCollection',
+            'properties': {'name': name, '_id': layer_id},
+            'features': [
+                {
+                    'type': 'Feature',
+                    'geometry': {'type': 'Polygon', 'coordinates': [[[i,0],[i+1,0],[i+1,1],[i,0]]]},
+                    'properties': {
+                        '_id': uuid.uuid4().hex[:24],
+                        'name': name,
+                        'area': i*scale,
+                        'label': ['x','y','z'][i%3],
+                        'Main': {'score': i/2} if i%2==0 else {}
+                    }
+                }
+                for i in range(n_features)
+            ]
+        }],
+        public = True,
+        source_hash = uuid.uuid4().hex
+    )
+
+
+def check_filter(value, f):
+    # Previous (per-structure) filter rules
+    if value is None:
+        return False
+    if type(value)==float and all([type(r) in [int,float] for r in f['range']]):
+        return f['range'][0]<=value and f['range'][1]>=value
+    return value in f['range']
+
+
+def expected_rows(all_data, columns, filters):
+    get_value = lambda row, name: row[columns.index(name)] if name in columns else None
+    and_filters = [f for f in filters if f['mod'] in ['and','not']]
+    or_filters = [f for f in filters if f['mod']=='or']
+    rows = []
+    for row in all_data:
+        if len(and_filters)>0:
+            if not all([check_filter(get_value(row, a['name']), a)!=(a['mod']=='not') for a in and_filters]):
+                continue
+        elif len(or_filters)>0:
+            if not any([check_filter(get_value(row, o['name']), o) for o in or_filters]):
+                continue
+        rows.append(row)
+
+    return rows
+
+
+def main():
+
+    db_dir = tempfile.mkdtemp()
+    database = fusionDB(
+        db_url = f'sqlite:///{db_dir}/fusion_database.db',
+        echo = False
+    )
+
+    slide_ids = ['slide'*4 + '0000', 'slide'*4 + '0001']
+    add_slide(database, slide_ids[0], 'a'*24, 'Tubules', 30, 1)
+    add_slide(database, slide_ids[1], 'b'*24, 'Glomeruli', 20, 10)
+    if not database.property_store is None:
+        # Second layer is read from the JSON properties column
+        database.property_store.remove_layer('b'*24)
+
+    include_keys = ['area', 'label', 'data.Main --> score', 'annotation.name', 'item.id', 'bbox.x0']
+    all_data = database.get_cohort_property_data(slide_ids, include_keys)['data']
+    assert len(all_data)==50
+
+    filter_list = [
+        [{'name': 'area', 'range': [5,50], 'mod': 'and'}],
+        [{'name': 'area', 'range': [5,50], 'mod': 'and'}, {'name': 'label', 'range': ['x','z'], 'mod': 'and'}],
+        [{'name': 'data.Main --> score', 'range': [1,4], 'mod': 'not'}],
+        [{'name': 'label', 'range': ['y'], 'mod': 'or'}, {'name': 'area', 'range': [100,1000], 'mod': 'or'}],
+        [{'name': 'annotation.name', 'range': ['Glomeruli'], 'mod': 'and'}, {'name': 'bbox.x0', 'range': [2,8.5], 'mod': 'and'}],
+        [{'name': 'item.id', 'range': [slide_ids[0]], 'mod': 'not'}, {'name': 'area', 'range': [0,60], 'mod': 'and'}],
+        [{'name': 'missing', 'range': [0,1], 'mod': 'and'}],
+        [{'name': 'missing', 'range': [0,1], 'mod': 'not'}, {'name': 'label', 'range': ['z'], 'mod': 'and'}]
+    ]
+    for filters in filter_list:
+        filtered_data = database.get_cohort_property_data(slide_ids, include_keys, filters = filters)['data']
+        print(f'filters: {[(f["name"],f["range"],f["mod"]) for f in filters]}, structures: {len(filtered_data)}')
+        assert sorted(filtered_data, key = str)==sorted(expected_rows(all_data, include_keys, filters), key = str)
+
+    # Filters are applied while reading the property file
+    if not database.property_store is None:
+        layer_data = database.property_store.read_layer(
+            'a'*24, ['area'],
+            filters = [{'name': 'area', 'range': [5,9], 'mod': 'and'}],
+            layer_values = {'layer.id': 'a'*24, 'layer.name': 'Tubules', 'item.id': slide_ids[0], 'item.name': 'Tubules_slide'}
+        )
+        assert layer_data['area']==[5,6,7,8,9]
+
+
+if __name__=='__main__':
+    main()
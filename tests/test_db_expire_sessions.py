@@ -0,0 +1,119 @@
+"""
+
+Testing that fusionDB.expire_sessions keeps the number of guest sessions/users bounded while keeping retained sessions, registered users, and local items
+
+"""
+
+import os
+import sys
+sys.path.append('./src/')
+
+import uuid
+import tempfile
+from datetime import datetime, timedelta
+
+from sqlalchemy import select, update, func
+from fusion_tools.database.database import fusionDB
+from fusion_tools.database.models import VisSession, User, Item, UserAccess
+
+
+def add_session(database, guest = True, retain = False):
+    user = {
+        'id': ('guestuser' if guest else 'registered') + uuid.uuid4().hex[:14],
+        'login': uuid.uuid4().hex[:24],
+        'firstName': 'Guest' if guest else 'Registered',
+        'lastName': 'User',
+        'token': uuid.uuid4().hex[:24],
+        'guest': guest
+    }
+    session = {'id': uuid.uuid4().hex[:24], 'data': {}}
+    database.add_vis_session({'user': user, 'session': session, 'data': {}}, retain = retain)
+    return user['id'], session['id']
+
+
+def add_slide(database, slide_id, vis_session_id, user_id, source_hash = None):
+    database.add_slide(
+        slide_id = slide_id,
+        slide_name = f'{slide_id}.tif',
+        item_type = 'local_item' if not source_hash is None else 'remote_item',
+        metadata = {},
+        image_metadata = {},
+        image_filepath = None,
+        annotations_metadata = [],
+        annotations = None,
+        vis_session_id = vis_session_id,
+        user_id = user_id,
+        source_hash = source_hash
+    )
+
+
+def count_rows(database):
+    with database.get_db() as session:
+        return {
+            'sessions': session.scalar(select(func.count()).select_from(VisSession)),
+            'users': session.scalar(select(func.count()).select_from(User)),
+            'access': session.scalar(select(func.count()).select_from(UserAccess)),
+            'items': session.scalar(select(func.count()).select_from(Item))
+        }
+
+
+def main():
+
+    db_dir = tempfile.mkdtemp()
+    database = fusionDB(
+        db_url = f'sqlite:///{db_dir}/fusion_database.db',
+        echo = False
+    )
+
+    max_sessions = 5
+
+    # Session created when the Visualization starts and a registered user's session, both inactive
+    retained_user, retained_session = add_session(database, guest = True, retain = True)
+    registered_user, registered_session = add_session(database, guest = False)
+
+    stale_sessions = [add_session(database) for _ in range(6)]
+    active_sessions = [add_session(database) for _ in range(max_sessions+4)]
+
+    # Every guest has a private (cached) slide, one stale session also viewed a local slide
+    for s_idx, (user_id, session_id) in enumerate(stale_sessions + active_sessions):
+        add_slide(database, f'slide{s_idx:019d}', session_id, user_id)
+    local_slide = 'local'*4 + '0000'
+    add_slide(database, local_slide, stale_sessions[0][1], stale_sessions[0][0], source_hash = uuid.uuid4().hex)
+
+    with database.get_db() as session:
+        session.execute(
+            update(VisSession).where(VisSession.id.in_([s[1] for s in stale_sessions] + [retained_session, registered_session])).values(updated = datetime.now() - timedelta(days = 30))
+        )
+    # Most recently active sessions are kept
+    kept_sessions = active_sessions[-max_sessions:]
+    for user_id, session_id in kept_sessions:
+        database.touch_vis_session(session_id)
+
+    print(f'before: {count_rows(database)}')
+    expired_stats = database.expire_sessions(max_age = 7*24*3600, max_sessions = max_sessions, chunk_size = 4)
+    after_counts = count_rows(database)
+    print(f'expired: {expired_stats}, after: {after_counts}')
+
+    # Kept guest sessions + retained session + registered user's session
+    assert after_counts['sessions']==max_sessions+2
+    assert after_counts['users']==max_sessions+2
+    # Access rows only remain for the kept guests' slides
+    assert after_counts['access']==max_sessions
+    # Kept guests' slides and the local slide
+    assert after_counts['items']==max_sessions+1
+    assert expired_stats['sessions']==len(stale_sessions)+len(active_sessions)-max_sessions
+
+    with database.get_db() as session:
+        remaining_sessions = set(session.scalars(select(VisSession.id)).all())
+        remaining_users = set(session.scalars(select(User.id)).all())
+    assert remaining_sessions==set([s[1] for s in kept_sessions] + [retained_session, registered_session])
+    assert remaining_users==set([s[0] for s in kept_sessions] + [retained_user, registered_user])
+    assert not database.get_item_info(local_slide) is None
+
+    # Nothing else expires until sessions become inactive
+    assert database.expire_sessions(max_age = 7*24*3600, max_sessions = max_sessions)=={'sessions': 0, 'users': 0, 'items': 0}
+    assert count_rows(database)==after_counts
+
+
+if __name__=='__main__':
+    main()
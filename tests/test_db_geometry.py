@@ -0,0 +1,144 @@
+"""
+
+Testing geometry encoding (JSON/WKB) round trips and migrating a database file created before the bounding box columns were added
+
+"""
+
+import os
+import sys
+sys.path.append('./src/')
+
+import json
+import sqlite3
+import tempfile
+
+from sqlalchemy import select, inspect, type_coerce, LargeBinary
+from shapely.geometry import shape
+from fusion_tools.database.database import fusionDB
+from fusion_tools.database.models import (
+    Structure, encode_geometry, decode_geometry,
+    WKB_FLOAT_PREFIX, WKB_INT_PREFIX
+)
+
+# Geometry, whether it can be stored as WKB
+TEST_GEOMETRIES = {
+    'int_polygon': ({'type': 'Polygon', 'coordinates': [[[0,0],[10,0],[10,10],[0,0]]]}, True),
+    'float_polygon': ({'type': 'Polygon', 'coordinates': [[[0.5,0.25],[10.5,0.25],[10.5,10.125],[0.5,0.25]]]}, True),
+    'polygon_with_hole': ({'type': 'Polygon', 'coordinates': [[[0,0],[20,0],[20,20],[0,20],[0,0]],[[5,5],[6,5],[6,6],[5,5]]]}, True),
+    'int_multipolygon': ({'type': 'MultiPolygon', 'coordinates': [[[[0,0],[1,0],[1,1],[0,0]]],[[[5,5],[6,5],[6,6],[5,5]]]]}, True),
+    'float_point': ({'type': 'Point', 'coordinates': [1.5,2.5]}, True),
+    'int_linestring': ({'type': 'LineString', 'coordinates': [[0,0],[3,4],[5,5]]}, True),
+    'mixed_polygon': ({'type': 'Polygon', 'coordinates': [[[0,0],[10.5,0],[10,10],[0,0]]]}, False),
+    '3d_polygon': ({'type': 'Polygon', 'coordinates': [[[0,0,1],[10,0,1],[10,10,1],[0,0,1]]]}, False),
+    'unclosed_ring': ({'type': 'Polygon', 'coordinates': [[[0,0],[10,0],[10,10],[0,10]]]}, False),
+    'large_int_polygon': ({'type': 'Polygon', 'coordinates': [[[0,0],[2**60,0],[2**60,1],[0,0]]]}, False),
+    'extra_keys': ({'type': 'Point', 'coordinates': [1,2], 'bbox': [1,2,1,2]}, False)
+}
+
+# Tables as created by fusionDB before bounding box columns, item source hashes, and guest users were added
+BASELINE_SCHEMA = """
+CREATE TABLE user (id VARCHAR(24) NOT NULL, login VARCHAR, password VARCHAR(60), "firstName" VARCHAR, "lastName" VARCHAR, email VARCHAR, admin BOOLEAN, updated DATETIME, token VARCHAR, external JSON, meta JSON, PRIMARY KEY (id), UNIQUE (login));
+CREATE TABLE vis_session (id VARCHAR(24) NOT NULL, user VARCHAR(24), name VARCHAR, data JSON, updated DATETIME, meta JSON, PRIMARY KEY (id), FOREIGN KEY(user) REFERENCES user (id));
+CREATE TABLE item (id VARCHAR(24) NOT NULL, name VARCHAR, meta JSON, image_meta JSON, ann_meta JSON, session VARCHAR(24), updated DATETIME, public BOOLEAN, item_type VARCHAR, PRIMARY KEY (id), FOREIGN KEY(session) REFERENCES vis_session (id));
+CREATE TABLE layer (id VARCHAR(24) NOT NULL, name VARCHAR, item VARCHAR(24), updated DATETIME, meta JSON, PRIMARY KEY (id), FOREIGN KEY(item) REFERENCES item (id));
+CREATE TABLE local_item (id VARCHAR(24) NOT NULL, url VARCHAR, filepath VARCHAR, PRIMARY KEY (id), FOREIGN KEY(id) REFERENCES item (id));
+CREATE TABLE remote_item (id VARCHAR(24) NOT NULL, url VARCHAR, remote_id VARCHAR(24), PRIMARY KEY (id), FOREIGN KEY(id) REFERENCES item (id));
+CREATE TABLE user_access (user_id VARCHAR, item_id VARCHAR, FOREIGN KEY(user_id) REFERENCES user (id) ON DELETE CASCADE, FOREIGN KEY(item_id) REFERENCES item (id) ON DELETE CASCADE);
+CREATE TABLE image_overlay (id VARCHAR(24) NOT NULL, bounds JSON, properties JSON, image_src VARCHAR, layer VARCHAR(24), item VARCHAR(24), updated DATETIME, meta JSON, PRIMARY KEY (id), FOREIGN KEY(layer) REFERENCES layer (id), FOREIGN KEY(item) REFERENCES item (id));
+CREATE TABLE structure (id VARCHAR(24) NOT NULL, geom JSON, properties JSON, layer VARCHAR(24), item VARCHAR(24), updated DATETIME, meta JSON, PRIMARY KEY (id), FOREIGN KEY(layer) REFERENCES layer (id), FOREIGN KEY(item) REFERENCES item (id));
+CREATE TABLE annotation (id VARCHAR(24) NOT NULL, user VARCHAR(24), session VARCHAR(24), item VARCHAR(24), layer VARCHAR(24), structure VARCHAR(24), data JSON, updated DATETIME, meta JSON, PRIMARY KEY (id), FOREIGN KEY(user) REFERENCES user (id), FOREIGN KEY(session) REFERENCES vis_session (id), FOREIGN KEY(item) REFERENCES item (id), FOREIGN KEY(layer) REFERENCES layer (id), FOREIGN KEY(structure) REFERENCES structure (id));
+CREATE TABLE data (id VARCHAR(24) NOT NULL, user VARCHAR(24), session VARCHAR(24), item VARCHAR(24), layer VARCHAR(24), structure VARCHAR(24), filepath VARCHAR, updated DATETIME, meta JSON, PRIMARY KEY (id), FOREIGN KEY(user) REFERENCES user (id), FOREIGN KEY(session) REFERENCES vis_session (id), FOREIGN KEY(item) REFERENCES item (id), FOREIGN KEY(layer) REFERENCES layer (id), FOREIGN KEY(structure) REFERENCES structure (id));
+"""
+
+
+def check_round_trip():
+
+    for name, (geom, wkb_encodable) in TEST_GEOMETRIES.items():
+        for geometry_format in ['json','wkb']:
+            encoded = encode_geometry(geom, geometry_format)
+            decoded = decode_geometry(encoded)
+
+            # Comparing serialized geometries so that int/float coordinates have to match
+            assert json.dumps(decoded)==json.dumps(geom), f'{name} ({geometry_format}): {decoded}'
+
+            stored_as_wkb = encoded[:1] in [WKB_FLOAT_PREFIX,WKB_INT_PREFIX]
+            assert stored_as_wkb==(geometry_format=='wkb' and wkb_encodable), f'{name} ({geometry_format})'
+
+        print(f'{name}: ok')
+
+
+def check_migration():
+
+    db_dir = tempfile.mkdtemp()
+    db_file = f'{db_dir}/fusion_database.db'
+
+    slide_id = 'slide'*4 + '0000'
+    layer_id = 'a'*24
+    baseline_connection = sqlite3.connect(db_file)
+    baseline_connection.executescript(BASELINE_SCHEMA)
+    baseline_connection.execute("INSERT INTO item (id, name, public, item_type) VALUES (?, 'baseline_slide', 1, 'local_item')", (slide_id,))
+    baseline_connection.execute('INSERT INTO local_item (id) VALUES (?)', (slide_id,))
+    baseline_connection.execute("INSERT INTO layer (id, name, item) VALUES (?, 'Baseline', ?)", (layer_id, slide_id))
+    baseline_structures = {}
+    for s_idx, (name, (geom, wkb_encodable)) in enumerate(TEST_GEOMETRIES.items()):
+        structure_id = f'{s_idx:024d}'
+        baseline_structures[structure_id] = geom
+        baseline_connection.execute(
+            'INSERT INTO structure (id, geom, properties, layer, item) VALUES (?, ?, ?, ?, ?)',
+            (structure_id, json.dumps(geom), json.dumps({'name': name, 'index': s_idx}), layer_id, slide_id)
+        )
+    baseline_connection.commit()
+    baseline_connection.close()
+
+    database = fusionDB(
+        db_url = f'sqlite:///{db_file}',
+        echo = False
+    )
+
+    structure_columns = [c.get('name') for c in inspect(database.engine).get_columns('structure')]
+    assert all([c in structure_columns for c in ['minx','miny','maxx','maxy','centroid_x','centroid_y']])
+    assert 'source_hash' in [c.get('name') for c in inspect(database.engine).get_columns('item')]
+    assert 'guest' in [c.get('name') for c in inspect(database.engine).get_columns('user')]
+
+    # Bounds are filled in for every existing structure
+    with database.get_db() as session:
+        structure_rows = session.execute(select(Structure.id, Structure.geom, Structure.minx, Structure.miny, Structure.maxx, Structure.maxy)).all()
+    for s_id, s_geom, *s_bounds in structure_rows:
+        assert json.dumps(s_geom)==json.dumps(baseline_structures[s_id])
+        assert tuple(s_bounds)==shape(s_geom).bounds, f'{s_id}: {s_bounds}'
+
+    bbox_ids = database.get_structures_in_bbox([4,4,7,7], item_id = slide_id)
+    expected_ids = [s_id for s_id, g in baseline_structures.items() if shape(g).intersects(shape({'type': 'Polygon', 'coordinates': [[[4,4],[7,4],[7,7],[4,7],[4,4]]]}))]
+    print(f'structures in bbox: {len(bbox_ids)}')
+    assert sorted(bbox_ids)==sorted(expected_ids)
+
+    # Property catalog and property store are built for the existing layer
+    catalog = {p['title']: p for p in database.get_structure_property_keys(item_id = slide_id)}
+    assert catalog['index']['count']==len(TEST_GEOMETRIES)
+    property_data = database.get_structure_property_data(item_id = slide_id, property_list = ['index'])
+    assert sorted([p['index'] for p in property_data])==list(range(len(TEST_GEOMETRIES)))
+
+    # Converting stored geometries to WKB
+    database = fusionDB(
+        db_url = f'sqlite:///{db_file}',
+        echo = False,
+        geometry_format = 'wkb'
+    )
+    database.migrate_structures(convert_geometry = True)
+    with database.get_db() as session:
+        encoded_rows = dict(session.execute(select(Structure.id, type_coerce(Structure.geom, LargeBinary))).all())
+    for s_idx, (name, (geom, wkb_encodable)) in enumerate(TEST_GEOMETRIES.items()):
+        encoded = bytes(encoded_rows[f'{s_idx:024d}'])
+        assert (encoded[:1] in [WKB_FLOAT_PREFIX,WKB_INT_PREFIX])==wkb_encodable, name
+        assert json.dumps(decode_geometry(encoded))==json.dumps(geom), name
+
+    assert sorted(database.get_structures_in_bbox([4,4,7,7], item_id = slide_id))==sorted(expected_ids)
+
+
+def main():
+    check_round_trip()
+    check_migration()
+
+
+if __name__=='__main__':
+    main()
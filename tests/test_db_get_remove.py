@@ -0,0 +1,110 @@
+"""
+
+Testing that fusionDB.get_remove only removes items/layers owned by the given user/session and keeps items ingested from local sources
+
+"""
+
+import os
+import sys
+sys.path.append('./src/')
+
+import uuid
+import tempfile
+
+from fusion_tools.database.database import fusionDB
+
+
+def add_session(database, name):
+    user = {'id': f'{name}user'.ljust(24,'a'), 'login': name, 'firstName': name, 'lastName': 'User', 'token': f'{name}token'.ljust(24,'b')}
+    session = {'id': f'{name}session'.ljust(24,'c'), 'data': {}}
+    database.add_vis_session({'user': user, 'session': session, 'data': {}})
+    return user['id'], session['id']
+
+
+def add_slide(database, slide_id, item_type = 'remote_item', vis_session_id = None, user_id = None, public = False, source_hash = None):
+    database.add_slide(
+        slide_id = slide_id,
+        slide_name = f'{slide_id}.tif',
+        item_type = item_type,
+        metadata = {},
+        image_metadata = {},
+        image_filepath = None,
+        annotations_metadata = [],
+        annotations = [{
+            'type': 'FeatureCollection',
+            'properties': {'name': 'Layer', '_id': uuid.uuid4().hex[:24]},
+            'features': [{
+                'type': 'Feature',
+                'geometry': {'type': 'Polygon', 'coordinates': [[[0,0],[1,0],[1,1],[0,0]]]},
+                'properties': {'_id': uuid.uuid4().hex[:24], 'name': 'Layer'}
+            }]
+        }],
+        vis_session_id = vis_session_id,
+        user_id = user_id,
+        public = public,
+        source_hash = source_hash
+    )
+
+
+def item_exists(database, slide_id):
+    return not database.get_item_info(slide_id) is None
+
+
+def main():
+
+    db_dir = tempfile.mkdtemp()
+    database = fusionDB(
+        db_url = f'sqlite:///{db_dir}/fusion_database.db',
+        echo = False
+    )
+
+    user_a, session_a = add_session(database, 'a')
+    user_b, session_b = add_session(database, 'b')
+
+    # Local slide ingested at startup, later viewed (and cached) in a session
+    local_slide = 'local'*4 + '0000'
+    add_slide(database, local_slide, item_type = 'local_item', vis_session_id = session_a, public = True, source_hash = uuid.uuid4().hex)
+    # Slides cached for user a's session, private and public
+    private_slide = 'prvte'*4 + '0000'
+    add_slide(database, private_slide, vis_session_id = session_a, user_id = user_a)
+    public_slide = 'pblic'*4 + '0000'
+    add_slide(database, public_slide, vis_session_id = session_a, user_id = user_a, public = True)
+    # Private slide user a has access to outside of a session
+    access_slide = 'acces'*4 + '0000'
+    add_slide(database, access_slide, user_id = user_a)
+
+    # Other users/sessions can't remove these items
+    for slide_id in [local_slide, private_slide, public_slide, access_slide]:
+        assert database.get_remove('item', slide_id, user_id = user_b, vis_session_id = session_b)==0
+        assert database.get_remove('item', slide_id, user_id = user_b)==0
+        assert item_exists(database, slide_id)
+
+    assert database.get_remove('item', public_slide, user_id = user_a, vis_session_id = session_b)==0
+    assert database.get_remove('user', user_a, user_id = user_b)==0
+
+    # Session cleanup (SlideMap without caching) keeps local slides
+    assert database.get_remove('item', local_slide, user_id = user_a, vis_session_id = session_a)==0
+    assert item_exists(database, local_slide)
+
+    assert database.get_remove('item', private_slide, user_id = user_a, vis_session_id = session_a)==1
+    assert database.get_remove('item', public_slide, user_id = user_a, vis_session_id = session_a)==1
+    assert database.get_remove('item', access_slide, user_id = user_a)==1
+    for slide_id in [private_slide, public_slide, access_slide]:
+        assert not item_exists(database, slide_id)
+
+    # Layers are owned through their item
+    layer_slide = 'layer'*4 + '0000'
+    add_slide(database, layer_slide, vis_session_id = session_a, user_id = user_a)
+    layer_ids = [l['id'] for l in database.search(search_kwargs = {'type': 'layer', 'filters': {'item': {'id': layer_slide}}})]
+    print(f'layers: {layer_ids}')
+    assert len(layer_ids)==1
+    assert database.get_remove('layer', layer_ids[0], user_id = user_b, vis_session_id = session_b)==0
+    assert database.get_remove('layer', layer_ids[0], user_id = user_a, vis_session_id = session_a)==1
+
+    # Without an owner, anything can be removed
+    assert database.get_remove('item', local_slide)==1
+    assert not item_exists(database, local_slide)
+
+
+if __name__=='__main__':
+    main()
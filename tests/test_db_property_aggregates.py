@@ -0,0 +1,121 @@
+"""
+
+Testing property aggregation (stats, histograms, and value counts) from the property store and from SQL
+
+"""
+
+import os
+import sys
+sys.path.append('./src/')
+
+import uuid
+import tempfile
+import numpy as np
+import pandas as pd
+
+from fusion_tools.database.database import fusionDB
+
+
+def check_aggregates(database, item_ids, annotations):
+
+    features = pd.DataFrame.from_records([
+        f['properties'] | {'minx': f['geometry']['coordinates'][0][0][0], 'item': i_id, 'layer': a['properties']['name']}
+        for i_id, i_anns in zip(item_ids, annotations) for a in i_anns for f in a['features']
+    ])
+
+    stats = database.get_property_stats(['area','label','counts --> y'], item_id = item_ids)
+    assert stats['area']['count']==len(features)
+    assert stats['area']['min']==features['area'].min() and stats['area']['max']==features['area'].max()
+    assert abs(stats['area']['mean']-features['area'].mean())<1e-6
+    assert stats['label']['count']==len(features) and stats['label']['mean'] is None
+    assert stats['counts --> y']['max']==max([2*i for i in range(100)])
+    # Integer properties have float min/max whether they are read from the property store or SQL
+    assert type(stats['counts --> y']['min'])==float and type(stats['counts --> y']['max'])==float
+
+    bbox_stats = database.get_property_stats('area', item_id = item_ids, bbox = [0,0,10.5,10.5])
+    assert bbox_stats['area']['count']==len(features[features['minx']<=10.5])
+
+    grouped = database.get_property_stats('area', item_id = item_ids, group_by = 'layer')
+    assert len(grouped)==sum([len(a) for a in annotations])
+    assert sum([g['area']['count'] for g in grouped])==len(features)
+
+    histogram = database.get_property_histogram('area', bins = 10, item_id = item_ids)
+    expected_counts, expected_edges = np.histogram(features['area'], bins = 10)
+    assert histogram['counts']==expected_counts.tolist()
+    assert np.allclose(histogram['edges'], expected_edges)
+
+    item_histograms = database.get_property_histogram('area', bins = 10, item_id = item_ids, group_by = 'item')
+    assert sum([sum(h['counts']) for h in item_histograms])==len(features)
+
+    counts = database.get_property_counts('label', item_id = item_ids)
+    expected = features['label'].value_counts().to_dict()
+    assert dict(zip(counts['values'],counts['counts']))==expected
+
+    return stats, histogram, counts
+
+
+def main():
+
+    item_ids = ['item'*6, 'meti'*6]
+    # Item, layer name, number of structures, area offset
+    layer_list = [
+        (item_ids[0], 'Layer 0', 100, 0),
+        (item_ids[0], 'Layer 1', 50, 1000),
+        (item_ids[1], 'Layer 0', 75, -20)
+    ]
+    annotations = [
+        [
+            {
+                'type': 'FeatureCollection',
+                'properties': {'name': name, '_id': uuid.uuid4().hex[:24]},
+                'features': [
+                    {
+                        'type': 'Feature',
+                        'geometry': {'type': 'Polygon', 'coordinates': [[[i,i],[i+1,i],[i+1,i+1],[i,i]]]},
+                        'properties': {
+                            '_id': uuid.uuid4().hex[:24],
+                            'name': name,
+                            'area': float(i + offset),
+                            'label': ['a','b','c'][i%3],
+                            'counts': {'x': i%5, 'y': 2*i}
+                        }
+                    }
+                    for i in range(n_structures)
+                ]
+            }
+            for l_item, name, n_structures, offset in layer_list if l_item==i_id
+        ]
+        for i_id in item_ids
+    ]
+
+    results = []
+    for store in [True, False]:
+        db_dir = tempfile.mkdtemp()
+        database = fusionDB(
+            db_url = f'sqlite:///{db_dir}/fusion_database.db',
+            echo = False,
+            property_store_dir = None if store else os.path.join(db_dir,'no_store')
+        )
+        if not store:
+            # Forcing the SQL fallback
+            database.property_store = None
+
+        for i_id, i_anns in zip(item_ids, annotations):
+            database.get_create(
+                table_name = 'item',
+                inst_id = i_id,
+                kwargs = {
+                    'name': i_id,
+                    'public': True
+                }
+            )
+            database.add_layer(i_anns, i_id)
+
+        results.append(check_aggregates(database, item_ids, annotations))
+        print(f'property store: {store}, {results[-1][0]}')
+
+    assert results[0]==results[1]
+
+
+if __name__=='__main__':
+    main()
@@ -0,0 +1,114 @@
+"""
+
+Testing the number of queries used to load layers and annotations for an item
+
+"""
+
+import os
+import sys
+sys.path.append('./src/')
+
+import uuid
+import tempfile
+
+from sqlalchemy import event
+from fusion_tools.database.database import fusionDB
+
+
+class QueryCounter:
+    def __init__(self, engine):
+        self.engine = engine
+        self.count = 0
+
+    def callback(self, *args, **kwargs):
+        self.count += 1
+
+    def __enter__(self):
+        self.count = 0
+        event.listen(self.engine, 'before_cursor_execute', self.callback)
+        return self
+
+    def __exit__(self, *args):
+        event.remove(self.engine, 'before_cursor_execute', self.callback)
+
+
+def make_layer(n_structures, name):
+    return {
+        'type': 'FeatureCollection',
+        'properties': {
+            'name': name,
+            '_id': uuid.uuid4().hex[:24]
+        },
+        'features': [
+            {
+                'type': 'Feature',
+                'geometry': {
+                    'type': 'Polygon',
+                    'coordinates': [[[i,i],[i+1,i],[i+1,i+1],[i,i]]]
+                },
+                'properties': {
+                    '_id': uuid.uuid4().hex[:24],
+                    'name': name
+                }
+            }
+            for i in range(n_structures)
+        ]
+    }
+
+
+def main():
+
+    n_layers = 30
+    n_structures = 50
+    item_id = 'blah'*6
+
+    db_dir = tempfile.mkdtemp()
+    database = fusionDB(
+        db_url = f'sqlite:///{db_dir}/fusion_database.db',
+        echo = False
+    )
+
+    database.get_create(
+        table_name = 'item',
+        inst_id = item_id,
+        kwargs = {
+            'name': 'test_item',
+            'public': True
+        }
+    )
+    database.add_layer(
+        [make_layer(n_structures, f'Layer {i}') for i in range(n_layers)],
+        item_id
+    )
+
+    with QueryCounter(database.engine) as counter:
+        layers = database.get_layers(item_id)
+
+    print(f'get_layers: {counter.count} queries for {len(layers)} layers')
+    assert len(layers)==n_layers
+    assert all([len(l['features'])==n_structures for l in layers])
+    assert counter.count <= 2
+
+    with QueryCounter(database.engine) as counter:
+        annotations = database.get_item_annotations(item_id)
+
+    print(f'get_item_annotations: {counter.count} queries for {len(annotations)} layers')
+    assert len(annotations)==n_layers
+    assert counter.count <= 3
+
+    with QueryCounter(database.engine) as counter:
+        annotations = database.get_item_annotations(item_id, bbox = [0,0,10,10])
+
+    print(f'get_item_annotations (bbox): {counter.count} queries for {len(annotations)} layers')
+    assert len(annotations)==n_layers
+    assert counter.count <= 3
+
+    with QueryCounter(database.engine) as counter:
+        layer_counts = database.get_layer_counts(item_id)
+
+    assert all([l['structures']==n_structures for l in layer_counts])
+    assert counter.count == 1
+
+
+if __name__=='__main__':
+    main()
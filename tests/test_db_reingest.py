@@ -0,0 +1,136 @@
+"""
+
+Testing that re-ingesting a slide whose annotations changed replaces its layers (structures, property catalog, and property store)
+
+"""
+
+import os
+import sys
+sys.path.append('./src/')
+
+import uuid
+import tempfile
+
+from sqlalchemy import select, func
+from fusion_tools.database.database import fusionDB
+from fusion_tools.database.models import Structure, Layer
+
+
+def add_slide(database, slide_id, layers):
+    return database.add_slide(
+        slide_id = slide_id,
+        slide_name = 'test_slide',
+        item_type = 'local_item',
+        metadata = {},
+        image_metadata = {},
+        image_filepath = None,
+        annotations_metadata = [],
+        annotations = [
+            {
+                'type': 'FeatureCollection',
+                'properties': {'name': name, '_id': layer_id},
+                'features': [
+                    {
+                        'type': 'Feature',
+                        'geometry': {'type': 'Polygon', 'coordinates': [[[i,i],[i+1,i],[i+1,i+1],[i,i]]]},
+                        # load_annotations gives every feature a new id each time a file is read
+                        'properties': {'_id': uuid.uuid4().hex[:24], 'name': name, 'area': i}
+                    }
+                    for i in range(n_features)
+                ]
+            }
+            for layer_id, name, n_features in layers
+        ],
+        public = True,
+        source_hash = uuid.uuid4().hex
+    )
+
+
+def main():
+
+    db_dir = tempfile.mkdtemp()
+    database = fusionDB(
+        db_url = f'sqlite:///{db_dir}/fusion_database.db',
+        echo = False
+    )
+
+    slide_id = 'slide'*4 + '0000'
+    kept_layer, removed_layer = 'a'*24, 'b'*24
+
+    add_slide(database, slide_id, [(kept_layer, 'Kept', 5), (removed_layer, 'Removed', 4)])
+    add_slide(database, slide_id, [(kept_layer, 'Kept', 3)])
+
+    with database.get_db() as session:
+        layer_ids = session.scalars(select(Layer.id).where(Layer.item==slide_id)).all()
+        n_structures = session.scalar(select(func.count(Structure.id)).where(Structure.layer==kept_layer))
+        n_removed = session.scalar(select(func.count(Structure.id)).where(Structure.layer==removed_layer))
+
+    print(f'layers: {layer_ids}, structures: {n_structures}')
+    assert layer_ids==[kept_layer]
+    assert n_structures==3 and n_removed==0
+
+    catalog = {p['title']: p for p in database.get_structure_property_keys(item_id = slide_id)}
+    assert catalog['area']['count']==3 and catalog['area']['max']==2
+
+    property_data = database.get_structure_property_data(item_id = slide_id, property_list = ['area'])
+    assert sorted([p['area'] for p in property_data])==[0,1,2]
+
+    if not database.property_store is None:
+        assert not database.property_store.has_layer(removed_layer)
+        assert len(database.property_store.read_layer(kept_layer, ['area'])['area'])==3
+
+    # Adding structures to an existing layer one at a time (non-bulk path) keeps the previous structures in the catalog
+    database.add_layer(
+        {
+            'type': 'FeatureCollection',
+            'properties': {'name': 'Kept', '_id': kept_layer},
+            'features': [{
+                'type': 'Feature',
+                'geometry': {'type': 'Polygon', 'coordinates': [[[10,10],[11,10],[11,11],[10,10]]]},
+                'properties': {'_id': uuid.uuid4().hex[:24], 'name': 'Kept', 'area': 10}
+            }]
+        },
+        item_id = slide_id,
+        bulk = False
+    )
+    catalog = {p['title']: p for p in database.get_structure_property_keys(item_id = slide_id)}
+    print(f'non-bulk catalog: {catalog["area"]}')
+    assert catalog['area']['count']==4 and catalog['area']['min']==0 and catalog['area']['max']==10
+
+    property_data = database.get_structure_property_data(item_id = slide_id, property_list = ['area'])
+    assert sorted([p['area'] for p in property_data])==[0,1,2,10]
+
+    # Adding the same annotations to another item doesn't move layers or structures off of the first item
+    shared_layer = 'c'*24
+    shared_annotations = {
+        'type': 'FeatureCollection',
+        'properties': {'name': 'Shared', '_id': shared_layer},
+        'features': [
+            {
+                'type': 'Feature',
+                'geometry': {'type': 'Polygon', 'coordinates': [[[i,i],[i+1,i],[i+1,i+1],[i,i]]]},
+                'properties': {'_id': uuid.uuid4().hex[:24], 'name': 'Shared', 'area': i}
+            }
+            for i in range(6)
+        ]
+    }
+    shared_ids = ['share'*4 + '0000', 'share'*4 + '0001']
+    for s_id in shared_ids:
+        database.get_create(
+            table_name = 'item',
+            inst_id = s_id,
+            kwargs = {'name': s_id, 'public': True}
+        )
+        database.add_layer(shared_annotations, s_id)
+
+    with database.get_db() as session:
+        shared_layers = [session.scalars(select(Layer.id).where(Layer.item==s_id)).all() for s_id in shared_ids]
+        shared_structures = [session.scalar(select(func.count(Structure.id)).where(Structure.item==s_id)) for s_id in shared_ids]
+
+    print(f'shared layers: {shared_layers}, structures: {shared_structures}')
+    assert shared_layers[0]==[shared_layer] and len(shared_layers[1])==1 and not shared_layers[1][0]==shared_layer
+    assert shared_structures==[6,6]
+
+
+if __name__=='__main__':
+    main()
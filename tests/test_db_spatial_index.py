@@ -0,0 +1,104 @@
+"""
+
+Testing that bounding box queries use the R*Tree spatial index (SQLite) and return the same structures as checking every structure
+
+"""
+
+import os
+import sys
+sys.path.append('./src/')
+
+import uuid
+import tempfile
+
+from sqlalchemy import select, text
+from shapely.geometry import box, shape
+from fusion_tools.database.database import fusionDB
+from fusion_tools.database.models import Structure
+
+
+def grid_layer(layer_id, name, n_side, offset):
+    return {
+        'type': 'FeatureCollection',
+        'properties': {'name': name, '_id': layer_id},
+        'features': [
+            {
+                'type': 'Feature',
+                'geometry': {'type': 'Polygon', 'coordinates': [[[x+offset,y+offset],[x+offset+0.8,y+offset],[x+offset+0.8,y+offset+0.8],[x+offset,y+offset]]]},
+                'properties': {'_id': uuid.uuid4().hex[:24], 'name': name}
+            }
+            for x in range(n_side) for y in range(n_side)
+        ]
+    }
+
+
+def check_bbox(database, slide_id, bbox):
+    indexed_ids = sorted(database.get_structures_in_bbox(bbox, item_id = slide_id))
+
+    with database.get_db() as session:
+        all_structures = session.execute(select(Structure.id, Structure.geom).where(Structure.item==slide_id)).all()
+    expected_ids = sorted([i for i,g in all_structures if shape(g).intersects(box(*bbox))])
+
+    print(f'bbox: {bbox}, structures: {len(indexed_ids)}')
+    assert indexed_ids==expected_ids
+
+
+def main():
+
+    db_dir = tempfile.mkdtemp()
+    database = fusionDB(
+        db_url = f'sqlite:///{db_dir}/fusion_database.db',
+        echo = False
+    )
+    if not database.spatial_index:
+        print('SQLite R*Tree module not available, skipping')
+        return
+
+    slide_id = 'slide'*4 + '0000'
+    database.add_slide(
+        slide_id = slide_id,
+        slide_name = 'test_slide',
+        item_type = 'local_item',
+        metadata = {},
+        image_metadata = {},
+        image_filepath = None,
+        annotations_metadata = [],
+        annotations = [grid_layer('a'*24, 'Grid', 40, 0), grid_layer('b'*24, 'Shifted', 40, 0.5)],
+        public = True,
+        source_hash = uuid.uuid4().hex
+    )
+
+    # Candidate structures come from the R*Tree instead of scanning every structure in the layer
+    with database.engine.connect() as connection:
+        bbox_query = select(Structure.id).where(Structure.layer=='a'*24, database.structure_bbox_filter([10,10,12,12]))
+        query_plan = connection.execute(
+            text(f'EXPLAIN QUERY PLAN {bbox_query.compile(database.engine, compile_kwargs = {"literal_binds": True})}')
+        ).all()
+    print('\n'.join([p[-1] for p in query_plan]))
+    assert any(['structure_rtree' in p[-1] and 'VIRTUAL TABLE INDEX' in p[-1] for p in query_plan])
+    assert any(['SEARCH structure USING INTEGER PRIMARY KEY' in p[-1] for p in query_plan])
+
+    for bbox in [[10,10,12,12],[0,0,1,1],[-5,-5,-1,-1],[39.5,39.5,50,50],[0.85,0.85,0.9,0.9]]:
+        check_bbox(database, slide_id, bbox)
+
+    # Removing a layer removes its structures from the index
+    database.delete_layers(['b'*24])
+    check_bbox(database, slide_id, [10,10,12,12])
+    with database.engine.connect() as connection:
+        assert connection.execute(text('SELECT count(*) FROM structure_rtree')).scalar()==40*40
+
+    # Structure rowids can change after a full VACUUM, the index is rebuilt
+    database.compact(full = True)
+    check_bbox(database, slide_id, [10,10,12,12])
+
+    # Re-opening the database re-uses the existing index
+    database = fusionDB(
+        db_url = f'sqlite:///{db_dir}/fusion_database.db',
+        echo = False
+    )
+    assert database.spatial_index
+    check_bbox(database, slide_id, [20,5,22.5,7])
+
+
+if __name__=='__main__':
+    main()
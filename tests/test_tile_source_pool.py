@@ -0,0 +1,50 @@
+"""
+
+Testing that TileSourcePool closes replaced sources and doesn't close sources which are still leased
+
+"""
+
+import os
+import sys
+sys.path.append('./src/')
+
+from fusion_tools import tileserver
+from fusion_tools.tileserver import TileSourcePool
+
+
+class FakeTileSource:
+    def __init__(self, path, style = None):
+        self.path = path
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+def main():
+
+    tileserver.large_image.open = FakeTileSource
+
+    pool = TileSourcePool(max_size = 1, max_idle = None)
+
+    # Changing an item's filepath closes the previous source
+    first_source = pool.get('item'*6, 'first.tif')
+    second_source = pool.get('item'*6, 'second.tif')
+    assert first_source.closed and not second_source.closed
+    assert pool.stats()['size']==1
+
+    # Sources evicted while leased are closed once the lease is released
+    with pool.lease('item'*6, 'second.tif') as leased_source:
+        assert leased_source is second_source
+        pool.get('meti'*6, 'third.tif')
+        assert not leased_source.closed
+
+    assert leased_source.closed
+    assert pool.stats()['size']==1
+
+    pool.clear()
+    assert pool.stats()['size']==0
+
+
+if __name__=='__main__':
+    main()